@@ -9,8 +9,13 @@
 #               eeg_data_channel_4,eeg_data_channel_3,eeg_data_channel_2,
 #               eeg_data_channel_1,eeg_data_channel_0};
 
+import os, sys, argparse
 import numpy
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))  # the GUI's modules, for its recording format
+import guiRecording
+import guiSettings
+
 
 
 def extract_from_raw_line(raw_data):
@@ -43,3 +48,120 @@ def extract_from_raw_line(raw_data):
     else:
         return raw_data
 
+
+# Bulk path for whole log files, for logs too long to go through extract_from_raw_line one line at a time
+# The file is read as bytes and the hex digits of every well formed line become one row of a uint8 matrix in one step, the fields are then
+# cut out of all rows at once and written straight to the GUI's binary recording format (see src/guiRecording.py)
+#
+# Lines are the packet above written out most significant digit first, 2 hex digits per byte, the same bytes mac_emulator.py sends:
+#   [0:2] packet id, then channels 7 down to 0 at 16 digits each from digit 2, each the big endian word
+#   {eeg[23:0], i[15:0], q[15:0], edo[7:0]}, the last 6 digits [130:136] aren't part of the packet and are ignored
+# (extract_from_raw_line slices each channel in the opposite order, edo first, and one digit short of each field's width)
+# eeg, i and q are two's complement like the GUI decodes them, packet id and edo are unsigned
+
+line_length = 136
+num_channels = 8
+channel_bytes = 8
+
+# A packet with a different value in every field, checked before converting so a layout mistake can't silently fill recordings
+# Packet id 0x85, channel n has eeg -(n + 1), i n + 16, q -(n + 32) and edo 0x40 + n
+known_line = b"85FFFFF80017FFD947FFFFF90016FFDA46FFFFFA0015FFDB45FFFFFB0014FFDC44FFFFFC0013FFDD43FFFFFD0012FFDE42FFFFFE0011FFDF41FFFFFF0010FFE040000000"
+known_fields = [[0x85], [[0x40 + n for n in range(8)]], [[-(n + 32) for n in range(8)]], [[n + 16 for n in range(8)]], [[-(n + 1) for n in range(8)]]]
+
+# Value of every hex digit's byte, 255 for bytes that aren't one
+hex_values = numpy.full(256, 255, dtype=numpy.uint8)
+hex_values[numpy.frombuffer(b"0123456789", dtype=numpy.uint8)] = numpy.arange(10)
+hex_values[numpy.frombuffer(b"abcdef", dtype=numpy.uint8)] = numpy.arange(10, 16)
+hex_values[numpy.frombuffer(b"ABCDEF", dtype=numpy.uint8)] = numpy.arange(10, 16)
+
+
+# Returns (packets, line numbers of the malformed lines) for the raw bytes of a log, line numbers start at 1 like an editor's
+# packets is a uint8 matrix with the line_length // 2 bytes of one well formed line per row
+# Empty lines are skipped, any other line that isn't exactly line_length hex digits (before its \n or \r\n) is malformed
+def hex_lines_to_bytes(raw):
+    data = numpy.frombuffer(raw, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(data == ord("\n"))
+    if len(data) and data[-1] != ord("\n"):
+        ends = numpy.append(ends, len(data))  # last line has no newline
+    starts = numpy.concatenate(([0], ends[:-1] + 1)).astype(ends.dtype)
+    lengths = ends - starts
+    lengths -= (lengths > 0) & (data[numpy.maximum(ends - 1, 0)] == ord("\r"))
+    line_numbers = numpy.arange(1, len(starts) + 1)
+
+    sized = lengths == line_length
+    malformed = (lengths != 0) & ~sized
+
+    # Marks the digits of every line of the right length and takes them all at once, without an index per digit
+    marks = numpy.zeros(len(data) + 1, dtype=numpy.int8)
+    marks[starts[sized]] = 1
+    marks[starts[sized] + line_length] = -1
+    digits = hex_values[data[numpy.cumsum(marks[:-1], dtype=numpy.int8).view(bool)]].reshape(-1, line_length)
+
+    bad_digits = (digits == 255).any(axis=1)
+    malformed[numpy.flatnonzero(sized)[bad_digits]] = True
+    digits = digits[~bad_digits]
+    packets = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    return packets, line_numbers[malformed]
+
+
+# Returns the fields of every packet as (packet_id, edo, q, i, eeg), packet_id shaped (packets,) and the rest (packets, channels) from ch0 up
+def extract_fields(packets):
+    channels = packets[:, 1:1 + num_channels * channel_bytes].reshape(-1, num_channels, channel_bytes)[:, ::-1].astype(numpy.int32)
+    packet_id = packets[:, 0].astype(numpy.int32)
+    eeg = (channels[:, :, 0] << 16) | (channels[:, :, 1] << 8) | channels[:, :, 2]
+    i = (channels[:, :, 3] << 8) | channels[:, :, 4]
+    q = (channels[:, :, 5] << 8) | channels[:, :, 6]
+    edo = channels[:, :, 7]
+    q[q >= 1 << 15] -= 1 << 16
+    i[i >= 1 << 15] -= 1 << 16
+    eeg[eeg >= 1 << 23] -= 1 << 24
+    return packet_id, edo, q, i, eeg
+
+
+# Converts a whole log to a binary recording at bin_filename, and its edo values (which recordings have no column for) to a
+# (packets, channels) uint8 array saved as <bin_filename without .bin>-edo.npy
+# The log has no times, so the recording is taken to have ended when the log was last modified
+# Returns (packets written, line numbers of the malformed lines), malformed lines are left out of the recording rather than passed through
+def extract_from_raw_file(log_filename, bin_filename, sample_rate=guiSettings.sampleRate):
+    with open(log_filename, "rb") as log_file:
+        raw = log_file.read()
+    packets, malformed = hex_lines_to_bytes(raw)
+    packet_id, edo, q, i, eeg = extract_fields(packets)
+
+    rows = numpy.empty((len(packets), 1 + 3 * num_channels), dtype=numpy.int32)  # saved data order, packet_id, chx0_eeg, chx0_i, chx0_q, chx1_eeg, ...
+    rows[:, 0] = packet_id
+    rows[:, 1::3] = eeg
+    rows[:, 2::3] = i
+    rows[:, 3::3] = q
+
+    start_time = os.path.getmtime(log_filename) - len(rows) / sample_rate
+    recording_writer = guiRecording.RecordingWriter(bin_filename, num_channels, sample_rate, start_time)
+    recording_writer.writeRows(rows)
+    recording_writer.close()
+    recording_writer.savePyramids()
+    numpy.save(os.path.splitext(bin_filename)[0] + "-edo.npy", edo.astype(numpy.uint8))
+    return len(rows), malformed
+
+
+# Run with 'python extract_data.py chip_log.txt', writes chip_log.bin next to it
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert hex packet logs to binary recordings the GUI's tools can read")
+    parser.add_argument("logs", nargs="+", help="Log files, one " + str(line_length) + " digit hex packet per line")
+    parser.add_argument("-r", "--sample-rate", type=float, default=guiSettings.sampleRate, help="Packets per second the log was taken at")
+    args = parser.parse_args()
+
+    if [fields.tolist() for fields in extract_fields(hex_lines_to_bytes(known_line)[0])] != known_fields:
+        sys.exit("The known packet decoded wrongly, the log layout in extract_fields needs fixing before converting anything")
+
+    failed = False
+    for log_filename in args.logs:
+        bin_filename = os.path.splitext(log_filename)[0] + ".bin"
+        if os.path.exists(bin_filename):
+            print(log_filename + ": skipped, " + bin_filename + " already exists")
+            continue
+        num_packets, malformed = extract_from_raw_file(log_filename, bin_filename, args.sample_rate)
+        print(log_filename + ": " + str(num_packets) + " packets written to " + bin_filename)
+        if len(malformed):
+            print(log_filename + ": " + str(len(malformed)) + " malformed lines left out, lines " + ", ".join(map(str, malformed[:10])) + (" ..." if len(malformed) > 10 else ""))
+            failed = True
+    sys.exit(1 if failed else 0)
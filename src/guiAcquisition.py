@@ -0,0 +1,398 @@
+import os, re, atexit, tempfile
+import serial
+import multiprocessing as mp
+import numpy as np
+from queue import Empty, Full
+from time import sleep, monotonic, perf_counter
+
+# Everything the SerialReader process needs, kept apart from the Qt recording widgets in guiData so that process doesn't import Qt
+
+# Returns why a command for the chip is malformed, or None if it can be sent, shared by the GUI's command box and the headless runner
+def commandFormatError(text):
+
+    if re.search(r"^read reg", text) and not re.search(r"^read reg [0-9]{2}$", text):
+        return "Must follow format `read reg xx` where xx is 00-99"
+    if re.search(r"^write reg", text) and not re.search(r"^write reg [0-9]{2} [0-9a-f]{4}$", text):
+        return "Must follow format `write reg xx yyyy` where xx is 00-99 and yyyy is 0000-ffff"
+    return None
+
+# The SerialReader class handles sending/receiving data to/from the usb dongle over pyserial
+class SerialReader():
+
+    def __init__(self, port, numChannels, latestSnapshot, rawRingBuffer, saveDataQueue, connectionPipe, commandWriterPipe, commandResponsePipe):
+
+        self.serialGUISide = None
+        self.port = port
+        self.numChannels = numChannels
+        self.latestSnapshot = latestSnapshot
+        self.rawRingBuffer = rawRingBuffer
+        self.saveDataQueue = saveDataQueue
+        self.connectionPipe = connectionPipe
+        self.commandWriterPipe = commandWriterPipe
+        self.commandResponsePipe = commandResponsePipe
+
+        self.refreshRate = 10 # Refresh rate in ms, only used when in command mode
+        self.commandMode = True # Controls whether serialReader is looking for data or command responses, always starts in command mode
+        self.packetCount = 0
+
+    # Waits for serial port connection and, once established, starts a loop to read data from and write commands to the pyserial connection
+    def startSerialReader(self):
+
+        while not self.serialGUISide: # This waits for a device at the given port to be connected
+            sleep(0.1) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+            try:
+                # Connection is in startSerialReader in order to work with multiprocessing
+                # self.serialGUISide = serial.Serial(self.port, 9600, rtscts=True, dsrdtr=True) # Uncomment for emulator
+                self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True) # Creates connection with specified port, baud doesn't actually matter
+            except:
+                pass
+
+        self.connectionPipe.send(1) # Callback to notify main loop that device is connected
+        print("Writing stop to chip")
+        # Stop is written to stop any data already streaming (in case of a malfunction), written three times as the first command sometimes doesn't get through
+        self.serialGUISide.write(("stop" + " \n").encode())
+        self.serialGUISide.write(("stop" + " \n").encode())
+        self.serialGUISide.write(("stop" + " \n").encode())
+
+        while True:
+            self.updateData() # Data read in happens here
+            if self.commandWriterPipe.poll(): # Checks if there is a command to write to the chip
+                command = self.commandWriterPipe.recv().strip() # Gets command and removes any extra whitespace 
+                print("Writing " + command + " to chip")
+                self.serialGUISide.write((command + " \n").encode()) # Space has to be added for chip parsing
+                if command == "start":
+                    self.commandMode = False # Data read will now expect eeg data to be streaming
+                elif command == "stop":
+                    self.commandMode = True # Data read will only expect responses to commands
+                    self.commandResponsePipe.send(f"Received {self.packetCount} packets")
+                    self.packetCount = 0
+                    # Waits for eeg data to finish arriving and throws it away, old usage, should be included if pyserial reset is removed
+                    # sleep(0.5) 
+                    # self.serialGUISide.reset_input_buffer()
+                    self.resetPyserial() # Issues appear on stop, pyserial reset fixes them
+                elif command == "pyserialReset": 
+                   self.resetPyserial()
+
+    # Works to reset the pyserial connection with the USB, fixes many connection issues
+    def resetPyserial(self):
+
+        # Closes and recreates connection and then throws away any remaining data in buffers
+        self.serialGUISide.close()
+        self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True)
+        self.serialGUISide.reset_output_buffer()
+        self.serialGUISide.reset_input_buffer()
+
+        # Checks new connections is successful by writing 'single' command and looking for response
+        self.serialGUISide.write(("single \n").encode()) 
+        print("Connection reset, writing single to chip and looking for response")
+        sleep(0.1)
+
+        if self.serialGUISide.in_waiting == 0: # If no response is found it tries resetting the connection again
+            print("No response, resetting again")
+            self.serialGUISide.close()
+            self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True)
+            self.serialGUISide.reset_output_buffer()
+            self.serialGUISide.reset_input_buffer()
+            self.serialGUISide.write(("single \n").encode())
+            print("Connection reset, writing single to chip and looking for response")
+            sleep(0.1)
+
+            if self.serialGUISide.in_waiting == 0: # Gives up after two attempts, can retry by clicking button again
+                print("No response, connection reestablishment failure")
+
+        if self.serialGUISide.in_waiting > 0: # If a response is found, the reset has succeeded and the response is thrown away
+            print("Response obtained, connection reestablishment success")
+            self.serialGUISide.reset_input_buffer()
+
+    # Handles all data reading from the pyserial port, saves eeg data so it can be accessed by the rest of the GUI
+    def updateData(self):
+
+        if self.commandMode: # Indicates GUI is not expecting eeg data to be streaming, just command responses
+            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+            if self.serialGUISide.in_waiting > 0: # If data exists to be read
+                sleep(0.1) # Make sure full response is transmitted
+                val = b''
+                val += self.serialGUISide.read(self.serialGUISide.in_waiting) # Reads all data from the USB dongle
+                # Currently reponses are handled in hex as that is how the chip sends them, text responses can be decoded with code below
+                print("Chip response: " + str(val.hex()))
+                self.commandResponsePipe.send("Chip: " + str(val.hex()))
+                # print("Chip response: " + val.decode())
+                # self.commandResponsePipe.send("Chip: " + val.decode())
+                
+
+        elif self.serialGUISide.in_waiting > 0: # If data exists to be read
+            if self.serialGUISide.in_waiting < 6: #TODO
+                self.serialGUISide.reset_input_buffer()
+
+            val = b''
+            val += self.serialGUISide.read(65) # Reads one packet of eeg data which is always exactly 65 bytes long
+            self.packetCount += 1
+
+            packetId = int.from_bytes(val[:1], "big") # Extracts packet id from first byte
+            
+            saveData = [packetId]
+
+            for i in range(1, len(val) - 1, self.numChannels):
+                # Decodes one channel (eight bytes) at a time from the packet
+                chxEEG = int.from_bytes(val[i:i+4], "big", signed=True)
+                chxI = int.from_bytes(val[i+4:i+6], "big", signed=True)
+                chxQ = int.from_bytes(val[i+6:i+8], "big", signed=True)
+
+                saveData.extend((chxEEG, chxI, chxQ)) # Data is added here to be saved later
+
+            self.latestSnapshot.write(packetId, saveData[1:]) # Every channel's newest value is published at once, without taking a lock
+            sampleIndex = self.rawRingBuffer.write(packetId, saveData[1:]) # Keeps recent history so graphs can be filled as soon as they're selected
+            
+            self.saveDataQueue.put((sampleIndex, saveData)) # The full packet of data is sent to be saved by the SaveDataWriter (a SaveQueue), the index lets events be aligned with it
+
+# The newest packet of every channel in one shared block, for consumers that only need the latest values (graphs, meters, readouts)
+# Guarded by a sequence counter rather than a lock (a seqlock): the SerialReader, the only writer, makes the counter odd before writing and
+# even again after, readers copy the block and retry if the counter was odd or changed while they copied, so the writer never waits for a
+# reader and a reader never sees half of one packet and half of another
+class LatestSnapshot():
+
+    def __init__(self, numChannels):
+
+        self.numChannels = numChannels
+        self.sequence = mp.RawValue('q', 0) # Odd while a packet is being written
+        self.block = mp.RawArray('i', 1 + numChannels * 3) # Packet id then chx0 eeg, i, q, chx1 eeg, i, q, ... same as the saved data
+
+    # Publishes one packet, values is the packet's data in the saved data order (without the packet id), only called by the SerialReader
+    def write(self, packetId, values):
+
+        self.sequence.value += 1
+        self.block[0] = packetId
+        self.block[1:] = values
+        self.sequence.value += 1
+
+    # Returns (packetId, values) of the newest packet, values laid out the same as write's
+    def read(self):
+
+        while True:
+            before = self.sequence.value
+            if before % 2 == 0:
+                block = self.block[:]
+                if self.sequence.value == before:
+                    return block[0], block[1:]
+            sleep(0) # Torn read, lets the writer finish before trying again
+
+    # Returns (packetId, eeg, i, q) of one channel from the newest packet
+    def readChannel(self, channelIdx):
+
+        packetId, values = self.read()
+        return (packetId,) + tuple(values[channelIdx * 3:channelIdx * 3 + 3])
+
+# Shared memory ring of the last 'capacity' raw packets for all channels, written by the SerialReader and readable from any process
+# Unlike LatestSnapshot this keeps history, so consumers that start late (e.g. a graph that was just selected) can catch up
+class RawRingBuffer():
+
+    def __init__(self, numChannels, capacity):
+
+        self.numChannels = numChannels
+        self.capacity = capacity
+        self.packetIds = mp.RawArray('B', capacity)
+        self.samples = mp.RawArray('i', capacity * numChannels * 3) # Per packet: chx0 eeg, i, q, chx1 eeg, i, q, ... same as the saved data
+        self.numWritten = mp.Value('q', 0) # Total packets ever written, also the acquisition index of the next packet
+        self.lastWriteTime = mp.Value('d', 0) # Monotonic time the newest packet arrived, used to map times to acquisition indices
+
+    # Adds one packet, values is the packet's data in the saved data order (without the packet id), returns the packet's acquisition index
+    def write(self, packetId, values):
+
+        sampleIndex = self.numWritten.value
+        idx = sampleIndex % self.capacity
+        rowLen = self.numChannels * 3
+        self.packetIds[idx] = packetId
+        self.samples[idx * rowLen:(idx + 1) * rowLen] = values
+        with self.numWritten.get_lock(): # Only incremented once the packet is fully written so readers never see a partial packet
+            self.lastWriteTime.value = monotonic()
+            self.numWritten.value += 1
+        return sampleIndex
+
+    # Acquisition index of the packet that arrived (or is expected to arrive) at monotonic time eventTime
+    def sampleIndexAt(self, eventTime, sampleRate):
+
+        with self.numWritten.get_lock():
+            newestIndex = self.numWritten.value - 1
+            newestTime = self.lastWriteTime.value
+        if newestIndex < 0:
+            return 0
+        return newestIndex + int(round((eventTime - newestTime) * sampleRate))
+
+    # Monotonic time the packet at acquisition index sampleIndex arrived (or is expected to arrive), the inverse of sampleIndexAt
+    def timeAt(self, sampleIndex, sampleRate):
+
+        with self.numWritten.get_lock():
+            newestIndex = self.numWritten.value - 1
+            newestTime = self.lastWriteTime.value
+        return newestTime + (sampleIndex - newestIndex) / sampleRate
+
+    # Returns (packetIds, samples) for the newest count packets (or fewer if not yet written), oldest first
+    # samples is shaped (packets, numChannels, 3) with the last axis being eeg, i, q
+    def readLatest(self, count):
+
+        numWritten = self.numWritten.value
+        count = min(count, numWritten, self.capacity - 1) # One slot is left as margin in case the writer is mid packet
+        return self.readRange(numWritten - count, count)
+
+    # Returns (packetIds, samples) for the count packets starting at acquisition index start, laid out the same as readLatest
+    # Returns None if some of them haven't arrived yet or have already been overwritten
+    def readRange(self, start, count):
+
+        numWritten = self.numWritten.value
+        if start < numWritten - (self.capacity - 1) or start + count > numWritten:
+            return None
+        packetIds = np.frombuffer(self.packetIds, dtype=np.uint8)
+        samples = np.frombuffer(self.samples, dtype=np.int32).reshape(self.capacity, self.numChannels, 3)
+
+        idx = np.arange(start, start + count) % self.capacity
+        return packetIds[idx], samples[idx]
+
+# Bounded handoff of full packets from the SerialReader to whatever records them (SaveDataWriter, HeadlessRecorder)
+# When the recorder falls behind and the queue fills, policy decides what happens to the next packet:
+#   "block"      the SerialReader waits for room, nothing is lost here but the serial port's own buffer may overflow while it waits
+#   "dropOldest" the oldest queued packet is thrown away to make room, the recording gets a gap
+#   "spill"      packets go to an append-only temporary file until the recorder has caught up, which reads them back in order
+# Every counter only ever has one writing process (the SerialReader or the recorder), so none of them need a lock
+class SaveQueue():
+
+    policies = ["block", "dropOldest", "spill"]
+
+    def __init__(self, capacity, numChannels, policy="spill"):
+
+        if policy not in self.policies:
+            raise ValueError("Save queue policy must be one of " + ", ".join(self.policies))
+        self.capacity = capacity
+        self.policy = policy
+        self.queue = mp.Queue(capacity)
+
+        # Written by the SerialReader
+        self.numPut = mp.RawValue('q', 0) # Packets handed to the queue (not counting spilled ones)
+        self.numDropped = mp.RawValue('q', 0) # Packets thrown away by dropOldest
+        self.maxDepth = mp.RawValue('q', 0)
+        self.numBlocked = mp.RawValue('q', 0) # Puts that had to wait for room
+        self.blockedSeconds = mp.RawValue('d', 0)
+        self.numSpilled = mp.RawValue('q', 0) # Packets ever written to the spill file
+        self.spillBase = mp.RawValue('q', 0) # numSpilled when the spill file was last emptied, the file's first record
+        # Written by the recorder
+        self.numTaken = mp.RawValue('q', 0)
+        self.numUnspilled = mp.RawValue('q', 0) # Spilled packets read back
+
+        # Spill records: acquisition index then the packet as saved (packet id, chx0 eeg, i, q, ...)
+        self.spillDtype = np.dtype([("sampleIndex", "<i8"), ("saveData", "<i4", (1 + numChannels * 3,))])
+        spillFile, self.spillFilename = tempfile.mkstemp(prefix="saveQueueSpill-", suffix=".bin")
+        os.close(spillFile)
+        atexit.register(self.removeSpillFile) # Only in the creating process, the others get a copy through pickling
+        self.spilling = False # Only used by the SerialReader
+        self.spillWriter = None # Opened in whichever process uses it, file handles don't survive pickling
+        self.spillReader = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state["spillWriter"] = None
+        state["spillReader"] = None
+        return state
+
+    # Packets queued and not yet taken, spilled ones not included
+    def depth(self):
+
+        return self.numPut.value - self.numTaken.value - self.numDropped.value
+
+    # Adds one (sampleIndex, saveData) packet, only called by the SerialReader
+    def put(self, item):
+
+        if self.policy == "spill":
+            if self.spilling and self.numUnspilled.value == self.numSpilled.value: # Recorder has caught up, the spill file can be emptied
+                self.spillWriter.truncate(0)
+                self.spillBase.value = self.numSpilled.value
+                self.spilling = False
+            if not self.spilling:
+                try:
+                    self.queue.put_nowait(item)
+                    self.putDone()
+                    return
+                except Full:
+                    self.spilling = True # Everything goes to the file from here until it's read back, so packets stay in order
+            self.spill(item)
+
+        elif self.policy == "dropOldest":
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    self.putDone()
+                    return
+                except Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.numDropped.value += 1
+                    except Empty: # The recorder took it first, there's room now
+                        pass
+
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                blockStart = perf_counter()
+                self.queue.put(item)
+                self.numBlocked.value += 1
+                self.blockedSeconds.value += perf_counter() - blockStart
+            self.putDone()
+
+    def putDone(self):
+
+        self.numPut.value += 1
+        self.maxDepth.value = max(self.maxDepth.value, self.depth())
+
+    def spill(self, item):
+
+        if self.spillWriter is None:
+            self.spillWriter = open(self.spillFilename, 'ab')
+        record = np.zeros(1, dtype=self.spillDtype)
+        record["sampleIndex"] = item[0]
+        record["saveData"] = item[1]
+        self.spillWriter.write(record.tobytes())
+        self.spillWriter.flush() # Must be readable before it's counted
+        self.numSpilled.value += 1
+
+    # Returns up to maxItems packets oldest first, waiting up to timeout seconds for the first, only called by the recorder
+    # Spilled packets are only read back once everything queued before them has been taken
+    def getBatch(self, maxItems, timeout=0):
+
+        items = []
+        if self.numSpilled.value > self.numUnspilled.value:
+            timeout = 0 # Spilled packets are already waiting
+        while len(items) < maxItems:
+            try:
+                items.append(self.queue.get(timeout=timeout) if timeout and not items else self.queue.get_nowait())
+            except Empty:
+                break
+            self.numTaken.value += 1
+
+        numPending = self.numSpilled.value - self.numUnspilled.value
+        if len(items) < maxItems and numPending > 0 and self.depth() == 0:
+            if self.spillReader is None:
+                self.spillReader = open(self.spillFilename, 'rb')
+            self.spillReader.seek((self.numUnspilled.value - self.spillBase.value) * self.spillDtype.itemsize)
+            records = np.fromfile(self.spillReader, dtype=self.spillDtype, count=min(numPending, maxItems - len(items)))
+            items.extend((int(record["sampleIndex"]), record["saveData"].tolist()) for record in records)
+            self.numUnspilled.value += len(records)
+        return items
+
+    # Throws away everything waiting, e.g. packets from before a recording starts
+    def clear(self):
+
+        while self.getBatch(10000):
+            pass
+
+    # Counters of what the policy has done so far, for warnings and reports
+    def stats(self):
+
+        return {"depth": self.depth(), "maxDepth": self.maxDepth.value, "dropped": self.numDropped.value, "blocked": self.numBlocked.value,
+                "blockedSeconds": self.blockedSeconds.value, "spilled": self.numSpilled.value, "spillPending": self.numSpilled.value - self.numUnspilled.value}
+
+    def removeSpillFile(self):
+
+        try:
+            os.remove(self.spillFilename)
+        except OSError:
+            pass
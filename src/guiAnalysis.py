@@ -0,0 +1,199 @@
+import os, sys, glob, argparse
+import multiprocessing as mp
+from csv import writer
+from time import perf_counter
+import numpy as np
+
+import guiDSP
+import guiRecording
+import guiSettings
+
+# Offline features of whole recordings, for comparing sessions across a study without loading any recording into memory at once
+# Run with 'python guiAnalysis.py ../data/*.bin -o features.csv', csv recordings work too but binary ones (see 'guiRecording.py convert') read faster
+# Every recording is streamed chunkSeconds at a time through the same guiDSP kernels the live spectral plots use, one recording per worker process,
+# and the results end up in one table with a row per recording and channel
+
+# Columns of the results table, the band power columns follow guiDSP.bands
+featureColumns = ["recording", "channel", "seconds"] + list(guiDSP.bands) + \
+    ["iqMagMean", "iqMagStd", "iqMagMin", "iqMagMax", "iqPhaseMean", "iqPhaseStd", "blinks", "blinksPerMinute"]
+minChunkSeconds = 10 # The blink threshold is estimated from each chunk's noise, shorter chunks give too few samples for a steady estimate
+
+# Accumulates the features of one recording from consecutive chunks of its rows, memory use depends on the chunk size not the recording length
+class RecordingFeatures():
+
+    def __init__(self, numChannels, sampleRate, segmentSeconds=2, blinkRefractorySeconds=0.3):
+
+        self.numChannels = numChannels
+        self.sampleRate = sampleRate
+        self.numRows = 0
+
+        # Welch band powers over the whole recording, hann windowed segments with 50% overlap, same window and scaling as the live psd
+        self.segmentLength = int(segmentSeconds * sampleRate)
+        self.hopLength = self.segmentLength // 2
+        self.window = guiDSP.hannWindow(self.segmentLength)
+        self.freqs = guiDSP.rfftFreqs(self.segmentLength, sampleRate)
+        self.spectrumTail = np.empty((numChannels, 0)) # Samples not yet part of a full segment
+        self.psdSum = np.zeros((numChannels, len(self.freqs)))
+        self.numSegments = 0
+
+        # I/Q summaries, kept as running sums so nothing but the current chunk is ever held
+        self.magSum = np.zeros(numChannels)
+        self.magSquareSum = np.zeros(numChannels)
+        self.magMin = np.full(numChannels, np.inf)
+        self.magMax = np.full(numChannels, -np.inf)
+        self.phaseSum = np.zeros(numChannels)
+        self.phaseSquareSum = np.zeros(numChannels)
+
+        # Blink onsets, the baseline the detector needs is carried over from the previous chunk so blinks across a chunk boundary still count
+        self.blinkStep, self.blinkBaselineLength = guiDSP.blinkBaseline(sampleRate)
+        self.blinkTail = np.empty((numChannels, 0))
+        self.blinkRefractory = int(blinkRefractorySeconds * sampleRate) # Onsets closer than this to the previous one are the same blink
+        self.lastBlink = np.full(numChannels, -self.blinkRefractory - 1) # Row of each channel's last counted onset
+        self.blinks = np.zeros(numChannels, dtype=int)
+
+    # rows is shaped (packets, columns) in the saved data order (packet_id, chx0_eeg, chx0_i, chx0_q, chx1_eeg, ...)
+    def add(self, rows):
+
+        eeg = rows[:, 1::3].T.astype(float)
+        self.addSpectrum(eeg)
+        self.addIQ(rows[:, 2::3].T.astype(float), rows[:, 3::3].T.astype(float))
+        self.addBlinks(eeg)
+        self.numRows += len(rows)
+
+    def addSpectrum(self, eeg):
+
+        data = np.concatenate((self.spectrumTail, eeg), axis=1)
+        if data.shape[1] < self.segmentLength:
+            self.spectrumTail = data
+            return
+        numSegments = (data.shape[1] - self.segmentLength) // self.hopLength + 1
+        segments = np.lib.stride_tricks.sliding_window_view(data, self.segmentLength, axis=1)[:, ::self.hopLength][:, :numSegments]
+        psd = guiDSP.periodograms(segments.reshape(-1, self.segmentLength), self.window, self.sampleRate) # All channels and segments in one rfft
+        self.psdSum += psd.reshape(self.numChannels, numSegments, -1).sum(axis=1)
+        self.numSegments += numSegments
+        self.spectrumTail = data[:, numSegments * self.hopLength:]
+
+    def addIQ(self, i, q):
+
+        magnitude = guiDSP.iqMagnitude(i, q)
+        phase = guiDSP.iqPhase(i, q)
+        self.magSum += magnitude.sum(axis=1)
+        self.magSquareSum += (magnitude ** 2).sum(axis=1)
+        self.magMin = np.minimum(self.magMin, magnitude.min(axis=1))
+        self.magMax = np.maximum(self.magMax, magnitude.max(axis=1))
+        self.phaseSum += phase.sum(axis=1)
+        self.phaseSquareSum += (phase ** 2).sum(axis=1)
+
+    def addBlinks(self, eeg):
+
+        data = np.concatenate((self.blinkTail, eeg), axis=1)
+        onsets = guiDSP.blinkOnsets(data, self.sampleRate)[:, self.blinkTail.shape[1]:] # Tail samples were already looked at
+        firstRow = self.numRows
+        for ch, row in zip(*np.nonzero(onsets)): # Few enough (a handful per second at most) that a loop is fine
+            if firstRow + row - self.lastBlink[ch] > self.blinkRefractory:
+                self.blinks[ch] += 1
+                self.lastBlink[ch] = firstRow + row
+        # Kept from a multiple of blinkStep so the next chunk's baseline medians are taken at the same samples as in one long pass
+        tailLength = self.blinkBaselineLength + (firstRow + eeg.shape[1]) % self.blinkStep
+        self.blinkTail = data[:, -tailLength:]
+
+    # Returns one dict per channel with every featureColumns entry but the recording's name
+    def results(self):
+
+        count = max(1, self.numRows)
+        seconds = self.numRows / self.sampleRate
+        magMean = self.magSum / count
+        phaseMean = self.phaseSum / count
+        powers = guiDSP.bandPowers(self.psdSum / max(1, self.numSegments), self.freqs, list(guiDSP.bands.values()))
+
+        results = []
+        for ch in range(self.numChannels):
+            result = {"channel": ch, "seconds": seconds}
+            result.update({band: (powers[ch, idx] if self.numSegments else np.nan) for idx, band in enumerate(guiDSP.bands)})
+            result.update({
+                "iqMagMean": magMean[ch], "iqMagStd": np.sqrt(max(0, self.magSquareSum[ch] / count - magMean[ch] ** 2)),
+                "iqMagMin": self.magMin[ch], "iqMagMax": self.magMax[ch],
+                "iqPhaseMean": phaseMean[ch], "iqPhaseStd": np.sqrt(max(0, self.phaseSquareSum[ch] / count - phaseMean[ch] ** 2)),
+                "blinks": int(self.blinks[ch]), "blinksPerMinute": self.blinks[ch] / seconds * 60 if seconds else np.nan,
+            })
+            results.append(result)
+        return results
+
+# Yields a recording's rows chunkSeconds at a time as int32 arrays shaped (packets, columns), and first its (numChannels, sampleRate)
+# Binary recordings are read through their memory map, csv ones are parsed in chunks (their sample rate isn't saved so csvSampleRate is used)
+def recordingChunks(filename, chunkSeconds, csvSampleRate):
+
+    if filename.endswith(".csv"):
+        with open(filename, "r") as csvFile:
+            numColumns = len(csvFile.readline().split(","))
+        yield (numColumns - 1) // 3, csvSampleRate
+        chunkBytes = int(chunkSeconds * csvSampleRate) * numColumns * 8 # About 8 bytes of text per value
+        for rows in guiRecording.readCsvChunks(filename, numColumns, chunkBytes):
+            yield rows
+        return
+
+    recordingMap = guiRecording.RecordingMap(filename)
+    try:
+        yield recordingMap.header["numChannels"], recordingMap.header["sampleRate"]
+        chunkRows = max(1, int(chunkSeconds * recordingMap.header["sampleRate"]))
+        for start in range(0, len(recordingMap.rows), chunkRows):
+            yield np.array(recordingMap.rows[start:start + chunkRows]) # Copied out so only this chunk's pages need to stay resident
+    finally:
+        recordingMap.close()
+
+# Computes the features of one recording, run in a worker process by extractFeatures with args (filename, chunkSeconds, csvSampleRate)
+# Returns (filename, results or the error that stopped it, seconds taken) rather than raising, so one bad file doesn't stop the rest
+def recordingFeatures(args):
+
+    filename, chunkSeconds, csvSampleRate = args
+    start = perf_counter()
+    try:
+        chunks = recordingChunks(filename, chunkSeconds, csvSampleRate)
+        numChannels, sampleRate = next(chunks)
+        features = RecordingFeatures(numChannels, sampleRate)
+        for rows in chunks:
+            features.add(rows)
+        results = features.results()
+    except (OSError, ValueError) as e:
+        return filename, e, perf_counter() - start
+    return filename, results, perf_counter() - start
+
+# Computes the features of every recording on a pool of processes and writes them to one csv table at outputFilename
+# Each worker holds one chunk of one recording at a time, so memory stays bounded however long the recordings are
+# Returns the number of recordings that couldn't be read
+def extractFeatures(filenames, outputFilename, chunkSeconds=60, csvSampleRate=guiSettings.sampleRate, processes=None):
+
+    start = perf_counter()
+    chunkSeconds = max(chunkSeconds, minChunkSeconds)
+    rows = []
+    failed = 0
+    with mp.Pool(processes or os.cpu_count() or 1, maxtasksperchild=1) as pool: # A fresh worker per recording returns its memory between them
+        for filename, results, seconds in pool.imap_unordered(recordingFeatures, [(filename, chunkSeconds, csvSampleRate) for filename in filenames]):
+            if isinstance(results, Exception):
+                print(filename + ": failed, " + str(results))
+                failed += 1
+                continue
+            print(filename + ": " + str(round(results[0]["seconds"], 1) if results else 0) + "s of data in " + str(round(seconds, 2)) + "s")
+            rows.extend([{"recording": filename, **result} for result in results])
+
+    rows.sort(key=lambda row: (row["recording"], row["channel"])) # Same order however the workers finished
+    with open(outputFilename, "w") as outputFile:
+        tableWriter = writer(outputFile)
+        tableWriter.writerow(featureColumns)
+        tableWriter.writerows([[row[column] for column in featureColumns] for row in rows])
+
+    print("Wrote " + str(len(rows)) + " rows for " + str(len(filenames) - failed) + " of " + str(len(filenames)) + " recordings to " + outputFilename + " in " + str(round(perf_counter() - start, 2)) + "s")
+    return failed
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compute band powers, I/Q summaries and blink counts for a set of recordings")
+    parser.add_argument("recordings", nargs="*", help=".bin or .csv recordings, every .bin in ../data by default")
+    parser.add_argument("-o", "--output", default="../data/features.csv", help="Results table, one row per recording and channel")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="Recordings processed at once, one per cpu by default")
+    parser.add_argument("-c", "--chunk-seconds", type=float, default=60, help="Seconds of a recording held in memory at once per worker, at least " + str(minChunkSeconds))
+    parser.add_argument("-r", "--sample-rate", type=float, default=guiSettings.sampleRate, help="Packets per second of csv recordings")
+    args = parser.parse_args()
+
+    recordings = args.recordings or sorted(glob.glob("../data/*.bin"))
+    sys.exit(1 if extractFeatures(recordings, args.output, args.chunk_seconds, args.sample_rate, args.processes) else 0)
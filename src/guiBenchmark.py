@@ -0,0 +1,98 @@
+import argparse
+import multiprocessing as mp
+from time import sleep
+from ctypes import Structure, c_ubyte, c_short, c_int
+
+import guiAcquisition
+
+# Benchmarks of the shared data paths between the SerialReader and the processes reading from it
+# Run with 'python guiBenchmark.py snapshot', each benchmark compares the current implementation with the one it replaced
+
+# The per channel struct the newest packet used to be shared in, each guarded by its own RLock, kept here to compare against
+class ChannelData(Structure):
+    _fields_ = [("packetId", c_ubyte), ("chxEEG", c_int), ("chxI", c_short), ("chxQ", c_short)]
+
+# Old scheme, one lock acquisition per channel per packet on the writer side and per channel read on the reader side
+class LockedChannels():
+
+    def __init__(self, numChannels):
+
+        self.channelDataArr = [mp.Value(ChannelData, 0, 0, 0, 0, lock=mp.RLock()) for _ in range(numChannels)]
+
+    def write(self, packetId, values):
+
+        for idx, channelData in enumerate(self.channelDataArr):
+            with channelData.get_lock():
+                channelData.packetId = packetId
+                channelData.chxEEG = values[idx * 3]
+                channelData.chxI = values[idx * 3 + 1]
+                channelData.chxQ = values[idx * 3 + 2]
+
+    def readChannel(self, channelIdx):
+
+        channelData = self.channelDataArr[channelIdx]
+        with channelData.get_lock():
+            return channelData.packetId, channelData.chxEEG, channelData.chxI, channelData.chxQ
+
+# Writes packets as fast as possible until stop is set, packets are consistent (every value is the packet number) so readers can check them
+# Numbers wrap at 2^15 to fit the old struct's shorts, which also keeps them a multiple of the 256 packet ids
+def writePackets(shared, numChannels, stop, numPackets):
+
+    count = 0
+    while not stop.value:
+        value = count % 2**15
+        shared.write(value % 256, [value] * numChannels * 3)
+        count += 1
+    numPackets.value = count
+
+# Reads channels in a loop like the graph processes do, counting reads and any that mixed values from two packets
+def readPackets(shared, numChannels, stop, numReads, numTorn):
+
+    count = 0
+    torn = 0
+    while not stop.value:
+        packetId, chxEEG, chxI, chxQ = shared.readChannel(count % numChannels)
+        if not (chxEEG == chxI == chxQ and chxEEG % 256 == packetId):
+            torn += 1
+        count += 1
+    numReads.value = count
+    numTorn.value = torn
+
+# Runs one writer and numReaders readers on shared for seconds, returns (packets written/s, reads/s per reader, torn reads)
+def runContention(shared, numChannels, numReaders, seconds):
+
+    stop = mp.RawValue('i', 0)
+    numPackets = mp.RawValue('q', 0)
+    readerCounts = [(mp.RawValue('q', 0), mp.RawValue('q', 0)) for _ in range(numReaders)]
+    processes = [mp.Process(target=writePackets, args=(shared, numChannels, stop, numPackets))]
+    processes += [mp.Process(target=readPackets, args=(shared, numChannels, stop, numReads, numTorn)) for numReads, numTorn in readerCounts]
+    for process in processes:
+        process.start()
+    sleep(seconds)
+    stop.value = 1
+    for process in processes:
+        process.join()
+
+    readsPerSecond = sum(numReads.value for numReads, _ in readerCounts) / max(1, numReaders) / seconds
+    return numPackets.value / seconds, readsPerSecond, sum(numTorn.value for _, numTorn in readerCounts)
+
+def benchmarkSnapshot(numChannels, numReaders, seconds):
+
+    print("Newest packet sharing, " + str(numChannels) + " channels, 1 writer and " + str(numReaders) + " readers for " + str(seconds) + "s each")
+    print("scheme".ljust(24) + "packets/s".rjust(14) + "reads/s/reader".rjust(16) + "torn reads".rjust(12))
+    for name, shared in [("per channel locks", LockedChannels(numChannels)), ("seqlock snapshot", guiAcquisition.LatestSnapshot(numChannels))]:
+        packetRate, readRate, numTorn = runContention(shared, numChannels, numReaders, seconds)
+        print(name.ljust(24) + str(int(packetRate)).rjust(14) + str(int(readRate)).rjust(16) + str(numTorn).rjust(12))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the shared data paths of the GUI")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    snapshotParser = subparsers.add_parser("snapshot", help="Per channel locks against the seqlock snapshot, under reader contention")
+    snapshotParser.add_argument("-c", "--channels", type=int, default=8)
+    snapshotParser.add_argument("-r", "--readers", type=int, default=4, help="Number of reading processes, e.g. graphs on screen")
+    snapshotParser.add_argument("-s", "--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    if args.benchmark == "snapshot":
+        benchmarkSnapshot(args.channels, args.readers, args.seconds)
@@ -1,36 +1,35 @@
-import numpy as np
+import threading
+from math import ceil
+from time import monotonic
 import simpleaudio as sa
-from PyQt5.QtWidgets import QLabel, QGridLayout, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QCheckBox, QLineEdit, QFrame
+from PyQt5.QtWidgets import QLabel, QGridLayout, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QCheckBox, QLineEdit, QFrame, QFileDialog
 from PyQt5.QtGui import QRegExpValidator
-from PyQt5.QtCore import QTimer, QRegExp
+from PyQt5.QtCore import QTimer, QRegExp, pyqtSignal
 
-class CueSystemButton(QPushButton):
-
-    def __init__(self, running, startStop):
-
-        super().__init__("Cue System")
-        self.running = running
-        self.startStop = startStop
-
-        self.clicked.connect(self.showPopup)
-
-        self.cueSystem = None
-
-    def showPopup(self):
-        if not self.cueSystem:
-            self.cueSystem = CueSystem(self.running, self.startStop)
-            self.cueSystem.show()
-        else:
-            self.cueSystem.show()
+import guiLatency
+import guiProtocol
+import guiStimuli
+import guiTimeline
 
 class CueSystem(QWidget):
 
-    def __init__(self, running, startStop):
+    # The CueScheduler fires cues on its own thread, these carry its cues and its end back to the GUI thread
+    cueFired = pyqtSignal(object)
+    timelineFinished = pyqtSignal()
+    calibrationFinished = pyqtSignal(object) # Carries the latency profile back from the calibration thread
+
+    def __init__(self, running, startStop, sharedAmFreq, eventRecorder, assrEstimator):
 
         super().__init__()
 
         self.running = running
         self.startStop = startStop
+        self.sharedAmFreq = sharedAmFreq # Lets the spectral plots track the frequency the current ASSR test should evoke
+        self.eventRecorder = eventRecorder # Saves each cue next to the recording, aligned to the sample it happened at
+        self.assrEstimator = assrEstimator # Measures the response to the audio tests, its SNR is shown so a test can be stopped once it's settled
+
+        # Sound events are shifted by this machine's measured audio latency, if it has been calibrated
+        self.eventRecorder.latencies = guiLatency.eventLatencies(guiLatency.loadProfile())
 
         self.layout = QVBoxLayout()
 
@@ -40,6 +39,12 @@ class CueSystem(QWidget):
         # Loads beep notification sound
         self.beepWav = sa.WaveObject.from_wave_file("beep.wav")
 
+        # Audio test stimuli are generated in the background as soon as their parameters are filled in, and reused for every repetition
+        self.stimulusPlayer = guiStimuli.StimulusPlayer()
+        self.stimulusPlayer.prewarm()
+        self.stimulusKey = None # Key of the stimulus the running test plays
+        self.assrTest = False # Whether the running test has an ASSR, its SNR is shown while it runs
+
         self.spacer = QFrame()
         self.spacer.setFrameShape(QFrame.HLine)
         self.spacer.setLineWidth(5)
@@ -50,6 +55,7 @@ class CueSystem(QWidget):
         # Params setup
         self.baseParams = BaseCueParamLayout()
         self.baseParams.setStyleSheet("BaseCueParamLayout {border: 1px solid black;}")
+        self.baseParams.cueLength.editingFinished.connect(self.prepareStimulus)
         self.cueParams.addWidget(self.baseParams)
 
         self.testSelection = QComboBox()
@@ -92,6 +98,16 @@ class CueSystem(QWidget):
         startStopSyncLayout.addWidget(self.startStopSync)
         cueStartStopLayout.addLayout(startStopSyncLayout, 1, 0)
 
+        # Runs a whole protocol file of tests back to back instead of the test set up above
+        self.loadProtocolButton = QPushButton("Load Protocol")
+        self.loadProtocolButton.clicked.connect(self.loadProtocol)
+        cueStartStopLayout.addWidget(self.loadProtocolButton, 1, 1)
+
+        # Measures audio latency through a loopback input, the result is saved and applied to the sound events of every test after
+        self.calibrateButton = QPushButton("Calibrate Audio Latency")
+        self.calibrateButton.clicked.connect(self.calibrateLatency)
+        self.calibrationFinished.connect(self.finishCalibration)
+
         self.splitWindowButton = QPushButton("Split Cue Window")
         self.splitWindowButton.clicked.connect(self.splitWindow)
         self.reformWindowButton = QPushButton("Reform Cue Window")
@@ -103,13 +119,20 @@ class CueSystem(QWidget):
         self.layout.addWidget(self.tooltipLabel)
         self.layout.addLayout(self.cueParams)
         self.layout.addLayout(cueStartStopLayout)
+        self.layout.addWidget(self.calibrateButton)
         self.layout.addWidget(self.splitWindowButton)
         self.layout.addWidget(self.reformWindowButton)
 
         self.setLayout(self.layout)
 
-        self.totalRuntimer = None
-        self.durationTimer = None
+        self.scheduler = None # Runs the current test's timeline, None when no test is running
+        self.currCue = None # Cue whose phase is currently shown
+        self.promptRefreshRate = 200 # Refresh rate in ms of the countdowns on the cue prompt, only affects what's shown
+        self.promptTimer = QTimer(self)
+        self.promptTimer.timeout.connect(self.updatePrompt)
+
+        self.cueFired.connect(self.showCue)
+        self.timelineFinished.connect(self.finishTimeline)
 
     def displayTooltip(self, msg):
         self.tooltipLabel.setText(msg)
@@ -148,23 +171,25 @@ class CueSystem(QWidget):
         self.paramList[idx].show()
         self.paramList[self.currParams].hide()
         self.currParams = idx
-    
-    def startTotalRuntime(self):
-
-        self.currRuntime = -1 # Needed for similar reason as +1 below, first tick should be 0s not 1s
-        self.cuePrompt.runtime.setText("0s")
+        self.prepareStimulus()
 
-        if self.totalRuntimer and self.totalRuntimer.isActive():
-            self.totalRuntimer.stop()
-        self.totalRuntimer = QTimer(self)
-        self.totalRuntimer.timeout.connect(self.updateTotalRuntime)
-        self.totalRuntimer.start(1000)
+    # Returns the stimulus cache key for the selected test's current parameters, or None if it isn't an audio test or a value is missing
+    def currentStimulusKey(self):
 
-    def updateTotalRuntime(self):
+        testLayout = self.paramList[self.testSelection.currentIndex()]
+        cueLengthText = self.baseParams.cueLength.text()
+        stimulusFields = getattr(testLayout, "stimulusFields", None)
+        if stimulusFields is None or not cueLengthText or not all(field.text() for field in stimulusFields.values()):
+            return None
+        return guiStimuli.stimulusKey(testLayout.name, {name: int(field.text()) for name, field in stimulusFields.items()}, int(cueLengthText))
 
-        self.currRuntime += 1
-        self.cuePrompt.runtime.setText(str(self.currRuntime) + "s")
+    # Starts generating the stimulus for the current parameters so it's ready by the time the test plays it
+    def prepareStimulus(self):
 
+        key = self.currentStimulusKey()
+        if key is not None:
+            self.stimulusPlayer.prepare(key)
+    
     def runTest(self):
 
         self.cueStart.setEnabled(False)
@@ -173,8 +198,8 @@ class CueSystem(QWidget):
 
         self.resetTooltip()
 
-        if self.startStopSync.checkState() and not self.running.value: # And statment is to stop recursion
-            self.startStop.start()
+        if self.startStopSync.checkState() and not self.running.value:
+            self.startStop.startAcquisition()
 
         testLayout = self.paramList[self.testSelection.currentIndex()]
         self.currTest = testLayout.name
@@ -189,19 +214,10 @@ class CueSystem(QWidget):
             self.stopTest()
             return
 
-        self.remainingStartDelay = int(startDelayText) + 1 # This is needed because it ticks down immediately upon reaching that stage
-
-        self.remainingReps = int(remainingRepsText)
-
-        self.originalCueTime = int(cueLengthText) + 1
-        self.originalRestTime = int(restLengthText) + 1
-        self.remainingCueTime = self.originalCueTime
-        self.remainingRestTime = self.originalRestTime
-
-        self.remainingEndDelay = int(endDelayText) + 1
-
+        cueAudio = False
+        assrFreq = None
         if self.currTest == "eyeBlinks" or self.currTest == "alpha":
-            self.cueAudio = testLayout.cueAudio.isChecked()
+            cueAudio = testLayout.cueAudio.isChecked()
         elif self.currTest == "clicks":
             clickFreqText = testLayout.clickFreq.text()
             if not clickFreqText:
@@ -209,6 +225,7 @@ class CueSystem(QWidget):
                 self.stopTest()
                 return
             self.clickFreq = int(clickFreqText)
+            assrFreq = self.clickFreq # Click trains evoke their response at the click rate
         elif self.currTest == "pureTone" or self.currTest == "whiteNoise":
             amFreqText = testLayout.amFreq.text()
             carrierAmpText = testLayout.carrierAmp.text()
@@ -220,6 +237,7 @@ class CueSystem(QWidget):
                 return
 
             self.amFreq = int(amFreqText)
+            assrFreq = self.amFreq
             self.carrierAmp = int(carrierAmpText)
             self.modAmp = int(modAmpText)
 
@@ -231,146 +249,155 @@ class CueSystem(QWidget):
                     return
                 self.carrierFreq = int(carrierFreqText)
 
-        self.startTotalRuntime()
-
-        if self.durationTimer and self.durationTimer.isActive():
-            self.durationTimer.stop()
-        self.durationTimer = QTimer(self)
-        self.durationTimer.timeout.connect(self.updateDuration)
-        self.durationTimer.start(1000)
-
-    def updateDuration(self):
-
-        if self.remainingStartDelay > 1:
-            self.cuePrompt.cueText.setText("Wait for test to start...")
-            self.remainingStartDelay -= 1
-            self.cuePrompt.duration.setText(str(self.remainingStartDelay) + "s")
-
-        elif self.remainingReps > 0:
-            if self.currTest == "eyeBlinks":
-                self.testEyeBlinks()
-            elif self.currTest == "alpha":
-                self.testAlpha()
-            elif self.currTest in ["clicks", "pureTone", "whiteNoise"]:
-                self.testAudio(self.currTest)
-
-        elif self.remainingEndDelay > 1:
-            self.cuePrompt.cueText.setText("Wait for test to end...")
-            self.remainingEndDelay -= 1
-            self.cuePrompt.duration.setText(str(self.remainingEndDelay) + "s")
-        else:
-            self.stopTest()
+        self.stimulusKey = self.currentStimulusKey()
 
-    def testEyeBlinks(self):
-
-        if self.remainingRestTime > 1:
-            if self.cueAudio and self.remainingRestTime == self.originalRestTime:
-                self.beepWav.play()
-            self.cuePrompt.cueText.setText("Rest")
-            self.remainingRestTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingRestTime) + "s")
-        elif self.remainingCueTime > 1:
-            if self.cueAudio and self.remainingCueTime == self.originalCueTime:
-                self.beepWav.play()
-            self.cuePrompt.cueText.setText("Blink")
-            self.remainingCueTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingCueTime) + "s")
-            if self.remainingCueTime <= 1:
-                self.remainingReps -= 1
-                self.remainingRestTime = self.originalRestTime
-                self.remainingCueTime = self.originalCueTime
-
-    def testAlpha(self):
-
-        if self.remainingRestTime > 1:
-            if self.cueAudio and self.remainingRestTime == self.originalRestTime:
-                self.beepWav.play()
-            self.cuePrompt.cueText.setText("Eyes Open")
-            self.remainingRestTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingRestTime) + "s")
-        elif self.remainingCueTime > 1:
-            if self.cueAudio and self.remainingCueTime == self.originalCueTime:
-                self.beepWav.play()
-            self.cuePrompt.cueText.setText("Eyes Closed")
-            self.remainingCueTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingCueTime) + "s")
-            if self.remainingCueTime <= 1:
-                self.remainingReps -= 1
-                self.remainingRestTime = self.originalRestTime
-                self.remainingCueTime = self.originalCueTime
-
-    def testAudio(self, testName):
-
-        if self.remainingRestTime > 1:
-            self.cuePrompt.cueText.setText("Rest")
-            self.remainingRestTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingRestTime) + "s")
-        elif self.remainingCueTime > 1:
-            if self.remainingCueTime == self.originalCueTime:
-                self.playAudio(testName, self.originalCueTime - 1)
-            self.cuePrompt.cueText.setText("Listen")
-            self.remainingCueTime -= 1
-            self.cuePrompt.duration.setText(str(self.remainingCueTime) + "s")
-            if self.remainingCueTime <= 1:
-                self.remainingReps -= 1
-                self.remainingRestTime = self.originalRestTime
-                self.remainingCueTime = self.originalCueTime
+        # Every phase of the test is worked out up front and then fired at its exact time by the scheduler's thread
+        timeline = guiTimeline.Timeline()
+        timeline.addTest(self.currTest, int(startDelayText), int(remainingRepsText), int(cueLengthText), int(restLengthText), int(endDelayText), cueAudio, self.stimulusKey, assrFreq)
+        self.startTimeline(timeline)
 
-    def stopTest(self):
+    # Runs a protocol file picked by the user, every test in it is compiled into one timeline so the gaps between tests are as exact as the phases
+    def loadProtocol(self):
 
-        if self.durationTimer:
-            self.durationTimer.stop()
-        if self.totalRuntimer:
-            self.totalRuntimer.stop()
-        self.cuePrompt.duration.setText("0s")
-        self.cuePrompt.cueText.setText("No Test Running")
-
-        self.cueStop.setEnabled(False)
-        self.startStopSync.setEnabled(True)
-        self.cueStart.setEnabled(True)
+        if self.scheduler is not None: # Only one timeline runs at a time, starting another would orphan the running one
+            return
+        filename, _ = QFileDialog.getOpenFileName(self, "Load Protocol", "", "Protocol files (*.json)")
+        if not filename:
+            return
+        try:
+            protocol = guiProtocol.loadProtocol(filename)
+        except (OSError, ValueError) as e:
+            self.displayTooltip("Couldn't load protocol: " + str(e))
+            return
 
+        self.cueStart.setEnabled(False)
+        self.startStopSync.setEnabled(False)
+        self.cueStop.setEnabled(True)
         self.resetTooltip()
+        if self.startStopSync.checkState() and not self.running.value:
+            self.startStop.startAcquisition()
 
-        if self.startStopSync.checkState() and self.running.value:
-            self.startStop.stop()
+        self.currTest = protocol["name"]
+        self.startTimeline(guiProtocol.compileProtocol(protocol))
+
+    # Gets a timeline's stimuli ready and starts firing its cues, unless one is already running
+    def startTimeline(self, timeline):
+
+        if self.scheduler is not None: # A second scheduler couldn't be stopped and would fire every cue and event again
+            print("A test is already running, not starting another")
+            return
+        for key in timeline.stimulusKeys(): # Usually already prepared, otherwise they have the start delay and first rest to generate
+            self.stimulusPlayer.prepare(key)
+        self.stimulusPlayer.prewarm() # The start delay (or first rest) gives the device time to wake before the first sound
+
+        self.currCue = None
+        self.assrTest = False
+        self.loadProtocolButton.setEnabled(False)
+        self.calibrateButton.setEnabled(False) # Calibration would play into the loopback over the test's sounds
+        self.scheduler = guiTimeline.CueScheduler(timeline, self.fireCue, self.timelineFinished.emit)
+        self.scheduler.start()
+        self.promptTimer.start(self.promptRefreshRate)
+        self.updatePrompt()
+
+    # Called on the scheduler's thread at the start of each phase, plays its sounds and marks its events as close to the deadline as possible
+    def fireCue(self, cue):
+
+        guiTimeline.performCue(cue, self.eventRecorder, self.stimulusPlayer, self.beepWav, self.sharedAmFreq)
+        self.cueFired.emit(cue)
+
+    def showCue(self, cue):
+
+        if self.scheduler is None: # Fired just before the test was stopped
+            return
+        if cue.phase == "testStart":
+            self.assrTest = cue.amFreq is not None
+        if cue.duration == 0: # Test start and stop markers have nothing to show
+            return
+        self.currCue = cue
+        self.cuePrompt.cueText.setText(cue.text)
+        self.updatePrompt()
+
+    # Updates the countdown and runtime (and the SNR during audio tests) from the scheduler's clock
+    def updatePrompt(self):
+
+        if self.scheduler is None:
+            return
+        elapsed = monotonic() - self.scheduler.startTime
+        self.cuePrompt.runtime.setText(str(int(elapsed)) + "s")
+        if self.currCue is not None:
+            self.cuePrompt.duration.setText(str(max(0, ceil(self.currCue.offset + self.currCue.duration - elapsed))) + "s")
+        if self.assrTest:
+            self.updateSNR()
 
-    def playAudio(self, testName, length):
+    def finishTimeline(self):
 
-        samplingFreq = 48000
+        if self.scheduler is not None:
+            self.stopTest()
 
-        if testName == "clicks":
-            numSamples = 1200
-            pulseWidth = 1e-6
-            periodLen = 1/self.clickFreq
+    # Runs the latency calibration on its own thread, tests can't be started until it's done as they'd play into the loopback
+    def calibrateLatency(self):
 
-            clicks = (np.zeros(numSamples) + (np.arange(numSamples) % periodLen < pulseWidth)).astype(np.float32)
-            numPeriods = int((length * samplingFreq)/numSamples)
-            fullClicks = np.tile(clicks, numPeriods)
+        self.cueStart.setEnabled(False)
+        self.loadProtocolButton.setEnabled(False)
+        self.calibrateButton.setEnabled(False)
+        self.displayTooltip("Calibrating audio latency, connect the audio output to the loopback input...")
+        threading.Thread(target=lambda: self.calibrationFinished.emit(guiLatency.calibrate(self.stimulusPlayer, self.beepWav)), daemon=True).start()
+
+    def finishCalibration(self, profile):
+
+        if self.scheduler is None:
+            self.cueStart.setEnabled(True)
+            self.loadProtocolButton.setEnabled(True)
+            self.calibrateButton.setEnabled(True)
+        if profile is None:
+            self.displayTooltip("Calibration failed, see the console for details")
+            return
+        guiLatency.saveProfile(profile)
+        self.eventRecorder.latencies = guiLatency.eventLatencies(profile)
+        self.displayTooltip(guiLatency.describeProfile(profile))
+
+    # Shows the SNR of the channel with the strongest response so far
+    def updateSNR(self):
+
+        with self.assrEstimator.numSegments.get_lock():
+            numSegments = self.assrEstimator.numSegments.value
+            snr = self.assrEstimator.snr[:]
+        if numSegments == 0:
+            self.cuePrompt.snr.setText("-")
+            return
+        bestCh = max(range(len(snr)), key=lambda ch: snr[ch])
+        self.cuePrompt.snr.setText("Ch " + str(bestCh) + ": " + str(round(snr[bestCh], 1)) + "dB (" + str(numSegments) + "s)")
 
-            # Start playback
-            sa.play_buffer(fullClicks, 1, 4, samplingFreq)
+    def stopTest(self):
 
-        elif testName == "pureTone":
-            inital = np.linspace(0, length, length * samplingFreq)
-            amPiece = np.cos(2 * np.pi * self.amFreq * inital)
-            carrierPiece = np.cos(2 * np.pi * self.carrierFreq * inital)
-            fullTone = (self.carrierAmp + self.modAmp * amPiece * carrierPiece).astype(np.float32)
+        timingReport = None
+        if self.scheduler:
+            self.scheduler.stop()
+            if not self.scheduler.done: # A timeline that ran to the end has marked its own stop
+                self.eventRecorder.mark("testStop")
+            timingReport = self.scheduler.jitterReport()
+            print(timingReport)
+            self.scheduler = None
+        self.promptTimer.stop()
+        self.currCue = None
+        self.cuePrompt.duration.setText("0s")
+        self.cuePrompt.cueText.setText("No Test Running")
 
-            # Start playback
-            sa.play_buffer(fullTone, 1, 4, samplingFreq)
+        self.stimulusPlayer.stop() # A streamed stimulus can be cut off with the test
 
-        elif testName == "whiteNoise":
-            numSamples = 1200
-            whiteNoise = np.random.normal(0, 0.5, size=numSamples) # Made std 0.5 because it kills my ears less but I don't know the "correct" value
-            numRepeats = int((length * samplingFreq)/numSamples)
+        self.cueStop.setEnabled(False)
+        self.startStopSync.setEnabled(True)
+        self.cueStart.setEnabled(True)
+        self.loadProtocolButton.setEnabled(True)
+        self.calibrateButton.setEnabled(True)
+        self.assrTest = False
 
-            inital = np.linspace(0, length, length * samplingFreq)
-            amPiece = np.cos(2 * np.pi * self.amFreq * inital)
-            whiteNoisePiece = np.tile(whiteNoise, numRepeats)
-            fullSound = (self.carrierAmp + self.modAmp * amPiece * whiteNoisePiece).astype(np.float32)
+        self.resetTooltip()
+        if timingReport:
+            self.displayTooltip(timingReport)
 
-            # Start playback
-            sa.play_buffer(fullSound, 1, 4, samplingFreq)
+        if self.startStopSync.checkState() and self.running.value:
+            self.startStop.stop()
 
 class CuePrompt(QWidget):
 
@@ -397,9 +424,17 @@ class CuePrompt(QWidget):
         runtimeLayout.addWidget(runtimeLabel)
         runtimeLayout.addWidget(self.runtime)
 
+        snrLabel = QLabel("ASSR SNR")
+        self.snr = QLabel("-")
+        self.snr.setStyleSheet("border: 1px solid black;")
+        snrLayout = QHBoxLayout()
+        snrLayout.addWidget(snrLabel)
+        snrLayout.addWidget(self.snr)
+
         layout.addWidget(self.cueText)
         layout.addLayout(durationLayout)
         layout.addLayout(runtimeLayout)
+        layout.addLayout(snrLayout)
 
         self.setLayout(layout)
 
@@ -485,6 +520,11 @@ class ClicksLayout(QWidget):
         self.clickFreq.setValidator(numValidator)
         layout.addWidget(self.clickFreq, 0, 1)
 
+        # Parameters the stimulus is generated from, by the name guiStimuli uses, regenerated in the background whenever one is edited
+        self.stimulusFields = {"clickFreq": self.clickFreq}
+        for field in self.stimulusFields.values():
+            field.editingFinished.connect(cueSystem.prepareStimulus)
+
         self.setLayout(layout)
 
 class PureToneLayout(QWidget):
@@ -518,6 +558,10 @@ class PureToneLayout(QWidget):
         self.amFreq.setValidator(numValidator)
         layout.addWidget(self.amFreq, 1, 3)
 
+        self.stimulusFields = {"carrierAmp": self.carrierAmp, "modAmp": self.modAmp, "carrierFreq": self.carrierFreq, "amFreq": self.amFreq}
+        for field in self.stimulusFields.values():
+            field.editingFinished.connect(cueSystem.prepareStimulus)
+
         self.setLayout(layout)
 
 class WhiteNoiseLayout(QWidget):
@@ -546,4 +590,8 @@ class WhiteNoiseLayout(QWidget):
         self.amFreq.setValidator(numValidator)
         layout.addWidget(self.amFreq, 0, 3)
 
+        self.stimulusFields = {"carrierAmp": self.carrierAmp, "modAmp": self.modAmp, "amFreq": self.amFreq}
+        for field in self.stimulusFields.values():
+            field.editingFinished.connect(cueSystem.prepareStimulus)
+
         self.setLayout(layout)
\ No newline at end of file
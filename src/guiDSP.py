@@ -0,0 +1,105 @@
+import numpy as np
+
+# Vectorized signal processing kernels shared by the live processing stages and the offline tools
+# Every kernel works on 2d arrays shaped (channels, samples) so all channels are processed in one numpy call
+
+# Standard EEG bands in Hz as (low, high), the high edge is exclusive
+bands = {"delta": (1, 4), "theta": (4, 8), "alpha": (8, 13), "beta": (13, 30)}
+
+# Periodic hann window, the variant welch uses for spectral estimation
+def hannWindow(segmentLength):
+
+    return 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(segmentLength) / segmentLength)
+
+# Frequencies (Hz) corresponding to the bins returned by periodograms
+def rfftFreqs(segmentLength, sampleRate):
+
+    return np.fft.rfftfreq(segmentLength, 1 / sampleRate)
+
+# One sided power spectral density of each row of segments, units are signal^2 / Hz
+def periodograms(segments, window, sampleRate):
+
+    detrended = segments - segments.mean(axis=1, keepdims=True) # Removes the DC offset of each channel so it doesn't leak into the low bins
+    spectrum = np.fft.rfft(detrended * window, axis=1)
+    psd = (spectrum.real ** 2 + spectrum.imag ** 2) / (sampleRate * np.sum(window ** 2))
+
+    # Folds the negative frequencies onto the positive ones, DC and (for even lengths) nyquist only exist once
+    if segments.shape[1] % 2 == 0:
+        psd[:, 1:-1] *= 2
+    else:
+        psd[:, 1:] *= 2
+    return psd
+
+# Integrates a psd over each (low, high) band, returns an array shaped (channels, len(bandEdges))
+def bandPowers(psd, freqs, bandEdges):
+
+    df = freqs[1] - freqs[0]
+    powers = np.empty((psd.shape[0], len(bandEdges)))
+    for idx, (low, high) in enumerate(bandEdges):
+        mask = (freqs >= low) & (freqs < high)
+        powers[:, idx] = psd[:, mask].sum(axis=1) * df
+    return powers
+
+# Power in the bin closest to freq for every channel
+def binPower(psd, freqs, freq):
+
+    df = freqs[1] - freqs[0]
+    return psd[:, int(np.argmin(np.abs(freqs - freq)))] * df
+
+# Ratio in dB of the power in the bin closest to freq to the mean power of the numNoiseBins bins either side of it, for every channel
+def binSNR(psd, freqs, freq, numNoiseBins):
+
+    signalBin = int(np.argmin(np.abs(freqs - freq)))
+    noiseBins = [b for b in range(signalBin - numNoiseBins, signalBin + numNoiseBins + 1) if b != signalBin and 0 < b < len(freqs)]
+    noise = psd[:, noiseBins].mean(axis=1)
+    return 10 * np.log10((psd[:, signalBin] + 1e-12) / (noise + 1e-12)) # Small offset avoids log(0) on flat signals
+
+# Magnitude of each I/Q pair, same as IQMagDataProcess
+def iqMagnitude(i, q):
+
+    return np.hypot(i, q)
+
+# Phase (radians) of each I/Q pair as atan(Q / I), 0 where I is 0, same as IQPhaseDataProcess
+def iqPhase(i, q):
+
+    i = np.asarray(i, dtype=float)
+    return np.arctan(np.divide(q, i, out=np.zeros(np.broadcast(i, q).shape), where=i != 0))
+
+# Mean of every length consecutive samples of each channel, returns (channels, samples - length + 1), entry k covers samples k to k + length - 1
+def movingAverage(signal, length):
+
+    sums = np.cumsum(signal, axis=1)
+    sums = np.concatenate((np.zeros((signal.shape[0], 1)), sums), axis=1)
+    return (sums[:, length:] - sums[:, :-length]) / length
+
+# Marks the samples where each channel's eeg jumps away from its slow baseline, the shape of an eye blink
+# The signal is smoothed over smoothSeconds and compared to its median over the last baselineSeconds (taken every baselineStep samples),
+# a median so a blink neither drags the baseline along nor leaves a dip behind it. A blink onset is where that deviation first exceeds
+# thresholdFactor times its median absolute deviation, so the threshold follows each channel's own noise level
+# Returns a boolean array the shape of eeg, the first baselineLength samples are never marked as they have no baseline yet
+def blinkOnsets(eeg, sampleRate, thresholdFactor=8, smoothSeconds=0.05, baselineSeconds=1):
+
+    smoothLength = max(1, int(smoothSeconds * sampleRate))
+    baselineStep, baselineLength = blinkBaseline(sampleRate, baselineSeconds)
+    onsets = np.zeros(eeg.shape, dtype=bool)
+    if eeg.shape[1] <= baselineLength:
+        return onsets
+
+    # Median of each window of baselineLength samples ending on a multiple of baselineStep, held until the next one
+    windows = np.lib.stride_tricks.sliding_window_view(eeg[:, ::baselineStep], baselineLength // baselineStep, axis=1)
+    baseline = np.repeat(np.median(windows, axis=2), baselineStep, axis=1)[:, :eeg.shape[1] - baselineLength + baselineStep]
+
+    # Lined up on the sample they end at, deviation[:, k] belongs to sample k + baselineLength - baselineStep
+    smooth = movingAverage(eeg, smoothLength)[:, baselineLength - baselineStep - smoothLength + 1:]
+    deviation = smooth - baseline[:, :smooth.shape[1]]
+    spread = np.median(np.abs(deviation - np.median(deviation, axis=1, keepdims=True)), axis=1, keepdims=True)
+    above = np.abs(deviation) > thresholdFactor * spread + 1e-12 # Offset keeps flat channels from marking every sample
+    onsets[:, baselineLength:] = (above[:, 1:] & ~above[:, :-1])[:, baselineStep - 1:]
+    return onsets
+
+# Returns (baselineStep, baselineLength) in samples for blinkOnsets, the length is a whole number of steps so chunked callers can keep the
+# steps lined up by starting every chunk on a multiple of baselineStep
+def blinkBaseline(sampleRate, baselineSeconds=1):
+
+    baselineStep = max(1, int(sampleRate) // 100) # About 100 samples per median
+    return baselineStep, max(1, int(baselineSeconds * sampleRate) // baselineStep) * baselineStep
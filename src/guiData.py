@@ -1,147 +1,12 @@
-import os, serial
-from time import sleep, time
+import os
+from time import time, monotonic
 from csv import writer
-from ctypes import Structure, c_ubyte, c_short, c_int
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QCheckBox, QLineEdit
 from PyQt5.QtCore import QTimer
 
-# The SerialReader class handles sending/receiving data to/from the usb dongle over pyserial
-class SerialReader():
-
-    def __init__(self, port, numChannels, channelDataArr, saveDataQueue, connectionPipe, commandWriterPipe, commandResponsePipe):
-
-        self.serialGUISide = None
-        self.port = port
-        self.numChannels = numChannels
-        self.channelDataArr = channelDataArr
-        self.saveDataQueue = saveDataQueue
-        self.connectionPipe = connectionPipe
-        self.commandWriterPipe = commandWriterPipe
-        self.commandResponsePipe = commandResponsePipe
-
-        self.refreshRate = 10 # Refresh rate in ms, only used when in command mode
-        self.commandMode = True # Controls whether serialReader is looking for data or command responses, always starts in command mode
-        self.packetCount = 0
-
-    # Waits for serial port connection and, once established, starts a loop to read data from and write commands to the pyserial connection
-    def startSerialReader(self):
-
-        while not self.serialGUISide: # This waits for a device at the given port to be connected
-            sleep(0.1) # This caps the refresh rate and lowers the load on the computer, full speed not needed
-            try:
-                # Connection is in startSerialReader in order to work with multiprocessing
-                # self.serialGUISide = serial.Serial(self.port, 9600, rtscts=True, dsrdtr=True) # Uncomment for emulator
-                self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True) # Creates connection with specified port, baud doesn't actually matter
-            except:
-                pass
-
-        self.connectionPipe.send(1) # Callback to notify main loop that device is connected
-        print("Writing stop to chip")
-        # Stop is written to stop any data already streaming (in case of a malfunction), written three times as the first command sometimes doesn't get through
-        self.serialGUISide.write(("stop" + " \n").encode())
-        self.serialGUISide.write(("stop" + " \n").encode())
-        self.serialGUISide.write(("stop" + " \n").encode())
-
-        while True:
-            self.updateData() # Data read in happens here
-            if self.commandWriterPipe.poll(): # Checks if there is a command to write to the chip
-                command = self.commandWriterPipe.recv().strip() # Gets command and removes any extra whitespace 
-                print("Writing " + command + " to chip")
-                self.serialGUISide.write((command + " \n").encode()) # Space has to be added for chip parsing
-                if command == "start":
-                    self.commandMode = False # Data read will now expect eeg data to be streaming
-                elif command == "stop":
-                    self.commandMode = True # Data read will only expect responses to commands
-                    self.commandResponsePipe.send(f"Received {self.packetCount} packets")
-                    self.packetCount = 0
-                    # Waits for eeg data to finish arriving and throws it away, old usage, should be included if pyserial reset is removed
-                    # sleep(0.5) 
-                    # self.serialGUISide.reset_input_buffer()
-                    self.resetPyserial() # Issues appear on stop, pyserial reset fixes them
-                elif command == "pyserialReset": 
-                   self.resetPyserial()
-
-    # Works to reset the pyserial connection with the USB, fixes many connection issues
-    def resetPyserial(self):
-
-        # Closes and recreates connection and then throws away any remaining data in buffers
-        self.serialGUISide.close()
-        self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True)
-        self.serialGUISide.reset_output_buffer()
-        self.serialGUISide.reset_input_buffer()
-
-        # Checks new connections is successful by writing 'single' command and looking for response
-        self.serialGUISide.write(("single \n").encode()) 
-        print("Connection reset, writing single to chip and looking for response")
-        sleep(0.1)
-
-        if self.serialGUISide.in_waiting == 0: # If no response is found it tries resetting the connection again
-            print("No response, resetting again")
-            self.serialGUISide.close()
-            self.serialGUISide = serial.Serial(self.port, 115200, rtscts=True)
-            self.serialGUISide.reset_output_buffer()
-            self.serialGUISide.reset_input_buffer()
-            self.serialGUISide.write(("single \n").encode())
-            print("Connection reset, writing single to chip and looking for response")
-            sleep(0.1)
-
-            if self.serialGUISide.in_waiting == 0: # Gives up after two attempts, can retry by clicking button again
-                print("No response, connection reestablishment failure")
-
-        if self.serialGUISide.in_waiting > 0: # If a response is found, the reset has succeeded and the response is thrown away
-            print("Response obtained, connection reestablishment success")
-            self.serialGUISide.reset_input_buffer()
-
-    # Handles all data reading from the pyserial port, saves eeg data so it can be accessed by the rest of the GUI
-    def updateData(self):
-
-        if self.commandMode: # Indicates GUI is not expecting eeg data to be streaming, just command responses
-            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
-            if self.serialGUISide.in_waiting > 0: # If data exists to be read
-                sleep(0.1) # Make sure full response is transmitted
-                val = b''
-                val += self.serialGUISide.read(self.serialGUISide.in_waiting) # Reads all data from the USB dongle
-                # Currently reponses are handled in hex as that is how the chip sends them, text responses can be decoded with code below
-                print("Chip response: " + str(val.hex()))
-                self.commandResponsePipe.send("Chip: " + str(val.hex()))
-                # print("Chip response: " + val.decode())
-                # self.commandResponsePipe.send("Chip: " + val.decode())
-                
-
-        elif self.serialGUISide.in_waiting > 0: # If data exists to be read
-            if self.serialGUISide.in_waiting < 6: #TODO
-                self.serialGUISide.reset_input_buffer()
-
-            val = b''
-            val += self.serialGUISide.read(65) # Reads one packet of eeg data which is always exactly 65 bytes long
-            self.packetCount += 1
-
-            packetId = int.from_bytes(val[:1], "big") # Extracts packet id from first byte
-            
-            saveData = [packetId]
-
-            idx = 0
-            for i in range(1, len(val) - 1, self.numChannels):
-                # Decodes one channel (eight bytes) at a time from the packet
-                chxEEG = int.from_bytes(val[i:i+4], "big", signed=True)
-                chxI = int.from_bytes(val[i+4:i+6], "big", signed=True)
-                chxQ = int.from_bytes(val[i+6:i+8], "big", signed=True)
-
-                # Fills the channels multiprocessing array with the new data
-                with self.channelDataArr[idx].get_lock():
-                    self.channelDataArr[idx].packetId = packetId
-                    self.channelDataArr[idx].chxEEG = chxEEG
-                    self.channelDataArr[idx].chxI = chxI
-                    self.channelDataArr[idx].chxQ = chxQ
-                idx += 1
-
-                saveData.extend((chxEEG, chxI, chxQ)) # Data is added here to be saved later
-            
-            self.saveDataQueue.put(saveData) # The full packet of data is sent to be saved by the SaveDataWriter
-
-# Class allows for construction of the multiprocessing array to share channel data
-class ChannelData(Structure):
-    _fields_ = [("packetId", c_ubyte), ("chxEEG", c_int), ("chxI", c_short), ("chxQ", c_short)]
+import guiEvents
+import guiRecording
 
 # Button to pull up the data saving options
 class SaveDataMenuButton(QPushButton):
@@ -205,20 +70,49 @@ class SaveDataMenu(QWidget):
 
 class SaveDataWriter(QWidget):
 
-    def __init__(self, running, numChannels, saveDataQueue, saveDataMenuButton):
+    def __init__(self, running, numChannels, sampleRate, saveDataQueue, saveDataMenuButton, eventRecorder, chatWindow):
 
         super().__init__()
 
+        self.numChannels = numChannels
+        self.sampleRate = sampleRate
+        self.recordingWriter = None # Writes the binary copy of the current recording, used by scrollback to browse the whole session
+        self.eventRecorder = eventRecorder # Cue events are taken from here and written next to the current recording
+
         # Header format: ["packet_id", "chx1_eeg", "chx1_i", "chx1_q", "chx2_eeg", "chx2_i", "chx2_q", ...]
         self.header = ["packet_id"] + [itm for lst in [[chxNum + "_eeg", chxNum + "_i", chxNum + "_q"] for chxNum in ["chx" + str(i) for i in range(numChannels)]] for itm in lst]
 
         self.running = running
         self.saveDataQueue = saveDataQueue
         self.saveDataMenuButton = saveDataMenuButton
+        self.chatWindow = chatWindow # Told when the save queue backs up and what its policy did about it
+
+        # A continuous run is split into segments of at most rotateSeconds or rotateBytes of binary data, each numbered like a new start/stop
+        # None turns either limit off, the next segment's files are opened prepareSeconds before they're needed
+        self.rotateSeconds = 3600
+        self.rotateBytes = 1 << 30
+        limits = [limit for limit in [self.rotateSeconds and self.rotateSeconds * sampleRate, self.rotateBytes and self.rotateBytes // ((1 + 3 * numChannels) * 4)] if limit]
+        self.segmentRows = min(limits) if limits else None # Packets per segment
+        self.prepareRows = 10 * sampleRate
+        self.csvFile = None # Open csv of the current segment
+        self.csvWriter = None
+        self.nextSegment = None # (csvFilename, csvFile, recordingWriter) opened ahead of the next rotation
+        self.nextStartTime = None # Start time of the next segment when continuing a run, None when a new run starts
+        self.finaliser = ThreadPoolExecutor(1) # Closes, syncs and indexes finished segments so writing never waits on it
+        self.finalising = [] # Futures of segments being finalised, errors are reported in the chat
 
         self.setCurrFilename()
 
         self.refreshRate = 5 # Refresh rate in ms, controls how often new data is looked for
+        self.maxBatch = sampleRate # Most packets written per refresh, enough to catch up from a backlog within a few refreshes
+        self.highWater = int(0.8 * saveDataQueue.capacity) # Queue depth that triggers a warning, rearmed once it drains below half
+        self.highWaterWarned = False
+        self.reportedStats = saveDataQueue.stats() # Policy counters as of the last report, only changes since then are reported
+        self.lastReportTime = 0
+        self.reportInterval = 2 # Seconds between reports while the policy keeps acting, so the chat isn't flooded
+        self.syncSeconds = 1 # The binary recording is fsynced at least this often, at most this much is lost if the computer crashes
+        self.syncBytes = 1 << 22 # or whenever this many bytes have built up, recover with 'python guiRecording.py recover'
+        self.indexEvery = sampleRate # Packets between sparse index records, see guiRecording.RecordingReader
 
         self.hide()
 
@@ -231,31 +125,183 @@ class SaveDataWriter(QWidget):
 
     def writeData(self):
 
-        if bool(self.saveDataMenuButton.menu.saveState) and bool(self.running.value) and not self.saveDataQueue.empty():
-            saveData = self.saveDataQueue.get() # Possibly not exitable on windows? https://docs.python.org/3/library/queue.html#put
-            shouldWriteHeader = not os.path.exists(self.currFilename)
+        self.checkSaveQueue()
+        self.checkFinalising()
+        self.writeEvents()
+        if not (bool(self.running.value) and self.saveDataMenuButton.menu.saveState.isChecked()):
+            self.eventRecorder.takePending() # Events while not recording have no saved data to line up with
 
-            with open(self.currFilename, 'a') as csvfile:
-                dataWriter = writer(csvfile) # CSV writer
-                if shouldWriteHeader:
-                    dataWriter.writerow(self.header)
-                dataWriter.writerow(saveData)
-            self.updatedExtenstion = False
+        if self.saveDataMenuButton.menu.saveState.isChecked() and bool(self.running.value):
+            self.writeBatch(self.saveDataQueue.getBatch(self.maxBatch)) # Everything waiting (up to maxBatch) is written at once so a backlog is caught up on
 
         elif (not self.updatedExtenstion or self.saveDataMenuButton.menu.updatedFilename) and not bool(self.running.value):
             self.setCurrFilename()
 
-        # This clause works to empty the queue if the user hasn't yet clicked start
-        elif not bool(self.running.value) and not self.saveDataQueue.empty():
-            self.saveDataQueue.get()
+        # This clause works to empty the queue while nothing is being saved (not yet started, or running with saving unchecked)
+        else:
+            self.saveDataQueue.getBatch(self.maxBatch)
+
+    # Appends a batch of (sampleIndex, saveData) packets to the current recording's csv and binary files
+    # The batch is split exactly at a rotation, so the first packet of a segment follows straight on from the last of the one before
+    def writeBatch(self, batch):
+
+        while batch:
+            if self.recordingWriter is None:
+                self.startSegment()
+            numRows = len(batch) if self.segmentRows is None else min(len(batch), self.segmentRows - self.recordingWriter.numRows)
+            sampleIndices = [sampleIndex for sampleIndex, _ in batch[:numRows]]
+            rows = [saveData for _, saveData in batch[:numRows]]
+            batch = batch[numRows:]
+
+            self.csvWriter.writerows(rows)
+            self.csvFile.flush()
+            self.recordingWriter.writeRows(rows, sampleIndices, self.eventRecorder.hostTimeAt(sampleIndices[-1]))
+            self.updatedExtenstion = False
+
+            if self.segmentRows is not None:
+                if self.recordingWriter.numRows >= self.segmentRows:
+                    self.rotate()
+                elif self.nextSegment is None and self.segmentRows - self.recordingWriter.numRows <= self.prepareRows:
+                    self.nextSegment = self.openSegment(self.freeFilename())
+
+    # Returns (csvFilename, csvFile, recordingWriter) for a new segment, the binary header is only written with its first rows
+    def openSegment(self, csvFilename):
+
+        csvFile = open(csvFilename, 'a')
+        recordingWriter = guiRecording.RecordingWriter(guiRecording.binFilename(csvFilename), self.numChannels, self.sampleRate, None, self.syncSeconds, self.syncBytes, self.indexEvery)
+        return csvFilename, csvFile, recordingWriter
+
+    # Makes the segment opened ahead of time (or a newly opened one) current
+    def startSegment(self):
+
+        if self.nextSegment is None:
+            self.nextSegment = self.openSegment(self.currFilename)
+        self.currFilename, self.csvFile, self.recordingWriter = self.nextSegment
+        self.nextSegment = None
+
+        self.recordingWriter.startTime = time() if self.nextStartTime is None else self.nextStartTime
+        self.csvWriter = writer(self.csvFile) # CSV writer
+        self.csvWriter.writerow(self.header)
+
+    # Ends the current segment during a run, the next packet starts the next one
+    def rotate(self):
+
+        self.writeEvents() # Events up to this segment's last packet
+        self.nextStartTime = self.recordingWriter.startTime + self.recordingWriter.numRows / self.sampleRate
+        if self.nextSegment is None:
+            self.nextSegment = self.openSegment(self.freeFilename())
+        self.chatWindow.addMessage("Recording continues in " + os.path.basename(self.nextSegment[0]))
+        self.finaliseSegment()
+
+    # Hands the current segment to the finaliser and forgets it, anything still viewing it (e.g. scrollback) keeps its own reference
+    def finaliseSegment(self):
+
+        if self.recordingWriter is not None:
+            self.finalising.append(self.finaliser.submit(finaliseSegment, self.csvFile, self.recordingWriter))
+        self.csvFile = None
+        self.csvWriter = None
+        self.recordingWriter = None
+
+    # Closes and deletes the segment opened ahead of time when the run ends before it's used
+    def discardNextSegment(self):
+
+        if self.nextSegment is None:
+            return
+        csvFilename, csvFile, recordingWriter = self.nextSegment
+        self.nextSegment = None
+        csvFile.close()
+        recordingWriter.close()
+        for filename in [csvFilename, recordingWriter.filename, guiRecording.checksumFilename(recordingWriter.filename), guiRecording.indexFilename(recordingWriter.filename)]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    # Reports segments that couldn't be finalised, the rows are on disk but may need 'python guiRecording.py recover'
+    def checkFinalising(self):
+
+        for future in [future for future in self.finalising if future.done()]:
+            self.finalising.remove(future)
+            if future.exception() is not None:
+                self.chatWindow.addMessage("Couldn't finalise recording: " + str(future.exception()))
+
+    # Called when the GUI closes, writes whatever is still queued for the current recording and syncs it, rather than losing it
+    def finish(self):
+
+        self.timer.stop()
+        if self.saveDataMenuButton.menu.saveState.isChecked() and bool(self.running.value):
+            batch = self.saveDataQueue.getBatch(self.maxBatch)
+            while batch:
+                self.writeBatch(batch)
+                batch = self.saveDataQueue.getBatch(self.maxBatch)
+            self.writeEvents(final=True)
+        self.finaliseSegment()
+        self.discardNextSegment()
+        self.finaliser.shutdown(wait=True) # Every segment is closed and synced before the GUI exits
+
+    # Warns in the chat once the save queue passes its high water mark, and reports whatever its policy did to keep up
+    def checkSaveQueue(self):
+
+        stats = self.saveDataQueue.stats()
+        if stats["depth"] >= self.highWater and not self.highWaterWarned:
+            self.highWaterWarned = True
+            self.chatWindow.addMessage("Warning: saving is falling behind, " + str(stats["depth"]) + " of " + str(self.saveDataQueue.capacity) + " packets queued (policy: " + self.saveDataQueue.policy + ")")
+        elif stats["depth"] < self.saveDataQueue.capacity // 2:
+            self.highWaterWarned = False
+
+        changed = [name for name in ["dropped", "blocked", "spilled", "spillPending"] if stats[name] != self.reportedStats[name]]
+        if changed and monotonic() - self.lastReportTime >= self.reportInterval:
+            self.chatWindow.addMessage(self.saveQueueReport(stats))
+            self.reportedStats = stats
+            self.lastReportTime = monotonic()
+
+    # Describes the save queue's policy counters since startup
+    def saveQueueReport(self, stats):
+
+        report = "Save queue (max " + str(stats["maxDepth"]) + "/" + str(self.saveDataQueue.capacity) + " queued):"
+        if stats["dropped"]:
+            report += " " + str(stats["dropped"]) + " packets dropped, recordings have gaps;"
+        if stats["blocked"]:
+            report += " reader blocked " + str(stats["blocked"]) + " times for " + str(round(stats["blockedSeconds"], 2)) + "s;"
+        if stats["spilled"]:
+            report += " " + str(stats["spilled"]) + " packets spilled to disk, " + str(stats["spillPending"]) + " not yet written back;"
+        return report.rstrip(";")
+
+    # Appends the pending cue events up to the last packet written to the current recording's event table
+    # Later events stay pending until their packets are written, the save queue can be far enough behind for them to be marked already,
+    # and they may belong to the next segment. final takes every event, for when no more packets will be written
+    def writeEvents(self, final=False):
+
+        if self.recordingWriter is None or self.recordingWriter.lastSampleIndex is None or not self.eventRecorder.pending:
+            return
+
+        pending = self.eventRecorder.takePending(None if final else self.recordingWriter.lastSampleIndex + 1)
+        if pending:
+            guiEvents.writeEvents(guiEvents.eventFilename(self.currFilename), pending, self.recordingWriter)
 
     def setCurrFilename(self):
 
-        idx = 0
-        self.currFilename = "../data/" + str(self.saveDataMenuButton.menu.filename) + "-" + str(idx) + ".csv"
-        while os.path.exists(self.currFilename):
-            idx += 1
-            self.currFilename = "../data/" + str(self.saveDataMenuButton.menu.filename) + "-" + str(idx) + ".csv"
+        self.finaliseSegment() # The next rows go to a new file
+        self.discardNextSegment()
+        self.nextStartTime = None
+
+        self.currFilename = self.freeFilename()
         self.updatedExtenstion = True
         self.saveDataMenuButton.menu.updatedFilename = False
-        
\ No newline at end of file
+
+    # Returns the first "../data/<filename>-<idx>.csv" that doesn't exist yet
+    def freeFilename(self):
+
+        idx = 0
+        filename = "../data/" + str(self.saveDataMenuButton.menu.filename) + "-" + str(idx) + ".csv"
+        while os.path.exists(filename):
+            idx += 1
+            filename = "../data/" + str(self.saveDataMenuButton.menu.filename) + "-" + str(idx) + ".csv"
+        return filename
+
+# Run on the SaveDataWriter's finaliser thread once a segment is finished: closes (and so syncs) it, then saves its pyramids so
+# scrollback and the offline tools can open it without reading it all again
+def finaliseSegment(csvFile, recordingWriter):
+
+    csvFile.close()
+    recordingWriter.close()
+    if recordingWriter.numRows:
+        recordingWriter.savePyramids()
@@ -0,0 +1,185 @@
+import math
+import multiprocessing as mp
+from time import sleep
+
+# The DataProcesses that compute each graph's points in their own processes, kept apart from the plot widgets that draw them
+# so those processes only import what the computation needs (no Qt or pyqtgraph)
+
+# Starts the process running an update loop the first time one of the DataProcesses it computes is subscribed
+# Graphs are only computed while on screen anyway, so a graph nobody ever looks at doesn't cost a process or slow down startup
+class ProcessLauncher():
+
+    def __init__(self, target):
+
+        self.target = target # Update loop to run, e.g. a DataProcess's startUpdateData
+        self.process = None
+
+    def start(self):
+
+        if self.process is None:
+            self.process = mp.Process(target=self.target)
+            self.process.daemon = True # Forces processes to end when program is closed
+            self.process.start()
+
+# Abstract class defining methods needed in all data processes, each distinct graph will have an implementation of this
+class DataProcess():
+
+    plotWidgetType = "CustomPlotWidget" # Name of the guiPlots class of plot the PlotWidgetPool draws this with, a name so this module needs no Qt
+
+    def __init__(self, running, latestSnapshot, x, y, xAxisLength, rawRingBuffer=None, channelIdx=0):
+
+        self.running = running
+        self.latestSnapshot = latestSnapshot # Newest packet of every channel, shared with the SerialReader
+        self.xAxisLength = xAxisLength
+        self.rawRingBuffer = rawRingBuffer # Recent raw packets, used to fill the graph immediately when it starts being computed
+        self.channelIdx = channelIdx # Channel this graph shows, used to find its data in latestSnapshot and rawRingBuffer
+        self.currPacket = -1
+        self.counter = -1 # Determines values on graph X axis, starts at -1 as first packet is (theoretically, usually not actually) 0
+
+        # These must be multiprocessing sync manager arrays so the data can be shared back to the process drawing the graphs
+        self.x = x
+        self.x[:] = list(range(-xAxisLength.value, 0))
+        self.y = y
+        self.y[:] = [0] * xAxisLength.value
+        self.lock = mp.RLock()
+
+        # Let plots fetch only what changed, numPushed counts points added by pushPoint and numReplaced counts full rewrites (e.g. resizes)
+        self.numPushed = mp.Value('q', 0)
+        self.numReplaced = mp.Value('q', 0)
+
+        # Number of things (plots on screen, recordings) currently using this graph, data is only computed while there is at least one
+        self.numSubscribers = mp.Value('i', 0)
+        self.computing = False
+        self.launcher = None # ProcessLauncher of the process computing this graph, None if it's computed some other way (or already running)
+
+        self.refreshRate = 2 # Refresh rate in ms, controls how often new data is looked for
+        self.idleRefreshRate = 50 # Refresh rate in ms while nobody is subscribed, only checks whether that has changed
+
+    # Registers interest in this graph, starts it being computed if it wasn't already
+    def subscribe(self):
+
+        with self.numSubscribers.get_lock():
+            self.numSubscribers.value += 1
+        if self.launcher is not None:
+            self.launcher.start()
+
+    # Removes interest registered by subscribe, computation stops once nobody is left
+    def unsubscribe(self):
+
+        with self.numSubscribers.get_lock():
+            self.numSubscribers.value = max(0, self.numSubscribers.value - 1)
+
+    # The launcher holds the process running this object, it stays behind in the main process when this is sent to that process
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state["launcher"] = None
+        return state
+
+    # Starts a loop to call the updateData function 
+    def startUpdateData(self):
+
+        while True:
+            if self.numSubscribers.value == 0:
+                self.computing = False
+                sleep(self.idleRefreshRate * 0.001)
+                continue
+
+            if bool(self.running.value):
+                if not self.computing: # Just subscribed, fills the graph with recent data so it doesn't start empty
+                    self.backfill()
+                    self.computing = True
+                self.updateData()
+
+            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+
+    # Recomputes the whole graph from the most recent packets in rawRingBuffer
+    def backfill(self):
+
+        if self.rawRingBuffer is None:
+            return
+
+        length = self.xAxisLength.value
+        packetIds, samples = self.rawRingBuffer.readLatest(length)
+        if len(packetIds) == 0:
+            return
+
+        newY = [self.calculateY(*sample) for sample in samples[:, self.channelIdx].tolist()] # tolist gives python ints so nothing can overflow
+        newestPacket = int(packetIds[-1])
+        self.counter += (newestPacket - self.currPacket) % 256
+        self.currPacket = newestPacket
+
+        # Backfilled packets are assumed to be consecutive, anything older than the ring buffer is left as 0
+        with self.lock:
+            self.x[:] = list(range(self.counter - length + 1, self.counter + 1))
+            self.y[:] = [0] * (length - len(newY)) + newY
+            self.numReplaced.value += 1
+
+    # Recalculates the graphical data to return based on the raw input
+    def updateData(self):
+        # newX = self.counter.value + 1 # Old version, use if difference between the current and next packet ID isn't working
+        packetId, chxEEG, chxI, chxQ = self.latestSnapshot.readChannel(self.channelIdx)
+        newY = self.calculateY(chxEEG, chxI, chxQ)
+        newX = self.counter + ((packetId - self.currPacket) % 256) # Assuming no dropped packets this should be 1, % 256 as packets are 0-255
+
+        if self.currPacket != packetId:
+            self.pushPoint(newX, newY)
+            self.currPacket = packetId
+            self.counter = newX 
+
+    # Scrolls the graph data one point to the left and adds (newX, newY) on the right
+    def pushPoint(self, newX, newY):
+        # If the graph appears as if it is dropping packets you can in theory use a non-locked array to keep track of values
+        # Append and delete only send one value to the manager each, copying the whole list gets slow with long x axes
+        with self.lock:
+            self.x.append(newX)
+            del self.x[0]
+            self.y.append(newY)
+            del self.y[0]
+            self.numPushed.value += 1
+
+    def resizeXAxis(self, newXAxisLength):
+        currXAxisLength = self.xAxisLength.value
+        if newXAxisLength > currXAxisLength:
+            diff = newXAxisLength - currXAxisLength
+
+            with self.lock:
+                self.x[:] = list(range(self.x[0] - diff, self.x[0])) + self.x[:]
+                self.y[:] = ([0] * diff) + self.y[:]
+                self.numReplaced.value += 1
+
+            with self.xAxisLength:
+                self.xAxisLength.value = newXAxisLength
+
+        elif newXAxisLength < currXAxisLength:
+            diff = currXAxisLength - newXAxisLength
+
+            with self.lock:
+                self.x[:] = self.x[diff:]
+                self.y[:] = self.y[diff:]
+                self.numReplaced.value += 1
+
+            with self.xAxisLength:
+                self.xAxisLength.value = newXAxisLength
+
+# Data process for a simple sine wave
+class EEGDataProcess(DataProcess):
+
+    def calculateY(self, chxEEG, chxI, chxQ):
+
+        return chxEEG
+
+# Data process for a simple sine wave
+class IQMagDataProcess(DataProcess):
+
+    def calculateY(self, chxEEG, chxI, chxQ):
+        
+        return math.sqrt(chxI**2 + chxQ**2)
+    
+# Data process for a simple sine wave
+class IQPhaseDataProcess(DataProcess):
+
+    def calculateY(self, chxEEG, chxI, chxQ):
+        if chxI == 0:
+            return 0
+        return math.atan(chxQ / chxI)
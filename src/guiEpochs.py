@@ -0,0 +1,245 @@
+import multiprocessing as mp
+from queue import Empty
+from time import sleep
+import numpy as np
+
+import guiDSP
+import guiEvents
+from guiDataProcesses import DataProcess
+from guiSpectral import SpectralTrace
+
+# Cue events an epoch is cut around, the blink cue for the eye blink test and the stimulus onset for the ASSR tests
+onsetCodes = [guiEvents.eventCodes[name] for name in ["blink", "clicks", "pureTone", "whiteNoise"]]
+assrCodes = [guiEvents.eventCodes[name] for name in ["clicks", "pureTone", "whiteNoise"]] # Onsets of the stimuli an ASSR is measured for
+
+# Averages the EEG of every channel around each cue onset while a cue test is running, so the response can be watched converging
+# Onsets arrive from the EventRecorder as acquisition indices, once the whole window after an onset has arrived it is cut from rawRingBuffer
+# The mean and variance are kept with welford's running update, so each new epoch only costs one pass over the window
+class EpochDataProcess():
+
+    def __init__(self, running, rawRingBuffer, sampleRate, amFreq, eventQueue, traceLists, snrTraceLists, xAxisLength):
+
+        self.running = running
+        self.rawRingBuffer = rawRingBuffer
+        self.numChannels = rawRingBuffer.numChannels
+        self.sampleRate = sampleRate
+        self.eventQueue = eventQueue # (sampleIndex, code) tuples sent by the EventRecorder
+
+        self.preSeconds = 0.2 # Time shown before each onset, also used as the baseline subtracted from each epoch
+        self.postSeconds = 1 # Time shown after each onset
+        self.preLength = int(self.preSeconds * sampleRate)
+        self.windowLength = self.preLength + int(self.postSeconds * sampleRate)
+        self.lags = (np.arange(self.windowLength) - self.preLength) / sampleRate # Time of each point relative to the onset in seconds
+
+        self.pendingOnsets = [] # Onsets whose window hasn't fully arrived yet
+        self.resetAverage()
+
+        # traceLists provides the (x, y, se) managed lists for every channel's trace
+        self.traces = [EpochTrace(running, *lists, mp.Value('i', self.windowLength), self.lags) for lists in traceLists]
+
+        # The ASSR SNR is measured from the same events, one point per analysed segment is added to each channel's snrTrace
+        self.assrEstimator = AssrEstimator(rawRingBuffer, sampleRate, amFreq)
+        self.snrTraces = [SpectralTrace(running, *lists, mp.Value('i', xAxisLength)) for lists in snrTraceLists]
+        self.publishing = False
+
+        self.refreshRate = 20 # Refresh rate in ms, epochs only complete a few times a second at most
+        self.idleRefreshRate = 50 # Refresh rate in ms while none of the traces are subscribed
+
+    # Forgets every epoch, called at the start of each test
+    def resetAverage(self):
+
+        self.numEpochs = 0
+        self.mean = np.zeros((self.numChannels, self.windowLength))
+        self.m2 = np.zeros((self.numChannels, self.windowLength)) # Sum of squared differences from the mean, variance is m2 / (n - 1)
+
+    # Number of (x, y, se) list triples the constructor needs in traceLists, and of (x, y) pairs in snrTraceLists
+    @staticmethod
+    def numTraces(numChannels):
+
+        return numChannels
+
+    # Returns ("Graph Name", DataProcess) tuples for every trace so they can be added to the selectable graphs
+    def getPlotDataProcesses(self):
+
+        return [("Ch " + str(ch) + " epoch average", trace) for ch, trace in enumerate(self.traces)] + [("Ch " + str(ch) + " ASSR SNR", trace) for ch, trace in enumerate(self.snrTraces)]
+
+    def isSubscribed(self):
+
+        return any(trace.numSubscribers.value > 0 for trace in self.traces)
+
+    # Starts a loop to call the updateData function
+    # Epochs are averaged even while nothing is subscribed as they're cheap and can't be recovered once out of rawRingBuffer
+    def startUpdateData(self):
+
+        while True:
+            changed = self.updateData()
+
+            # SNR points arrive once a second at most, they're always pushed so the history is complete whenever it's looked at
+            for snr in self.assrEstimator.update():
+                for ch, trace in enumerate(self.snrTraces):
+                    trace.pushPoint(self.assrEstimator.numSegments.value, float(snr[ch]))
+
+            if not self.isSubscribed():
+                self.publishing = False
+                sleep(self.idleRefreshRate * 0.001)
+                continue
+
+            if changed or not self.publishing: # Just subscribed traces are sent the average so far
+                self.publish()
+                self.publishing = True
+
+            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+
+    # Takes new events and averages in every epoch whose window has arrived, returns whether the average changed
+    def updateData(self):
+
+        changed = False
+        while True:
+            try:
+                sampleIndex, code = self.eventQueue.get_nowait()
+            except Empty:
+                break
+            if code == guiEvents.eventCodes["testStart"]:
+                self.pendingOnsets = []
+                self.resetAverage()
+                self.assrEstimator.reset()
+                changed = True
+            elif code in onsetCodes:
+                self.pendingOnsets.append(sampleIndex)
+
+            # A stimulus plays from its onset until the next cue, so the next event ends the listen period
+            if code in assrCodes:
+                self.assrEstimator.startListen(sampleIndex)
+            else:
+                self.assrEstimator.endListen(sampleIndex)
+
+        numWritten = self.rawRingBuffer.numWritten.value
+        while self.pendingOnsets and self.pendingOnsets[0] - self.preLength + self.windowLength <= numWritten:
+            onset = self.pendingOnsets.pop(0)
+            epoch = self.rawRingBuffer.readRange(onset - self.preLength, self.windowLength)
+            if epoch is not None: # Windows starting before acquisition or already overwritten are skipped
+                self.addEpoch(epoch[1][:, :, 0].T.astype(float))
+                changed = True
+
+        return changed
+
+    # Adds one (channels, windowLength) epoch to the running mean and variance
+    def addEpoch(self, epoch):
+
+        if self.preLength > 0: # Removes each channel's offset before the onset so slow drifts don't add to the variance
+            epoch = epoch - epoch[:, :self.preLength].mean(axis=1, keepdims=True)
+        self.numEpochs += 1
+        delta = epoch - self.mean
+        self.mean += delta / self.numEpochs
+        self.m2 += delta * (epoch - self.mean)
+
+    # Sends the current mean and standard error to every trace
+    def publish(self):
+
+        if self.numEpochs > 1:
+            se = np.sqrt(self.m2 / (self.numEpochs - 1) / self.numEpochs)
+        else:
+            se = np.zeros_like(self.mean)
+        for ch, trace in enumerate(self.traces):
+            trace.setAverage(self.mean[ch].tolist(), se[ch].tolist(), self.numEpochs)
+
+# Measures the auditory steady state response of every channel as the SNR at the AM (or click) frequency over the listen periods of a test
+# Each listen period is split into 1s segments as they arrive, the spectrum of each is added to a running average over the whole test,
+# and the power in the AM frequency bin is compared to the mean power of the bins around it, which converges as segments accumulate
+class AssrEstimator():
+
+    def __init__(self, rawRingBuffer, sampleRate, amFreq):
+
+        self.rawRingBuffer = rawRingBuffer
+        self.numChannels = rawRingBuffer.numChannels
+        self.sampleRate = sampleRate
+        self.amFreq = amFreq # Shared value set by the cue system when an ASSR test is configured
+
+        segmentSeconds = 1 # AM and click frequencies are whole Hz so they fall exactly on a bin, which also means no taper is needed
+        self.segmentLength = int(segmentSeconds * sampleRate)
+        self.window = np.ones(self.segmentLength)
+        self.freqs = guiDSP.rfftFreqs(self.segmentLength, sampleRate)
+        self.numNoiseBins = 5 # Bins either side of the AM frequency averaged for the noise estimate
+
+        # Latest SNR (dB) of every channel and the number of segments it's from, shared so the cue system can show them
+        self.snr = mp.Array('d', self.numChannels)
+        self.numSegments = mp.Value('i', 0)
+        self.reset()
+
+    # Forgets every segment, called at the start of each test
+    def reset(self):
+
+        self.psdSum = np.zeros((self.numChannels, len(self.freqs)))
+        self.listenPeriods = [] # [start of next segment, end] of listen periods not fully analysed yet, end is None until known
+        with self.numSegments.get_lock():
+            self.numSegments.value = 0
+            self.snr[:] = [0] * self.numChannels
+
+    def startListen(self, onset):
+
+        self.endListen(onset)
+        self.listenPeriods.append([onset, None])
+
+    def endListen(self, sampleIndex):
+
+        if self.listenPeriods and self.listenPeriods[-1][1] is None:
+            self.listenPeriods[-1][1] = sampleIndex
+
+    # Analyses every complete segment that has arrived, returns the SNR of every channel after each one
+    def update(self):
+
+        snrs = []
+        numWritten = self.rawRingBuffer.numWritten.value
+        while self.listenPeriods:
+            segmentStart, listenEnd = self.listenPeriods[0]
+            segmentEnd = segmentStart + self.segmentLength
+            if listenEnd is not None and segmentEnd > listenEnd: # Partial segments at the end of a listen period are dropped
+                self.listenPeriods.pop(0)
+                continue
+            if segmentEnd > numWritten:
+                break
+
+            segment = self.rawRingBuffer.readRange(segmentStart, self.segmentLength)
+            self.listenPeriods[0][0] = segmentEnd
+            if segment is None:
+                continue
+
+            self.psdSum += guiDSP.periodograms(segment[1][:, :, 0].T.astype(float), self.window, self.sampleRate)
+            snr = guiDSP.binSNR(self.psdSum, self.freqs, self.amFreq.value, self.numNoiseBins) # Scaling by the count cancels in the ratio
+            with self.numSegments.get_lock():
+                self.numSegments.value += 1
+                self.snr[:] = snr.tolist()
+            snrs.append(snr)
+        return snrs
+
+# Epoch averaged trace of one channel, x is time relative to the onset so it has a fixed length and isn't affected by x axis resizing
+class EpochTrace(DataProcess):
+
+    plotWidgetType = "EpochPlotWidget"
+
+    def __init__(self, running, x, y, se, xAxisLength, lags):
+
+        super().__init__(running, None, x, y, xAxisLength)
+        self.se = se # Standard error of each point of the mean
+        self.numEpochs = mp.Value('i', 0)
+        with self.lock:
+            self.x[:] = lags.tolist()
+            self.y[:] = [0] * len(lags)
+            self.se[:] = [0] * len(lags)
+            self.numReplaced.value += 1
+
+    def startUpdateData(self):
+
+        pass # Data is pushed by the EpochDataProcess that owns this trace
+
+    def setAverage(self, mean, se, numEpochs):
+
+        with self.lock:
+            self.y[:] = mean
+            self.se[:] = se
+            self.numEpochs.value = numEpochs
+            self.numReplaced.value += 1
+
+    def resizeXAxis(self, newXAxisLength):
+
+        pass
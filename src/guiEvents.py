@@ -0,0 +1,74 @@
+import os, threading
+from time import monotonic, time
+import numpy as np
+
+# Cue events are saved next to each recording with the same name and a .evt extension, as a flat table of eventDtype records
+# recordingIndex is the row of the recording (csv line after the header / binary row) the event happened at, so epochs can be cut by index
+eventCodes = {
+    "testStart": 1, "testStop": 2, "startDelay": 3, "endDelay": 4,
+    "rest": 10, "blink": 11, "eyesOpen": 12, "eyesClosed": 13, "listen": 14,
+    "beep": 20, "clicks": 21, "pureTone": 22, "whiteNoise": 23,
+}
+eventNames = {code: name for name, code in eventCodes.items()}
+eventDtype = np.dtype([("recordingIndex", "<i8"), ("sampleIndex", "<i8"), ("time", "<f8"), ("code", "<i4")])
+
+# Returns the event table filename that goes with a csv (or binary) recording filename
+def eventFilename(recordingFilename):
+
+    return os.path.splitext(recordingFilename)[0] + ".evt"
+
+# Reads a whole event table as a numpy structured array with eventDtype fields
+def readEvents(filename):
+
+    return np.fromfile(filename, dtype=eventDtype)
+
+# Appends (sampleIndex, time, code) events to the event table of the recording recordingWriter is writing
+# Rows are looked up through the acquisition indices actually written, so events after packets the save queue dropped still line up
+def writeEvents(filename, pending, recordingWriter):
+
+    events = np.empty(len(pending), dtype=eventDtype)
+    events["sampleIndex"] = [event[0] for event in pending]
+    events["recordingIndex"] = recordingWriter.rowsAt(events["sampleIndex"])
+    events["time"] = [event[1] for event in pending]
+    events["code"] = [event[2] for event in pending]
+    with open(filename, 'ab') as eventFile:
+        eventFile.write(events.tobytes())
+
+# Timestamps events with the monotonic clock and maps them to the acquisition sample index they happened at
+# Events are kept until the SaveDataWriter takes them to write next to the current recording, events can be marked from any thread
+class EventRecorder():
+
+    def __init__(self, rawRingBuffer, sampleRate, eventQueue=None, latencies=None):
+
+        self.rawRingBuffer = rawRingBuffer # Knows the index and arrival time of the newest packet
+        self.sampleRate = sampleRate
+        self.eventQueue = eventQueue # If given every event is also sent here as (sampleIndex, code), used by the live epoch averaging
+        self.latencies = dict(latencies or {}) # Seconds between marking and the event actually happening by event name, e.g. audio output latency
+        self.pending = [] # (sampleIndex, time, code) tuples not yet written
+        self.lock = threading.Lock()
+
+    def mark(self, name, eventTime=None):
+
+        eventTime = (monotonic() if eventTime is None else eventTime) + self.latencies.get(name, 0)
+        sampleIndex = self.rawRingBuffer.sampleIndexAt(eventTime, self.sampleRate)
+        with self.lock:
+            self.pending.append((sampleIndex, eventTime, eventCodes[name]))
+        if self.eventQueue is not None:
+            self.eventQueue.put((sampleIndex, eventCodes[name]))
+
+    # Wall clock time (seconds since epoch) the packet at sampleIndex arrived, used to index recordings by host time
+    def hostTimeAt(self, sampleIndex):
+
+        return time() - monotonic() + self.rawRingBuffer.timeAt(sampleIndex, self.sampleRate)
+
+    # Returns and forgets every pending event, or only those before acquisition index stopIndex if it's given, the rest stay pending
+    def takePending(self, stopIndex=None):
+
+        with self.lock:
+            if stopIndex is None:
+                pending = self.pending
+                self.pending = []
+            else:
+                pending = [event for event in self.pending if event[0] < stopIndex]
+                self.pending = [event for event in self.pending if event[0] >= stopIndex]
+        return pending
@@ -0,0 +1,61 @@
+import os, sys, json, argparse, subprocess
+
+# Reports what starting each kind of process costs: how long its imports take, its memory use once they're done and which of the heavy
+# libraries it ends up loading. Each is measured in a fresh interpreter importing the modules that process imports when started with spawn
+# (the default on macOS and windows), where every process imports guiMain again before its own modules
+# Run with 'python guiImportReport.py', after changing any module's imports to check a worker hasn't started loading Qt again
+
+processModules = {
+    "gui": ["guiMain", "guiWindow"],
+    "cue system": ["guiMain", "guiWindow", "guiCue"], # Loaded into the gui process when the cue system is first opened
+    "serial reader": ["guiMain", "guiAcquisition"],
+    # Workers also import the modules of the shared objects they're sent, every one of them unpickles a RawRingBuffer (and the graph workers
+    # a LatestSnapshot) from guiAcquisition
+    "graph worker": ["guiMain", "guiDataProcesses", "guiAcquisition"],
+    "spectral worker": ["guiMain", "guiSpectral", "guiAcquisition"],
+    "epoch worker": ["guiMain", "guiEpochs", "guiAcquisition"],
+    "headless protocol": ["guiProtocol", "guiAcquisition"],
+}
+heavyModules = ["numpy", "serial", "PyQt5", "pyqtgraph", "simpleaudio", "sounddevice"]
+
+# Run in the fresh interpreter, prints the measurements as json
+measureCode = """
+import sys, json
+from time import perf_counter
+start = perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+seconds = perf_counter() - start
+try:
+    import resource
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    maxRss = maxRss / 2**20 if sys.platform == "darwin" else maxRss / 2**10 # Bytes on macOS, KiB elsewhere
+except ImportError: # Not available on windows
+    maxRss = None
+print(json.dumps({"seconds": seconds, "maxRss": maxRss, "loaded": [name for name in %r if name in sys.modules]}))
+""" % heavyModules
+
+# Returns the import time (s), peak RSS (MiB, None if unknown) and loaded heavy modules of a fresh interpreter importing modules
+def measureImports(modules):
+
+    result = subprocess.run([sys.executable, "-c", measureCode] + modules, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError("Importing " + ", ".join(modules) + " failed:\n" + result.stderr)
+    return json.loads(result.stdout.splitlines()[-1])
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Report the import time and memory of each kind of GUI process")
+    parser.add_argument("-n", "--repeats", type=int, default=3, help="Times each process is measured, the fastest is reported as the first run warms the disk cache")
+    args = parser.parse_args()
+
+    print("process".ljust(20) + "import".rjust(10) + "rss".rjust(10) + "   heavy modules loaded")
+    for processName, modules in processModules.items():
+        try:
+            runs = [measureImports(modules) for _ in range(args.repeats)]
+        except RuntimeError as e:
+            print(processName.ljust(20) + "   " + str(e).splitlines()[0])
+            continue
+        fastest = min(runs, key=lambda run: run["seconds"])
+        rss = "-" if fastest["maxRss"] is None else str(round(fastest["maxRss"], 1)) + "MiB"
+        print(processName.ljust(20) + (str(round(fastest["seconds"] * 1000)) + "ms").rjust(10) + rss.rjust(10) + "   " + ", ".join(fastest["loaded"]))
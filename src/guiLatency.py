@@ -0,0 +1,164 @@
+import os, sys, json, socket, argparse, threading
+from time import monotonic, sleep, strftime
+import numpy as np
+
+import guiStimuli
+
+# Measures how long after a sound is started it actually comes out of the speakers, by playing it into a loopback input (a cable from the
+# audio output to an input, or a virtual sink recorded as an input) and timing when it's heard. The results are kept per machine and
+# added to the timestamps of beep and stimulus events so epochs line up with when the subject heard the sound, not when it was started
+
+profileFilename = "latencyProfile-" + socket.gethostname() + ".json" # Latency depends on the machine and its audio setup, so each keeps its own
+calibrationKey = guiStimuli.stimulusKey("pureTone", {"carrierAmp": 0, "modAmp": 1, "carrierFreq": 1000, "amFreq": 0}, 1) # 1s of a plain 1kHz tone
+
+# Returns the saved latency profile, or an empty one if this machine hasn't been calibrated
+def loadProfile(filename=profileFilename):
+
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as profileFile:
+        return json.load(profileFile)
+
+def saveProfile(profile, filename=profileFilename):
+
+    with open(filename, 'w') as profileFile:
+        json.dump(profile, profileFile, indent=4)
+
+# Seconds to add to each event's timestamp, by event name, for EventRecorder
+def eventLatencies(profile):
+
+    latencies = {}
+    if "beep" in profile:
+        latencies["beep"] = profile["beep"]["median"]
+    if "stimulus" in profile:
+        for testName in ["clicks", "pureTone", "whiteNoise"]:
+            latencies[testName] = profile["stimulus"]["median"]
+    return latencies
+
+# Records the loopback input continuously, every block is kept with the monotonic time of its first sample
+class LoopbackRecorder():
+
+    def __init__(self, sampleRate=guiStimuli.samplingFreq):
+
+        self.sampleRate = sampleRate
+        self.blocks = [] # (monotonic time of the first sample, samples) tuples
+        self.lock = threading.Lock()
+        self.clockOffset = None # Converts the stream's clock to monotonic time, set once the stream has started
+        self.input = guiStimuli.sounddevice.InputStream(samplerate=sampleRate, channels=1, dtype="float32", callback=self.addBlock)
+        self.input.start()
+        self.clockOffset = monotonic() - self.input.time
+
+    def addBlock(self, indata, frames, time, status):
+
+        if self.clockOffset is None: # Blocks captured while the stream was starting aren't needed, calibration starts after it
+            return
+        if time.inputBufferAdcTime > 0:
+            blockTime = time.inputBufferAdcTime + self.clockOffset
+        else: # Some host apis don't report capture times, the reported input latency is the next best thing
+            blockTime = monotonic() - frames / self.sampleRate - self.input.latency
+        with self.lock:
+            self.blocks.append((blockTime, indata[:, 0].copy()))
+
+    # Returns (times, samples) of everything recorded between startTime and endTime
+    def getRange(self, startTime, endTime):
+
+        with self.lock:
+            blocks = [block for block in self.blocks if block[0] < endTime and block[0] + len(block[1]) / self.sampleRate > startTime]
+        if not blocks:
+            return np.zeros(0), np.zeros(0)
+        times = np.concatenate([blockTime + np.arange(len(samples)) / self.sampleRate for blockTime, samples in blocks])
+        samples = np.concatenate([samples for _, samples in blocks])
+        mask = (times >= startTime) & (times < endTime)
+        return times[mask], samples[mask]
+
+    # Monotonic time of the first sound louder than the background noise after startTime, None if nothing was heard
+    def findOnset(self, startTime, searchSeconds):
+
+        _, background = self.getRange(startTime - 0.2, startTime)
+        times, samples = self.getRange(startTime, startTime + searchSeconds)
+        threshold = max(0.02, 8 * np.sqrt(np.mean(background ** 2))) if len(background) else 0.02
+        loud = np.flatnonzero(np.abs(samples) > threshold)
+        return times[loud[0]] if len(loud) else None
+
+    def close(self):
+
+        self.input.stop()
+        self.input.close()
+
+# Plays a sound numTrials times with play() and returns the statistics (seconds) of the delay until it's heard on the loopback
+def measureLatency(recorder, play, numTrials, soundSeconds):
+
+    latencies = []
+    for _ in range(numTrials):
+        sleep(0.3 + 0.3 * np.random.random()) # Random gaps so the latency can't lock onto the audio device's block timing
+        playTime = monotonic()
+        play()
+        sleep(soundSeconds + 0.5) # Leaves time for the sound to be recorded before looking for it
+        onset = recorder.findOnset(playTime, soundSeconds + 0.5)
+        if onset is not None:
+            latencies.append(onset - playTime)
+
+    if not latencies:
+        return None
+    latencies = np.array(latencies)
+    return {
+        "median": float(np.median(latencies)), "mean": float(latencies.mean()), "std": float(latencies.std()),
+        "p5": float(np.percentile(latencies, 5)), "p95": float(np.percentile(latencies, 95)),
+        "numTrials": numTrials, "numHeard": len(latencies),
+    }
+
+# Measures the latency of stimuli played by stimulusPlayer and of beepWav, returns the profile (or None if nothing could be measured)
+def calibrate(stimulusPlayer, beepWav, numTrials=20):
+
+    if guiStimuli.sounddevice is None:
+        print("Latency calibration needs the sounddevice package to record the loopback input")
+        return None
+    try:
+        recorder = LoopbackRecorder()
+    except Exception as e:
+        print("Couldn't open a loopback input: " + str(e))
+        return None
+
+    stimulusPlayer.prepare(calibrationKey)
+    stimulusPlayer.prewarm()
+    sleep(0.5)
+    try:
+        profile = {
+            "hostname": socket.gethostname(), "date": strftime("%Y-%m-%d %H:%M:%S"),
+            "streaming": stimulusPlayer.output is not None, # Streamed and whole buffer playback have different latencies
+            "stimulus": measureLatency(recorder, lambda: stimulusPlayer.play(calibrationKey), numTrials, calibrationKey[1]),
+            "beep": measureLatency(recorder, beepWav.play, numTrials, 0.5),
+        }
+    finally:
+        recorder.close()
+        stimulusPlayer.stop()
+    if profile["stimulus"] is None and profile["beep"] is None:
+        print("Nothing was heard on the loopback input")
+        return None
+    return {name: value for name, value in profile.items() if value is not None}
+
+# Describes a profile in one line, e.g. for the cue window
+def describeProfile(profile):
+
+    parts = []
+    for name in ["stimulus", "beep"]:
+        if name in profile:
+            stats = profile[name]
+            parts.append(name + " " + str(round(stats["median"] * 1000, 1)) + "ms (5-95%: " + str(round(stats["p5"] * 1000, 1)) + "-" + str(round(stats["p95"] * 1000, 1)) + "ms)")
+    return "Audio latency: " + (", ".join(parts) if parts else "not calibrated")
+
+# Calibration without the GUI: 'python guiLatency.py', with the loopback connected
+if __name__ == "__main__":
+
+    import simpleaudio as sa
+
+    parser = argparse.ArgumentParser(description="Measure audio onset latency through a loopback input and save it as this machine's profile")
+    parser.add_argument("-n", "--trials", type=int, default=20, help="Number of times each sound is played")
+    args = parser.parse_args()
+
+    profile = calibrate(guiStimuli.StimulusPlayer(), sa.WaveObject.from_wave_file("beep.wav"), args.trials)
+    if not profile:
+        sys.exit(1)
+    saveProfile(profile)
+    print(describeProfile(profile))
+    print("Saved to " + profileFilename)
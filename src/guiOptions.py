@@ -1,16 +1,17 @@
 import os
-import re
 from csv import writer
 from time import sleep, time
 
 from PyQt5.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton,QLineEdit, QScrollArea
 from PyQt5.QtGui import QRegExpValidator
-from PyQt5.QtCore import QTimer, QRegExp
+from PyQt5.QtCore import QTimer, QRegExp, pyqtSignal
 
-import guiPlots
+import guiAcquisition
 
 class StartStop(QWidget):
 
+    connectionMade = pyqtSignal() # Emitted once the device is connected and the startup commands have been sent
+
     def __init__(self, running, connectionPipe, saveDataMenuButton, chatWindow, regDump):
 
         super().__init__()
@@ -45,9 +46,21 @@ class StartStop(QWidget):
         self.synced = None
         self.startTime = None
         self.connected = False
+
+        self.connectionTimer = QTimer()
+        self.connectionTimer.setInterval(50) # Checks every 50 ms, only affects how soon a connection is noticed
+        self.connectionTimer.timeout.connect(self.checkConnection)
         
+    # Starts acquisition and, when synced to the cue system, its configured test
     def start(self):
 
+        self.startAcquisition()
+        if self.synced:
+            self.cueSystem.runTest()
+
+    # Starts acquisition only, the cue system calls this when it starts a test itself so the test isn't started twice
+    def startAcquisition(self):
+
         self.chatWindow.commandWriter.sendStartCommand()
 
         self.running.value = True
@@ -58,8 +71,6 @@ class StartStop(QWidget):
 
         if self.cueSystem:
             self.cueSystem.startStopSync.setEnabled(False)
-        if self.synced:
-            self.cueSystem.runTest()
 
         self.chatWindow.addMessage("Streaming Started")
 
@@ -84,8 +95,30 @@ class StartStop(QWidget):
         self.chatWindow.addMessage(f"Ran for {timeDiff} seconds")
         self.chatWindow.addMessage("Streaming Stopped")
 
+    # Connects as soon as the SerialReader reports the device is connected, without holding up the GUI while it waits
+    # failureMessage is shown once if that takes longer than timeout ms, it keeps waiting after that (the connect button still works too)
+    def waitForConnection(self, failureMessage, timeout=2000):
+
+        self.connectionFailureMessage = failureMessage
+        self.connectionDeadline = time() + timeout * 0.001
+        self.connectionTimer.start()
+
+    def checkConnection(self):
+
+        if self.connected:
+            self.connectionTimer.stop()
+        elif self.connectionPipe.poll():
+            self.connectionTimer.stop()
+            self.connect()
+        elif self.connectionFailureMessage and time() > self.connectionDeadline:
+            self.chatWindow.addMessage(self.connectionFailureMessage)
+            print(self.connectionFailureMessage)
+            self.connectionFailureMessage = None
+
     def connect(self, failureMessage="No Device Found"): # failureMessage used to modify message when automatic connection is attempted (currently on startup)
 
+        if self.connected:
+            return
         if self.connectionPipe.poll():
             self.chatWindow.addMessage("Connection Success")
             print("Connection Success")
@@ -97,6 +130,7 @@ class StartStop(QWidget):
             self.chatWindow.commandWriter.runStartupCommands()
             self.chatWindow.commandWriter.enable()
             self.regDump.enable()
+            self.connectionMade.emit()
         else:
             self.chatWindow.addMessage(failureMessage)
             print(failureMessage)
@@ -253,14 +287,11 @@ class CommandWriter(QWidget):
 
     def badCommandFormat(self, text): # Returns true on a failure
 
-        if re.search(r"^read reg", text) and not re.search(r"^read reg [0-9]{2}$", text):
-            self.chatWindow.addMessage("Must follow format `read reg xx` where xx is 00-99")
-            return True
-        elif re.search(r"^write reg", text) and not re.search(r"^write reg [0-9]{2} [0-9a-f]{4}$", text):
-            self.chatWindow.addMessage("Must follow format `write reg xx yyyy` where xx is 00-99 and yyyy is 0000-ffff")
+        error = guiAcquisition.commandFormatError(text)
+        if error:
+            self.chatWindow.addMessage(error)
             return True
-        else:
-            return False
+        return False
 
 
 class XAxisResizer(QWidget):
@@ -373,11 +404,12 @@ class RegDump(QWidget):
 # Class containing all of the dropdown menues corrosponding to a certain PlotColumn
 class ColumnDropdowns(QWidget):
 
-    def __init__(self, running, startingDropdowns, plotColumn, plotDataProcesses, lables, current, maxNumPlots):
+    def __init__(self, running, plotWidgetPool, startingDropdowns, plotColumn, plotDataProcesses, lables, current, maxNumPlots):
 
         super().__init__()
 
         self.running = running
+        self.plotWidgetPool = plotWidgetPool # Plots are taken from here rather than created, so layout changes reuse existing widgets
         self.dropdowns = startingDropdowns
         self.plotColumn = plotColumn # PlotColumn that corrosponds to this set of dropdown menus
         self.plotDataProcesses = plotDataProcesses
@@ -422,6 +454,8 @@ class ColumnDropdowns(QWidget):
                 self.dropdowns[idx].deleteLater()
                 self.dropdowns[idx] = None
 
+            for plotData in self.current[self.screenIdx][newSize:self.numPlots]:
+                plotData[1].unsubscribe() # Removed plots no longer need their data computed
             del self.current[self.screenIdx][newSize:self.numPlots]
 
             self.plotColumn.shrink(newSize)
@@ -443,8 +477,8 @@ class ColumnDropdowns(QWidget):
                     if possData in col:
                         exists = True
                 if not exists:
-                    newPlot = guiPlots.CustomPlotWidget(self.running, possData[1], possData[0])
-                    newPlot.startRedraw()
+                    possData[1].subscribe()
+                    newPlot = self.plotWidgetPool.acquire(possData[1], possData[0])
                     newPlots.append(newPlot)
                     indices.append(idx)
                     self.current[self.screenIdx].append(possData)
@@ -497,11 +531,38 @@ class ColumnDropdowns(QWidget):
 
         else: # If the newly selected graph isn't already on the screen it just displays it
 
-            newPlot = guiPlots.CustomPlotWidget(self.running, newPlotData[1], newPlotData[0])
-            newPlot.startRedraw()
+            # Subscribes before unsubscribing so a data process being shared with the old plot never stops in between
+            newPlotData[1].subscribe()
+            self.current[self.screenIdx][plotIdx][1].unsubscribe()
+
+            newPlot = self.plotWidgetPool.acquire(newPlotData[1], newPlotData[0])
             self.plotColumn.swapOutPlot(plotIdx, newPlot)
             self.current[self.plotColumn.getScreenIdx()][plotIdx] = newPlotData
 
+class CueSystemButton(QPushButton):
+
+    def __init__(self, running, startStop, amFreq, eventRecorder, assrEstimator):
+
+        super().__init__("Cue System")
+        self.running = running
+        self.startStop = startStop
+        self.amFreq = amFreq
+        self.eventRecorder = eventRecorder
+        self.assrEstimator = assrEstimator
+
+        self.clicked.connect(self.showPopup)
+
+        self.cueSystem = None
+
+    # The cue system (and the audio libraries it needs) is only loaded the first time it's opened, most sessions never use it
+    def showPopup(self):
+        if not self.cueSystem:
+            import guiCue
+            self.cueSystem = guiCue.CueSystem(self.running, self.startStop, self.amFreq, self.eventRecorder, self.assrEstimator)
+            self.cueSystem.show()
+        else:
+            self.cueSystem.show()
+
 class PyserialReset(QWidget):
 
     def __init__(self, running, startStop, connectionPipe, chatWindow):
@@ -1,17 +1,18 @@
 import math
-import multiprocessing as mp
-from time import sleep
+from time import perf_counter
+import numpy as np
 from PyQt5.QtWidgets import QVBoxLayout, QWidget
 from PyQt5.QtCore import QTimer
-from pyqtgraph import PlotWidget, mkPen
+from pyqtgraph import PlotWidget, FillBetweenItem, mkPen, mkBrush
 
 class PlotColumn(QWidget):
 
-    def __init__(self, startingPlots, screenIdx, maxNumPlots):
+    def __init__(self, startingPlots, screenIdx, maxNumPlots, plotWidgetPool):
 
         super().__init__()
         self.layout = QVBoxLayout()
 
+        self.plotWidgetPool = plotWidgetPool # Plots removed from the column are parked here to be reused rather than deleted
         self.plots = startingPlots
         self.screenIdx = screenIdx
 
@@ -29,12 +30,13 @@ class PlotColumn(QWidget):
 
     # Used to display a plot that is not currently on the screen
     def swapOutPlot(self, plotIdx, newPlot):
-        # This will remove the widget from being onscreen and then actually delete it from memory, very useful so we aren't "drawing" graphs that aren't onscreen
+        # This will remove the widget from being onscreen and park it in the pool, parked plots aren't redrawn so we aren't "drawing" graphs that aren't onscreen
         self.layout.removeWidget(self.plots[plotIdx])
-        self.plots[plotIdx].deleteLater()
+        self.plotWidgetPool.release(self.plots[plotIdx])
 
         self.plots[plotIdx] = newPlot
         self.layout.insertWidget(plotIdx, self.plots[plotIdx], 1)
+        self.plots[plotIdx].show() # Plots reused from the pool are hidden
     
     # Used to trade the plot currently in this object with a plot in another (or even the same) 'PlotColumn' object
     def tradePlot(self, selfIdx, plotColumn, otherIdx):
@@ -56,7 +58,7 @@ class PlotColumn(QWidget):
 
         for idx in range(newSize, self.numPlots):
             self.layout.removeWidget(self.plots[idx])
-            self.plots[idx].deleteLater()
+            self.plotWidgetPool.release(self.plots[idx])
             self.plots[idx] = None
         
         self.numPlots = newSize
@@ -67,6 +69,7 @@ class PlotColumn(QWidget):
             for idx in range(self.numPlots, newSize):
                 self.plots[idx] = newPlots[idx - self.numPlots]
                 self.layout.addWidget(self.plots[idx], 1)
+                self.plots[idx].show() # Plots reused from the pool are hidden
                 
             self.numPlots = newSize
 
@@ -82,8 +85,7 @@ class CustomPlotWidget(PlotWidget):
         self.running = running
         self.setBackground('w')
         self.dataProcess = dataProcess
-
-        self.refreshRate = 50 # Refresh rate in ms, controls how often graphs are redrawn
+        self.renderScheduler = None
 
         self.pen = mkPen(color=(0,0,0), width=3) # Sets color and size of line drawn on graph
 
@@ -94,108 +96,300 @@ class CustomPlotWidget(PlotWidget):
 
         self.data_line = self.plot(xStart, yStart, pen=self.pen)
 
-    # Starts the redrawing of the plot every 'refreshRate' millseconds
-    def startRedraw(self):
+        # Long windows are drawn through a min/max decimator that only ever processes the newly pushed points
+        self.decimator = MinMaxDecimator()
+        self.resetFetchState()
 
-        self.timer = QTimer()
-        self.timer.setInterval(self.refreshRate)
-        self.timer.timeout.connect(self.redrawPlot)
-        self.timer.start()
+    # Points the plot at a different DataProcess, used to reuse pooled plots instead of creating new ones
+    def bind(self, dataProcess, name):
+
+        self.dataProcess = dataProcess
+        self.resetFetchState()
+        self.data_line.setData(list(range(-dataProcess.xAxisLength.value, 0)), [0] * dataProcess.xAxisLength.value)
+
+    # Makes the next fetchData fetch everything
+    def resetFetchState(self):
+
+        self.lastPushed = 0 # dataProcess.numPushed at the last fetch, the difference is how many new points to fetch
+        self.lastReplaced = -1 # dataProcess.numReplaced at the last fetch, a change means everything has to be refetched
+        self.lastLength = 0
+
+    # Hands the plot to renderScheduler which redraws it with data recived from dataProcess every frame
+    def startRedraw(self, renderScheduler):
+
+        self.renderScheduler = renderScheduler
+        self.renderScheduler.register(self)
+
+    # Stops the plot from being redrawn, must be called before the plot is deleted
+    def stopRedraw(self):
+
+        if self.renderScheduler:
+            self.renderScheduler.unregister(self)
+            self.renderScheduler = None
+
+    # Returns the (x, y) to draw, or None if nothing changed since the last call
+    # Windows longer than about two points per pixel are min/max decimated, which keeps every spike and blink visible
+    def fetchData(self):
+
+        dataProcess = self.dataProcess
+        length = dataProcess.xAxisLength.value
+        width = max(1, int(self.getPlotItem().getViewBox().width())) # Pixel width of the area the line is drawn in
+        bucketSize = math.ceil(length / width)
+
+        with dataProcess.lock:
+            numPushed = dataProcess.numPushed.value
+            numReplaced = dataProcess.numReplaced.value
+            numNew = numPushed - self.lastPushed
+
+            if numReplaced == self.lastReplaced and numNew == 0 and length == self.lastLength:
+                return None
+
+            # Short windows are cheap enough to fetch and draw in full
+            if bucketSize <= 2:
+                x = dataProcess.x[:]
+                y = dataProcess.y[:]
+                self.decimator.reset(0)
+                full = True
+
+            # Anything invalidating the existing buckets (new data set, resize, plot width change, falling too far behind) rebuilds from scratch
+            elif numReplaced != self.lastReplaced or length != self.lastLength or bucketSize != self.decimator.bucketSize or numNew >= length:
+                x = dataProcess.x[:]
+                y = dataProcess.y[:]
+                self.decimator.reset(bucketSize)
+                full = False
+
+            # Otherwise only the new tail is fetched from the data process
+            else:
+                x = dataProcess.x[-numNew:]
+                y = dataProcess.y[-numNew:]
+                full = False
+
+        self.lastPushed = numPushed
+        self.lastReplaced = numReplaced
+        self.lastLength = length
+
+        if full:
+            return x, y
 
-    # Redraws plot with data recived from dataProcess
-    def redrawPlot(self):
+        self.decimator.add(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        self.decimator.trim(length)
+        return self.decimator.getData()
 
-        if bool(self.running.value):
-            with self.dataProcess.lock:
-                x = self.dataProcess.x[:]
-                y = self.dataProcess.y[:]
-            self.data_line.setData(x, y)
+    # Draws data returned by fetchData
+    def draw(self, x, y):
 
-# Abstract class defining methods needed in all data processes, each distinct graph will have an implementation of this
-class DataProcess():
+        self.data_line.setData(x, y)
 
-    def __init__(self, running, channelData, x, y, xAxisLength):
+# Plot of an EpochTrace, draws the mean with a shaded band of plus and minus one standard error and shows the number of epochs
+class EpochPlotWidget(CustomPlotWidget):
+
+    def __init__(self, running, dataProcess, name):
+
+        super().__init__(running, dataProcess, name)
+        self.setLabel('bottom', "Time from onset (s)")
+
+        self.upperLine = self.plot([], [], pen=mkPen(color=(120,120,120), width=1))
+        self.lowerLine = self.plot([], [], pen=mkPen(color=(120,120,120), width=1))
+        self.addItem(FillBetweenItem(self.upperLine, self.lowerLine, brush=mkBrush(150,150,150,100)))
+        self.setTitle("n = 0")
+
+    def bind(self, dataProcess, name):
+
+        super().bind(dataProcess, name)
+        self.upperLine.setData([], [])
+        self.lowerLine.setData([], [])
+        self.setTitle("n = 0")
+
+    # Epoch averages are only ever replaced as a whole and are short, so they're fetched in full whenever they change
+    def fetchData(self):
+
+        dataProcess = self.dataProcess
+        with dataProcess.lock:
+            numReplaced = dataProcess.numReplaced.value
+            if numReplaced == self.lastReplaced:
+                return None
+            x = np.asarray(dataProcess.x[:])
+            y = np.asarray(dataProcess.y[:])
+            se = np.asarray(dataProcess.se[:])
+            numEpochs = dataProcess.numEpochs.value
+
+        self.lastReplaced = numReplaced
+        return x, y, se, numEpochs
+
+    def draw(self, x, y, se, numEpochs):
+
+        self.data_line.setData(x, y)
+        self.upperLine.setData(x, y + se)
+        self.lowerLine.setData(x, y - se)
+        self.setTitle("n = " + str(numEpochs))
+
+# Keeps CustomPlotWidgets that have been taken off screen so they can be rebound to another DataProcess instead of recreated
+# Creating a plot builds a whole new pyqtgraph scene, rebinding only swaps the DataProcess, parked plots are not redrawn so they cost nothing
+class PlotWidgetPool():
+
+    def __init__(self, running, renderScheduler):
 
         self.running = running
-        self.channelData = channelData
-        self.xAxisLength = xAxisLength
-        self.currPacket = -1
-        self.counter = -1 # Determines values on graph X axis, starts at -1 as first packet is (theoretically, usually not actually) 0
+        self.renderScheduler = renderScheduler
+        self.parked = {} # Parked plots by type, a DataProcess can only be bound to the type of plot it asks for
 
-        # These must be multiprocessing sync manager arrays so the data can be shared back to the process drawing the graphs
-        self.x = x
-        self.x[:] = list(range(-xAxisLength.value, 0))
-        self.y = y
-        self.y[:] = [0] * xAxisLength.value
-        self.lock = mp.RLock()
+    # Returns a plot drawing dataProcess that is already being redrawn
+    def acquire(self, dataProcess, name):
 
-        self.refreshRate = 2 # Refresh rate in ms, controls how often new data is looked for
+        plotWidgetType = globals()[dataProcess.plotWidgetType]
+        parked = self.parked.setdefault(plotWidgetType, [])
+        if parked:
+            plot = parked.pop()
+            plot.bind(dataProcess, name)
+        else:
+            plot = plotWidgetType(self.running, dataProcess, name)
+        plot.startRedraw(self.renderScheduler)
+        return plot
 
-    # Starts a loop to call the updateData function 
-    def startUpdateData(self):
+    # Takes a plot that has been removed from its layout and parks it
+    def release(self, plot):
 
-        while True:
-            if bool(self.running.value):
-                self.updateData()
+        plot.stopRedraw()
+        plot.setParent(None) # Detaches it from the PlotColumn so it isn't deleted with it
+        plot.hide() # Explicitly hidden as layouts may still have a pending show for it, PlotColumn shows it again once it's back in a layout
+        self.parked.setdefault(type(plot), []).append(plot)
 
-            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+# Redraws every registered CustomPlotWidget from a single timer instead of one timer per plot
+# Each frame first fetches data for the plots whose DataProcess has changed (others are skipped) and then calls setData on all of them in one pass
+# The frame interval backs off when frames take longer than their budget (or the event loop is running late) and recovers when load drops
+class RenderScheduler():
 
-    # Recalculates the graphical data to return based on the raw input
-    def updateData(self):
-        # newX = self.counter.value + 1 # Old version, use if difference between the current and next packet ID isn't working
-        with self.channelData.get_lock():
-            packetId = self.channelData.packetId
-            newY = self.calculateY()
-        newX = self.counter + ((packetId - self.currPacket) % 256) # Assuming no dropped packets this should be 1, % 256 as packets are 0-255
+    def __init__(self, running):
 
-        if self.currPacket != packetId:
-            # If the graph appears as if it is dropping packets you can in theory use a non-locked array to keep track of values
-            with self.lock:
-                self.x[:] = self.x[1:] + [newX] # FYI iterating through is super slow compared to this apperently
-                self.y[:] = self.y[1:] + [newY]
-                self.currPacket = packetId
-                self.counter = newX 
+        self.running = running
+        self.plots = []
 
-    def resizeXAxis(self, newXAxisLength):
-        currXAxisLength = self.xAxisLength.value
-        if newXAxisLength > currXAxisLength:
-            diff = newXAxisLength - currXAxisLength
+        self.minInterval = 16 # Fastest frame interval in ms (~60 fps)
+        self.maxInterval = 200 # Slowest frame interval in ms, plots still update 5 times a second under heavy load
+        self.frameBudget = 0.5 # Fraction of the frame interval redrawing may use, the rest is left for the rest of the GUI
+        self.interval = 50 # Current frame interval in ms, starts at the old per plot refresh rate
+        self.lastTick = None
 
-            with self.lock:
-                self.x[:] = list(range(self.x[0] - diff, self.x[0])) + self.x[:]
-                self.y[:] = ([0] * diff) + self.y[:]
+        self.timer = QTimer()
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.tick)
 
-            with self.xAxisLength:
-                self.xAxisLength.value = newXAxisLength
+    def start(self):
 
-        elif newXAxisLength < currXAxisLength:
-            diff = currXAxisLength - newXAxisLength
+        self.timer.start()
 
-            with self.lock:
-                self.x[:] = self.x[diff:]
-                self.y[:] = self.y[diff:]
+    def register(self, plot):
 
-            with self.xAxisLength:
-                self.xAxisLength.value = newXAxisLength
+        if plot not in self.plots:
+            self.plots.append(plot)
 
-# Data process for a simple sine wave
-class EEGDataProcess(DataProcess):
+    def unregister(self, plot):
 
-    def calculateY(self):
+        if plot in self.plots:
+            self.plots.remove(plot)
 
-        return self.channelData.chxEEG
+    # One frame, redraws all visible plots that have new data
+    def tick(self):
 
-# Data process for a simple sine wave
-class IQMagDataProcess(DataProcess):
+        tickStart = perf_counter()
+        lateness = 0 if self.lastTick is None else (tickStart - self.lastTick) * 1000 - self.interval # How much later than scheduled this tick ran
+        self.lastTick = tickStart
 
-    def calculateY(self):
-        
-        return math.sqrt(self.channelData.chxI**2 + self.channelData.chxQ**2)
-    
-# Data process for a simple sine wave
-class IQPhaseDataProcess(DataProcess):
+        if not bool(self.running.value):
+            return
 
-    def calculateY(self):
-        if self.channelData.chxI == 0:
-            return 0
-        return math.atan(self.channelData.chxQ / self.channelData.chxI)
\ No newline at end of file
+        updates = []
+        for plot in self.plots:
+            if plot.isVisible():
+                data = plot.fetchData()
+                if data:
+                    updates.append((plot, data))
+
+        for plot, data in updates:
+            plot.draw(*data)
+
+        self.adaptInterval((perf_counter() - tickStart) * 1000, lateness)
+
+    # Slows the frame rate down when over budget and speeds it back up when comfortably under
+    def adaptInterval(self, frameTime, lateness):
+
+        budget = self.interval * self.frameBudget
+        if frameTime > budget or lateness > self.interval:
+            self.interval = min(self.maxInterval, self.interval * 1.25)
+        elif frameTime < budget / 2 and lateness < self.interval / 4:
+            self.interval = max(self.minInterval, self.interval * 0.95)
+        self.timer.setInterval(int(self.interval))
+
+# Reduces a scrolling line to the first/last of the min and max point of each bucketSize samples, so at most two points are drawn per bucket
+# Buckets are built as points arrive and dropped as they scroll off, so the work per frame only depends on the number of new points
+class MinMaxDecimator():
+
+    def __init__(self):
+
+        self.reset(0)
+
+    def reset(self, bucketSize):
+
+        self.bucketSize = bucketSize
+        self.buckets = np.empty((64, 4)) # Rows of (xA, yA, xB, yB), A is whichever of the min/max came first so the line is drawn in order
+        self.start = 0 # Rows before start have scrolled off
+        self.end = 0
+        self.pendingX = np.empty(0) # Points that don't fill a full bucket yet
+        self.pendingY = np.empty(0)
+
+    # Adds new points to the right of the line
+    def add(self, x, y):
+
+        x = np.concatenate((self.pendingX, x))
+        y = np.concatenate((self.pendingY, y))
+        numFull = len(x) // self.bucketSize
+        used = numFull * self.bucketSize
+        self.pendingX = x[used:]
+        self.pendingY = y[used:]
+
+        if numFull == 0:
+            return
+
+        bucketX = x[:used].reshape(numFull, self.bucketSize)
+        bucketY = y[:used].reshape(numFull, self.bucketSize)
+        minIdx = bucketY.argmin(axis=1)
+        maxIdx = bucketY.argmax(axis=1)
+        firstIdx = np.minimum(minIdx, maxIdx)
+        secondIdx = np.maximum(minIdx, maxIdx)
+        rows = np.arange(numFull)
+
+        self.makeRoom(numFull)
+        newBuckets = self.buckets[self.end:self.end + numFull]
+        newBuckets[:, 0] = bucketX[rows, firstIdx]
+        newBuckets[:, 1] = bucketY[rows, firstIdx]
+        newBuckets[:, 2] = bucketX[rows, secondIdx]
+        newBuckets[:, 3] = bucketY[rows, secondIdx]
+        self.end += numFull
+
+    # Makes sure numNew rows fit after self.end, moving live rows to the front or growing the array when needed
+    def makeRoom(self, numNew):
+
+        numLive = self.end - self.start
+        if self.end + numNew <= len(self.buckets):
+            return
+        if numLive + numNew > len(self.buckets) // 2:
+            newBuckets = np.empty((2 * (numLive + numNew), 4))
+        else:
+            newBuckets = self.buckets
+        newBuckets[:numLive] = self.buckets[self.start:self.end]
+        self.buckets = newBuckets
+        self.start = 0
+        self.end = numLive
+
+    # Drops buckets that have scrolled out of a window of length points
+    def trim(self, length):
+
+        maxBuckets = math.ceil((length - len(self.pendingX)) / self.bucketSize)
+        self.start = max(self.start, self.end - maxBuckets)
+
+    def getData(self):
+
+        live = self.buckets[self.start:self.end]
+        x = np.concatenate((live[:, [0, 2]].ravel(), self.pendingX))
+        y = np.concatenate((live[:, [1, 3]].ravel(), self.pendingY))
+        return x, y
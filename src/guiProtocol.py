@@ -0,0 +1,233 @@
+import os, sys, json, argparse, threading
+from time import monotonic, sleep, time
+import multiprocessing as mp
+
+import guiEvents
+import guiLatency
+import guiRecording
+import guiSettings
+import guiStimuli
+import guiTimeline
+
+# A protocol is a json file listing cue tests to run back to back, so a whole session can be repeated exactly without setting up the GUI by hand
+# e.g. {"name": "assrSession", "tests": [{"test": "eyeBlinks", "repetitions": 10, "cueLength": 2, "restLength": 3, "cueAudio": true},
+#                                        {"test": "pureTone", "startDelay": 5, "repetitions": 30, "carrierAmp": 0, "modAmp": 1, "carrierFreq": 1000, "amFreq": 40}]}
+# Each test takes the cue system's settings by the same names, ones left out get the cue system's defaults
+# The whole protocol is compiled into one Timeline before it starts, so the gaps between tests are as exact as the phases within them
+
+baseDefaults = {"startDelay": 0, "repetitions": 1, "cueLength": 5, "restLength": 5, "endDelay": 0} # Same defaults as the cue system's fields
+stimulusParams = { # Parameters each test's stimulus is generated from, all required
+    "eyeBlinks": [], "alpha": [],
+    "clicks": ["clickFreq"],
+    "pureTone": ["carrierAmp", "modAmp", "carrierFreq", "amFreq"],
+    "whiteNoise": ["carrierAmp", "modAmp", "amFreq"],
+}
+
+# Reads and checks a protocol file, returns it with every test's defaults filled in, raises ValueError describing the first problem found
+def loadProtocol(filename):
+
+    with open(filename, 'r') as protocolFile:
+        try:
+            protocol = json.load(protocolFile)
+        except json.JSONDecodeError as e:
+            raise ValueError("Not valid json: " + str(e))
+
+    if not isinstance(protocol, dict) or not isinstance(protocol.get("tests"), list) or not protocol["tests"]:
+        raise ValueError("A protocol needs a non empty \"tests\" list")
+
+    tests = []
+    for idx, test in enumerate(protocol["tests"]):
+        where = "Test " + str(idx) + ": "
+        if not isinstance(test, dict) or test.get("test") not in stimulusParams:
+            raise ValueError(where + "\"test\" must be one of " + ", ".join(stimulusParams))
+
+        testName = test["test"]
+        allowed = set(baseDefaults) | set(stimulusParams[testName]) | {"test"}
+        if testName in ["eyeBlinks", "alpha"]:
+            allowed.add("cueAudio")
+        unknown = set(test) - allowed
+        if unknown:
+            raise ValueError(where + "unknown settings for " + testName + ": " + ", ".join(sorted(unknown)))
+        missing = [name for name in stimulusParams[testName] if name not in test]
+        if missing:
+            raise ValueError(where + testName + " needs " + ", ".join(missing))
+
+        filled = {**baseDefaults, "cueAudio": False, **test}
+        for name in list(baseDefaults) + stimulusParams[testName]:
+            if not isinstance(filled[name], int) or isinstance(filled[name], bool) or filled[name] < 0: # The cue system's fields only take whole numbers
+                raise ValueError(where + name + " must be a whole number of at least 0")
+        if not isinstance(filled["cueAudio"], bool):
+            raise ValueError(where + "cueAudio must be true or false")
+        tests.append(filled)
+
+    name = protocol.get("name", os.path.splitext(os.path.basename(filename))[0])
+    return {"name": str(name), "tests": tests}
+
+# Returns the Timeline of every test of a loaded protocol one after another
+def compileProtocol(protocol):
+
+    timeline = guiTimeline.Timeline()
+    for test in protocol["tests"]:
+        testName = test["test"]
+        params = {name: test[name] for name in stimulusParams[testName]}
+        stimulusKey = guiStimuli.stimulusKey(testName, params, test["cueLength"]) if params else None
+        assrFreq = params.get("clickFreq", params.get("amFreq")) # Click trains evoke their response at the click rate
+        timeline.addTest(testName, test["startDelay"], test["repetitions"], test["cueLength"], test["restLength"], test["endDelay"], test["cueAudio"], stimulusKey, assrFreq)
+    return timeline
+
+# Writes the packets the SerialReader streams during a headless run to a binary recording with its event table, on its own thread
+class HeadlessRecorder():
+
+    def __init__(self, filename, numChannels, sampleRate, saveDataQueue, eventRecorder):
+
+        self.recordingWriter = guiRecording.RecordingWriter(filename, numChannels, sampleRate, time(), syncSeconds=1, indexEvery=sampleRate) # Unattended, so durable
+        self.eventFilename = guiEvents.eventFilename(filename)
+        self.saveDataQueue = saveDataQueue
+        self.eventRecorder = eventRecorder
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+
+        while not self.stopEvent.is_set():
+            self.writeAvailable(0.1)
+        self.writeAvailable(0, final=True) # Whatever arrived before stopping still belongs to the recording
+        self.recordingWriter.close()
+
+    # Writes every queued packet (waiting up to timeout for the first) and the events up to the last of them, or every event if final
+    def writeAvailable(self, timeout, final=False):
+
+        batch = self.saveDataQueue.getBatch(self.saveDataQueue.capacity, timeout)
+        while batch:
+            self.recordingWriter.writeRows([saveData for _, saveData in batch], [sampleIndex for sampleIndex, _ in batch], self.eventRecorder.hostTimeAt(batch[-1][0]))
+            batch = self.saveDataQueue.getBatch(self.saveDataQueue.capacity) # Spilled packets come back after the queued ones
+        if self.recordingWriter.lastSampleIndex is not None and self.eventRecorder.pending:
+            pending = self.eventRecorder.takePending(None if final else self.recordingWriter.lastSampleIndex + 1)
+            if pending:
+                guiEvents.writeEvents(self.eventFilename, pending, self.recordingWriter)
+
+    # Stops once everything queued so far is written
+    def stop(self):
+
+        self.stopEvent.set()
+        self.thread.join()
+
+# Returns the first "<dataDir>/<name>-<idx>.bin" that doesn't exist yet, numbered like the GUI's recordings
+def recordingFilename(dataDir, name):
+
+    idx = 0
+    while os.path.exists(os.path.join(dataDir, name + "-" + str(idx) + ".bin")):
+        idx += 1
+    return os.path.join(dataDir, name + "-" + str(idx) + ".bin")
+
+# Runs one compiled protocol to the end, firing its cues with performCue, returns the scheduler so its timing can be reported
+def runTimeline(timeline, eventRecorder, stimulusPlayer, beepWav):
+
+    for key in timeline.stimulusKeys():
+        stimulusPlayer.prepare(key)
+    stimulusPlayer.prewarm()
+
+    def fireCue(cue):
+        guiTimeline.performCue(cue, eventRecorder, stimulusPlayer, beepWav)
+        print(str(round(monotonic() - scheduler.startTime, 3)) + "s: " + cue.text)
+
+    finished = threading.Event()
+    scheduler = guiTimeline.CueScheduler(timeline, fireCue, finished.set)
+    scheduler.start()
+    try:
+        while not finished.wait(0.5): # Waits in short steps so ctrl-c still gets through
+            pass
+    finally:
+        scheduler.stop()
+        stimulusPlayer.stop()
+    return scheduler
+
+# Unattended sessions: 'python guiProtocol.py protocol.json [more.json ...] -p PORT -o NAME'
+# Connects to the chip like the GUI does, then runs each protocol in turn into its own recording (binary + event table, no csv)
+# Without a port the protocols are only played and their cues printed, e.g. to check a protocol before a session
+if __name__ == "__main__":
+
+    import guiAcquisition
+    import simpleaudio as sa
+
+    parser = argparse.ArgumentParser(description="Run cue protocol files without the GUI")
+    parser.add_argument("protocols", nargs="+", help="Protocol json files, run in the order given")
+    parser.add_argument("-p", "--port", help="Chip Port Name, /dev/cu.*, leave out to play the protocols without recording")
+    parser.add_argument("-o", "--output", default="headless", help="Recordings are saved as ../data/<output>-<protocol name>-<n>.bin")
+    parser.add_argument("--pause", type=float, default=5, help="Seconds between protocols")
+    args = parser.parse_args()
+
+    numChannels = guiSettings.numChannels
+    sampleRate = guiSettings.sampleRate
+    startupCommandsFilename = "startupCommands.txt"
+    dataDir = "../data"
+
+    try: # Every protocol is checked before anything is run, so a typo in the last one doesn't stop a session halfway
+        protocols = [loadProtocol(filename) for filename in args.protocols]
+    except (OSError, ValueError) as e:
+        print("Couldn't load protocol: " + str(e))
+        sys.exit(1)
+
+    startupCommands = [] # Checked up front like the protocols, the GUI's command box applies the same check
+    if args.port and os.path.exists(startupCommandsFilename):
+        with open(startupCommandsFilename, 'r') as startupCommandsFile:
+            startupCommands = [command for command in startupCommandsFile.read().splitlines() if command]
+        for command in startupCommands:
+            error = guiAcquisition.commandFormatError(command)
+            if error:
+                print("Bad startup command \"" + command + "\" in " + startupCommandsFilename + ": " + error)
+                sys.exit(1)
+
+    rawRingBuffer = guiAcquisition.RawRingBuffer(numChannels, guiSettings.rawBufferSeconds * sampleRate)
+    eventRecorder = guiEvents.EventRecorder(rawRingBuffer, sampleRate, latencies=guiLatency.eventLatencies(guiLatency.loadProfile()))
+
+    if args.port:
+        latestSnapshot = guiAcquisition.LatestSnapshot(numChannels)
+        saveDataQueue = guiAcquisition.SaveQueue(guiSettings.saveQueueSeconds * sampleRate, numChannels, "spill") # A protocol is run once, so nothing is ever dropped
+        connectionPipe, sRConnectionPipe = mp.Pipe()
+        commandWriterPipe, sRCommandWriterPipe = mp.Pipe()
+        commandResponsePipe, sRCommandResponsePipe = mp.Pipe()
+        serialReader = guiAcquisition.SerialReader(args.port, numChannels, latestSnapshot, rawRingBuffer, saveDataQueue, sRConnectionPipe, sRCommandWriterPipe, commandResponsePipe)
+        serialReaderProcess = mp.Process(target=serialReader.startSerialReader, daemon=True)
+        serialReaderProcess.start()
+
+        print("Connecting to " + args.port + "...")
+        if not connectionPipe.poll(10):
+            print("Couldn't connect to " + args.port)
+            sys.exit(1)
+        connectionPipe.recv()
+        for command in startupCommands:
+            commandWriterPipe.send(command)
+            print("Startup: " + command)
+        os.makedirs(dataDir, exist_ok=True)
+
+    stimulusPlayer = guiStimuli.StimulusPlayer()
+    beepWav = sa.WaveObject.from_wave_file("beep.wav")
+
+    for idx, protocol in enumerate(protocols):
+        if idx > 0:
+            sleep(args.pause)
+        print("Running protocol " + protocol["name"] + " (" + str(idx + 1) + "/" + str(len(protocols)) + ")")
+        timeline = compileProtocol(protocol)
+
+        recorder = None
+        if args.port:
+            saveDataQueue.clear() # Packets from before the start belong to no recording
+            eventRecorder.takePending()
+            filename = recordingFilename(dataDir, args.output + "-" + protocol["name"])
+            recorder = HeadlessRecorder(filename, numChannels, sampleRate, saveDataQueue, eventRecorder)
+            commandWriterPipe.send("start")
+
+        try:
+            scheduler = runTimeline(timeline, eventRecorder, stimulusPlayer, beepWav)
+        finally:
+            if recorder:
+                commandWriterPipe.send("stop")
+                sleep(0.5) # Lets the last packets through the queue
+                recorder.stop()
+                print("Saved " + filename)
+                stats = saveDataQueue.stats()
+                if stats["spilled"] or stats["dropped"] or stats["blocked"]:
+                    print("Save queue: " + ", ".join(name + " " + str(stats[name]) for name in ["maxDepth", "dropped", "blocked", "spilled"]))
+        print(scheduler.jitterReport())
@@ -0,0 +1,713 @@
+import os, io, sys, mmap, glob, struct, json, zlib, argparse
+import multiprocessing as mp
+import numpy as np
+from time import monotonic, time, perf_counter
+
+import guiSettings
+
+# Binary recording format, written next to each csv recording with the same name and a .bin extension
+# A fixed size header followed by one row of little endian int32s per packet, the columns are the same as the csv
+# (packet_id, chx0_eeg, chx0_i, chx0_q, chx1_eeg, ...) so row n is packet n of the recording and can be memory mapped directly
+headerMagic = b"EEGBIN01"
+headerFormat = "<8sIIdd" # magic, numChannels, numColumns, sampleRate, start time (seconds since epoch)
+headerSize = 64 # Header is padded to this size, leaves room to add fields later
+rowDtype = np.dtype("<i4")
+
+# Durable recordings also get a checksum file (same name, .sum extension) listing every block of rows that has been fsynced:
+# an 8 byte magic then one record per block (first row, number of rows, crc32 of the block's bytes in the .bin)
+# The rows themselves stay in the .bin untouched so it can still be memory mapped, after a crash recoverRecording cuts it back
+# to the end of the last block whose checksum matches
+checksumMagic = b"EEGSUM01"
+blockFormat = "<QII"
+blockSize = struct.calcsize(blockFormat)
+
+# Recordings can also get a sparse index (same name, .idx extension), a flat table of indexDtype records for the first row and then every
+# indexEvery rows and wherever acquisition indices skip (packets the save queue dropped), so any acquisition index or host time can be found
+# by a binary search over the records rather than a scan of the recording, see RecordingReader
+indexDtype = np.dtype([("row", "<u8"), ("sampleIndex", "<i8"), ("hostTime", "<f8"), ("offset", "<u8")]) # offset is the row's byte offset in the .bin
+
+# Returns the binary recording filename that goes with a csv recording filename
+def binFilename(csvFilename):
+
+    return os.path.splitext(csvFilename)[0] + ".bin"
+
+# Returns the checksum filename that goes with a binary recording filename
+def checksumFilename(binFilename):
+
+    return os.path.splitext(binFilename)[0] + ".sum"
+
+# Returns the sparse index filename that goes with a binary recording filename
+def indexFilename(binFilename):
+
+    return os.path.splitext(binFilename)[0] + ".idx"
+
+# Returns the directory the cached per channel pyramids of a binary recording are saved in
+def pyramidDirname(binFilename):
+
+    return os.path.splitext(binFilename)[0] + ".pyr"
+
+def writeHeader(file, numChannels, sampleRate, startTime):
+
+    header = struct.pack(headerFormat, headerMagic, numChannels, 1 + 3 * numChannels, sampleRate, startTime)
+    file.write(header.ljust(headerSize, b"\0"))
+
+# Returns the header of an open binary recording as a dict, raises ValueError if it isn't one
+def readHeader(file):
+
+    file.seek(0)
+    raw = file.read(headerSize)
+    if len(raw) < headerSize or raw[:len(headerMagic)] != headerMagic:
+        raise ValueError("Not a binary EEG recording")
+    _, numChannels, numColumns, sampleRate, startTime = struct.unpack_from(headerFormat, raw)
+    return {"numChannels": numChannels, "numColumns": numColumns, "sampleRate": sampleRate, "startTime": startTime}
+
+# Appends packets to a binary recording and keeps its MinMaxPyramid up to date as they are written
+# Giving syncSeconds and/or syncBytes makes it durable: rows are fsynced as one block whenever that much time or data has built up
+# since the last sync (and on close), and each block's checksum is added to the checksum file, so a crash loses at most one block
+# startTime can be left as None to open the file ahead of time, the header is then written with the first rows using startTime as set by then
+# Giving indexEvery also writes the sparse index, which needs every writeRows call to say which acquisition indices and times its rows are
+class RecordingWriter():
+
+    def __init__(self, filename, numChannels, sampleRate, startTime, syncSeconds=None, syncBytes=None, indexEvery=None):
+
+        self.filename = filename
+        self.numChannels = numChannels
+        self.numColumns = 1 + 3 * numChannels
+        self.sampleRate = sampleRate
+        self.startTime = startTime
+
+        self.file = open(filename, "ab")
+        self.needsHeader = self.file.tell() == 0
+        if self.needsHeader and startTime is not None:
+            self.writeHeader()
+        self.numRows = max(0, self.file.tell() - headerSize) // (self.numColumns * rowDtype.itemsize)
+
+        self.pyramid = MinMaxPyramid(self.numColumns - 1) # Packet ids aren't worth summarising, only the data columns are
+
+        self.indexEvery = indexEvery
+        self.indexFile = open(indexFilename(filename), "ab") if indexEvery else None
+        self.lastSampleIndex = None # Acquisition index of the last row written, a jump from it starts a new index record and run
+        self.runRows = [] # First row of every run of consecutive acquisition indices written, a dropped packet ends a run
+        self.runSampleIndices = [] # and its acquisition index, together they map acquisition indices to rows (see rowsAt)
+
+        self.syncSeconds = syncSeconds
+        self.syncBytes = syncBytes
+        self.checksumFile = None
+        if syncSeconds is not None or syncBytes is not None:
+            self.checksumFile = open(checksumFilename(filename), "ab")
+            if self.checksumFile.tell() == 0:
+                self.checksumFile.write(checksumMagic)
+            self.blockStart = self.numRows # First row not yet synced
+            self.blockCrc = 0
+            self.blockBytes = 0
+            self.lastSync = monotonic()
+
+    def writeHeader(self):
+
+        writeHeader(self.file, self.numChannels, self.sampleRate, time() if self.startTime is None else self.startTime)
+        self.needsHeader = False
+
+    # rows is a list of packets (or a 2d array), each in the saved data order starting with the packet id
+    # sampleIndices (the rows' acquisition indices) and lastRowTime (wall clock time the last row arrived) are needed for the index
+    def writeRows(self, rows, sampleIndices=None, lastRowTime=None):
+
+        if self.needsHeader:
+            self.writeHeader()
+        data = np.asarray(rows, dtype=rowDtype).reshape(-1, self.numColumns)
+        raw = data.tobytes()
+        if sampleIndices is not None and len(data):
+            sampleIndices = np.asarray(sampleIndices, dtype=np.int64)
+            previous = np.concatenate(([-2 if self.lastSampleIndex is None else self.lastSampleIndex], sampleIndices[:-1]))
+            runStarts = np.flatnonzero(sampleIndices != previous + 1)
+            self.runRows.extend((self.numRows + runStarts).tolist())
+            self.runSampleIndices.extend(sampleIndices[runStarts].tolist())
+            if self.indexFile:
+                self.writeIndex(sampleIndices, runStarts, lastRowTime)
+            self.lastSampleIndex = int(sampleIndices[-1])
+        self.file.write(raw)
+        self.file.flush() # Makes the rows visible to anything memory mapping the file
+        self.pyramid.add(data[:, 1:])
+        self.numRows += len(data)
+
+        if self.checksumFile:
+            self.blockCrc = zlib.crc32(raw, self.blockCrc)
+            self.blockBytes += len(raw)
+            if (self.syncBytes is not None and self.blockBytes >= self.syncBytes) or (self.syncSeconds is not None and monotonic() - self.lastSync >= self.syncSeconds):
+                self.sync()
+
+    # Adds the index records of the rows about to be written, their host times are spaced back from lastRowTime by the sample rate
+    # runStarts are the positions in sampleIndices that don't follow on from the row before, each gets a record
+    def writeIndex(self, sampleIndices, runStarts, lastRowTime):
+
+        rows = self.numRows + np.arange(len(sampleIndices))
+        marked = rows % self.indexEvery == 0
+        marked[runStarts] = True
+
+        records = np.zeros(np.count_nonzero(marked), dtype=indexDtype)
+        records["row"] = rows[marked]
+        records["sampleIndex"] = sampleIndices[marked]
+        records["hostTime"] = lastRowTime - (rows[-1] - rows[marked]) / self.sampleRate
+        records["offset"] = headerSize + rows[marked] * self.numColumns * rowDtype.itemsize
+        self.indexFile.write(records.tobytes())
+        self.indexFile.flush()
+
+    # Rows the packets at acquisition indices sampleIndices were written to, needs sampleIndices given to every writeRows call
+    # Packets that weren't written (dropped by the save queue, or not arrived yet) map to the next row that was, numRows if none has been
+    def rowsAt(self, sampleIndices):
+
+        sampleIndices = np.asarray(sampleIndices, dtype=np.int64)
+        if not self.runRows:
+            return np.full(len(sampleIndices), self.numRows, dtype=np.int64)
+        runRows = np.array(self.runRows + [self.numRows], dtype=np.int64) # Each run ends where the next starts
+        runSampleIndices = np.array(self.runSampleIndices, dtype=np.int64)
+        runs = np.maximum(np.searchsorted(runSampleIndices, sampleIndices, side="right") - 1, 0)
+        rows = runRows[runs] + np.maximum(sampleIndices - runSampleIndices[runs], 0)
+        return np.minimum(rows, runRows[runs + 1])
+
+    # Forces the rows written since the last sync to disk and records their block, only the rows are synced before the checksum so a
+    # checksum on disk always describes rows that are too
+    def sync(self):
+
+        if not self.checksumFile or self.numRows == self.blockStart:
+            return
+        os.fsync(self.file.fileno())
+        self.checksumFile.write(struct.pack(blockFormat, self.blockStart, self.numRows - self.blockStart, self.blockCrc))
+        self.checksumFile.flush()
+        os.fsync(self.checksumFile.fileno())
+
+        self.blockStart = self.numRows
+        self.blockCrc = 0
+        self.blockBytes = 0
+        self.lastSync = monotonic()
+
+    def close(self):
+
+        self.sync()
+        self.file.close()
+        if self.checksumFile:
+            self.checksumFile.close()
+        if self.indexFile:
+            self.indexFile.close()
+
+    # Saves the pyramids loadPyramids would otherwise build from the file, split from the one kept while writing so nothing is reread
+    def savePyramids(self):
+
+        dirname = pyramidDirname(self.filename)
+        os.makedirs(dirname, exist_ok=True)
+        numLevels = []
+        for ch in range(self.numChannels):
+            columns = slice(3 * ch, 3 * ch + 3)
+            channelPyramid = MinMaxPyramid(3, self.pyramid.baseBucket, self.pyramid.factor)
+            channelPyramid.levels = [PyramidLevel(3, level.mins[:, columns], level.maxs[:, columns]) for level in self.pyramid.levels]
+            channelPyramid.save(dirname, "ch" + str(ch))
+            numLevels.append(len(channelPyramid.levels))
+
+        with open(os.path.join(dirname, "info.json"), "w") as infoFile: # Written last, same as buildPyramids
+            json.dump({"numRows": self.numRows, "numLevels": numLevels}, infoFile)
+
+# Cuts a binary recording back to its last intact row, e.g. after the GUI was killed mid recording
+# With a checksum file every block is checked in order and the recording ends with the last block that matches, rows after it (unsynced
+# or damaged) are removed along with any checksum records past it. Without one only a partly written last row can be removed
+# Returns a dict of what was kept and removed, nothing is changed when dryRun is set
+def recoverRecording(filename, dryRun=False):
+
+    with open(filename, "rb") as file:
+        header = readHeader(file)
+        rowBytes = header["numColumns"] * rowDtype.itemsize
+        size = os.fstat(file.fileno()).st_size
+        numRows = (size - headerSize) // rowBytes
+
+        sumFilename = checksumFilename(filename)
+        numBlocks = None
+        keepRows = numRows
+        sumKeepSize = None
+        if os.path.exists(sumFilename):
+            with open(sumFilename, "rb") as sumFile:
+                checksums = sumFile.read()
+            numBlocks = 0
+            keepRows = 0
+            sumKeepSize = len(checksumMagic)
+            if checksums[:len(checksumMagic)] == checksumMagic:
+                for offset in range(len(checksumMagic), len(checksums) - blockSize + 1, blockSize):
+                    firstRow, blockRows, crc = struct.unpack_from(blockFormat, checksums, offset)
+                    if firstRow != keepRows or firstRow + blockRows > numRows:
+                        break
+                    file.seek(headerSize + firstRow * rowBytes)
+                    if zlib.crc32(file.read(blockRows * rowBytes)) != crc:
+                        break
+                    keepRows += blockRows
+                    numBlocks += 1
+                    sumKeepSize = offset + blockSize
+
+    if not dryRun:
+        if headerSize + keepRows * rowBytes != size:
+            os.truncate(filename, headerSize + keepRows * rowBytes)
+        if os.path.exists(indexFilename(filename)): # Index records of removed rows go too, as does a partly written last record
+            index = np.fromfile(indexFilename(filename), dtype=indexDtype, count=os.path.getsize(indexFilename(filename)) // indexDtype.itemsize)
+            os.truncate(indexFilename(filename), np.count_nonzero(index["row"] < keepRows) * indexDtype.itemsize)
+        if sumKeepSize is not None:
+            with open(sumFilename, "r+b") as sumFile:
+                sumFile.seek(0)
+                sumFile.write(checksumMagic) # A damaged magic is rewritten, the blocks after it were rejected anyway
+                sumFile.truncate(sumKeepSize)
+    return {"keptRows": keepRows, "removedRows": numRows - keepRows, "removedBytes": size - headerSize - keepRows * rowBytes,
+            "verifiedBlocks": numBlocks, "seconds": keepRows / header["sampleRate"]}
+
+# Read only memory mapped view of a binary recording, the file can keep growing while it is mapped
+class RecordingMap():
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.header = readHeader(self.file)
+        self.numColumns = self.header["numColumns"]
+        self.rowBytes = self.numColumns * rowDtype.itemsize
+
+        self.map = None
+        self.mappedSize = 0
+        self.rows = np.empty((0, self.numColumns), dtype=rowDtype) # Every complete row in the file, shaped (packets, columns)
+        self.refresh()
+
+    # Remaps the file if it has grown, cheap as nothing is read until rows is indexed
+    def refresh(self):
+
+        size = os.fstat(self.file.fileno()).st_size
+        numRows = (size - headerSize) // self.rowBytes
+        if numRows <= len(self.rows):
+            return
+
+        self.rows = None # The old view has to be released before the old map can be closed
+        if self.map:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mappedSize = size
+        self.rows = np.frombuffer(self.map, dtype=rowDtype, count=numRows * self.numColumns, offset=headerSize).reshape(numRows, self.numColumns)
+
+    def close(self):
+
+        self.rows = None
+        if self.map:
+            self.map.close()
+        self.file.close()
+
+# Random access to a finished or growing binary recording by acquisition index or host time, through its sparse index
+# Lookups are a binary search over the index records and reads only touch the memory mapped rows asked for
+# Recordings without an index are treated as gapless, starting at acquisition index 0 and the header's start time
+class RecordingReader():
+
+    def __init__(self, filename):
+
+        self.recordingMap = RecordingMap(filename)
+        self.header = self.recordingMap.header
+        self.numChannels = self.header["numChannels"]
+        self.sampleRate = self.header["sampleRate"]
+        self.index = None
+        self.refresh()
+
+    # Picks up rows and index records written since the last call
+    def refresh(self):
+
+        self.recordingMap.refresh()
+        numRows = len(self.recordingMap.rows)
+        filename = indexFilename(self.recordingMap.filename)
+        numRecords = os.path.getsize(filename) // indexDtype.itemsize if os.path.exists(filename) else 0
+        if numRecords:
+            index = np.memmap(filename, dtype=indexDtype, mode="r", shape=(numRecords,))
+            self.index = index[:np.searchsorted(index["row"], numRows)] # Records are written just ahead of their rows
+        if self.index is None or not len(self.index):
+            self.index = np.zeros(1, dtype=indexDtype)
+            self.index["hostTime"] = self.header["startTime"]
+            self.index["offset"] = headerSize
+
+    def __len__(self):
+
+        return len(self.recordingMap.rows)
+
+    # Row of the recording holding acquisition index sampleIndex, or the row after it if that packet wasn't recorded
+    def rowAt(self, sampleIndex):
+
+        idx = max(0, np.searchsorted(self.index["sampleIndex"], sampleIndex, side="right") - 1)
+        return self.rowFrom(idx, sampleIndex - int(self.index["sampleIndex"][idx]))
+
+    # Row of the recording that arrived at wall clock time hostTime, rounded to the nearest packet
+    def rowAtTime(self, hostTime):
+
+        idx = max(0, np.searchsorted(self.index["hostTime"], hostTime, side="right") - 1)
+        return self.rowFrom(idx, int(round((hostTime - self.index["hostTime"][idx]) * self.sampleRate)))
+
+    # The row steps after index record idx, clamped to the rows that record covers (up to the next record or the end of the recording)
+    def rowFrom(self, idx, steps):
+
+        end = int(self.index["row"][idx + 1]) if idx + 1 < len(self.index) else len(self)
+        return min(max(0, int(self.index["row"][idx]) + steps), end)
+
+    # Returns (packetIds, samples) for count recorded packets starting at acquisition index start, from channels (all by default)
+    # laid out the same as RawRingBuffer.readRange: samples is shaped (packets, channels, 3) with the last axis being eeg, i, q
+    # Fewer packets are returned if the recording ends first
+    def read(self, start, count, channels=None):
+
+        first = self.rowAt(start)
+        return self.readRows(first, min(first + count, len(self)), channels)
+
+    # Same as read for the packets that arrived between wall clock times t0 and t1
+    def readTime(self, t0, t1, channels=None):
+
+        return self.readRows(self.rowAtTime(t0), self.rowAtTime(t1), channels)
+
+    def readRows(self, first, stop, channels):
+
+        rows = self.recordingMap.rows[first:stop] # Still a view of the map, nothing has been read yet
+        samples = rows[:, 1:].reshape(len(rows), self.numChannels, 3)
+        if channels is not None:
+            samples = samples[:, list(channels)]
+        return np.array(rows[:, 0]), np.array(samples)
+
+    def close(self):
+
+        self.index = None
+        self.recordingMap.close()
+
+# Multi resolution min/max summary of a growing 2d array (samples, columns), used to draw any zoom level without touching the raw data
+# Level 0 holds the min and max of every baseBucket samples, each following level summarises 'factor' buckets of the one below
+# Built incrementally, adding samples only ever summarises the new complete buckets
+class MinMaxPyramid():
+
+    def __init__(self, numColumns, baseBucket=64, factor=8):
+
+        self.numColumns = numColumns
+        self.baseBucket = baseBucket
+        self.factor = factor
+        self.numSamples = 0
+        self.pending = np.empty((0, numColumns), dtype=rowDtype) # Samples not yet making a full level 0 bucket
+        self.levels = [] # List of PyramidLevels, finest first
+
+    # Saves every level as .npy files in dirname so they can later be memory mapped by load
+    def save(self, dirname, prefix):
+
+        for idx, level in enumerate(self.levels):
+            np.save(os.path.join(dirname, prefix + "_min" + str(idx) + ".npy"), level.mins)
+            np.save(os.path.join(dirname, prefix + "_max" + str(idx) + ".npy"), level.maxs)
+
+    # Loads a pyramid written by save, levels are memory mapped so only the buckets that are drawn are ever read from disk
+    # A loaded pyramid is read only, nothing can be added to it
+    @classmethod
+    def load(cls, dirname, prefix, numColumns, numSamples, numLevels, baseBucket=64, factor=8):
+
+        pyramid = cls(numColumns, baseBucket, factor)
+        pyramid.numSamples = numSamples
+        for idx in range(numLevels):
+            mins = np.load(os.path.join(dirname, prefix + "_min" + str(idx) + ".npy"), mmap_mode="r")
+            maxs = np.load(os.path.join(dirname, prefix + "_max" + str(idx) + ".npy"), mmap_mode="r")
+            pyramid.levels.append(PyramidLevel(numColumns, mins, maxs))
+        return pyramid
+
+    def bucketSize(self, level):
+
+        return self.baseBucket * self.factor ** level
+
+    def add(self, data):
+
+        data = np.concatenate((self.pending, np.asarray(data, dtype=rowDtype).reshape(-1, self.numColumns)))
+        self.numSamples += len(data) - len(self.pending)
+        numBuckets = len(data) // self.baseBucket
+        used = numBuckets * self.baseBucket
+        self.pending = data[used:]
+
+        if numBuckets:
+            complete = data[:used].reshape(numBuckets, self.baseBucket, self.numColumns)
+            self.addToLevel(0, complete.min(axis=1), complete.max(axis=1))
+
+    # Appends buckets to a level and carries any newly completed groups of factor buckets up to the next level
+    def addToLevel(self, levelIdx, mins, maxs):
+
+        if levelIdx == len(self.levels):
+            self.levels.append(PyramidLevel(self.numColumns))
+        level = self.levels[levelIdx]
+        level.append(mins, maxs)
+
+        parentDone = self.levels[levelIdx + 1].count if levelIdx + 1 < len(self.levels) else 0
+        parentTotal = level.count // self.factor
+        if parentTotal > parentDone:
+            groupMins = level.mins[parentDone * self.factor:parentTotal * self.factor].reshape(-1, self.factor, self.numColumns)
+            groupMaxs = level.maxs[parentDone * self.factor:parentTotal * self.factor].reshape(-1, self.factor, self.numColumns)
+            self.addToLevel(levelIdx + 1, groupMins.min(axis=1), groupMaxs.max(axis=1))
+
+    # Returns (x, y) to draw column over samples [start, stop) with about maxPoints points, x is the sample index
+    # Uses the finest level that needs at most maxPoints / 2 buckets, anything newer than that level covers comes from finer levels
+    # and finally from rawColumn (the column's raw samples, e.g. from a RecordingMap) so the newest data is always included
+    def getEnvelope(self, rawColumn, column, start, stop, maxPoints):
+
+        start = max(0, start)
+        stop = min(stop, len(rawColumn))
+        if stop - start <= maxPoints or not self.levels: # Few enough samples to draw them all
+            x = np.arange(start, stop)
+            return x, np.asarray(rawColumn[start:stop])
+
+        levelIdx = 0
+        while levelIdx + 1 < len(self.levels) and (stop - start) / self.bucketSize(levelIdx) > maxPoints / 2:
+            levelIdx += 1
+
+        xPieces = []
+        yPieces = []
+        pos = start
+        for idx in range(levelIdx, -1, -1):
+            size = self.bucketSize(idx)
+            level = self.levels[idx]
+            first = pos // size
+            last = min(level.count, -(-stop // size))
+            if last > first:
+                starts = np.arange(first, last) * size
+                xPieces.append(np.repeat(starts, 2))
+                yPieces.append(np.stack((level.mins[first:last, column], level.maxs[first:last, column]), axis=1).ravel())
+                pos = last * size
+
+        if pos < stop:
+            xPieces.append(np.arange(pos, stop))
+            yPieces.append(np.asarray(rawColumn[pos:stop]))
+
+        return np.concatenate(xPieces), np.concatenate(yPieces)
+
+# One level of a MinMaxPyramid, growable arrays of per bucket mins and maxs shaped (buckets, columns)
+class PyramidLevel():
+
+    # mins and maxs can be given to wrap existing (e.g. memory mapped) arrays without copying them
+    def __init__(self, numColumns, mins=None, maxs=None):
+
+        if mins is None:
+            self.count = 0
+            self.allMins = np.empty((16, numColumns), dtype=rowDtype)
+            self.allMaxs = np.empty((16, numColumns), dtype=rowDtype)
+        else:
+            self.count = len(mins)
+            self.allMins = mins
+            self.allMaxs = maxs
+
+    @property
+    def mins(self):
+
+        return self.allMins[:self.count]
+
+    @property
+    def maxs(self):
+
+        return self.allMaxs[:self.count]
+
+    def append(self, mins, maxs):
+
+        newCount = self.count + len(mins)
+        if newCount > len(self.allMins): # Doubles the capacity so appends are amortised O(1)
+            capacity = max(newCount, 2 * len(self.allMins))
+            self.allMins = np.concatenate((self.allMins[:self.count], np.empty((capacity - self.count, self.allMins.shape[1]), dtype=rowDtype)))
+            self.allMaxs = np.concatenate((self.allMaxs[:self.count], np.empty((capacity - self.count, self.allMaxs.shape[1]), dtype=rowDtype)))
+        self.allMins[self.count:newCount] = mins
+        self.allMaxs[self.count:newCount] = maxs
+        self.count = newCount
+
+# Builds the pyramid of one channel's (eeg, i, q) columns and saves it in dirname, run in a worker process by buildPyramids
+# Reads the recording in chunks through a memory map so memory use doesn't depend on the length of the recording
+def buildChannelPyramid(binFilename, dirname, channel):
+
+    chunkRows = 1 << 18
+    recordingMap = RecordingMap(binFilename)
+    columns = recordingMap.rows[:, 1 + 3 * channel:4 + 3 * channel]
+    pyramid = MinMaxPyramid(3)
+    for start in range(0, len(columns), chunkRows):
+        pyramid.add(columns[start:start + chunkRows])
+    pyramid.save(dirname, "ch" + str(channel))
+    numLevels = len(pyramid.levels)
+
+    del columns
+    recordingMap.close()
+    return numLevels
+
+# Builds and saves the pyramids of every channel of a finished binary recording, one channel per worker process
+def buildPyramids(binFilename, processes=None):
+
+    recordingMap = RecordingMap(binFilename)
+    numChannels = recordingMap.header["numChannels"]
+    numRows = len(recordingMap.rows)
+    recordingMap.close()
+
+    dirname = pyramidDirname(binFilename)
+    os.makedirs(dirname, exist_ok=True)
+    with mp.Pool(processes or min(numChannels, os.cpu_count() or 1)) as pool:
+        numLevels = pool.starmap(buildChannelPyramid, [(binFilename, dirname, ch) for ch in range(numChannels)])
+
+    # Info is written last, so a build that was interrupted is never mistaken for a finished one
+    with open(os.path.join(dirname, "info.json"), "w") as infoFile:
+        json.dump({"numRows": numRows, "numLevels": numLevels}, infoFile)
+
+# Returns one memory mapped MinMaxPyramid per channel (columns eeg, i, q) for a finished binary recording
+# Uses the pyramids cached next to the recording, building them first if they are missing or out of date
+def loadPyramids(binFilename, processes=None):
+
+    recordingMap = RecordingMap(binFilename)
+    numRows = len(recordingMap.rows)
+    recordingMap.close()
+
+    dirname = pyramidDirname(binFilename)
+    infoFilename = os.path.join(dirname, "info.json")
+    info = None
+    if os.path.exists(infoFilename):
+        with open(infoFilename, "r") as infoFile:
+            info = json.load(infoFile)
+    if info is None or info["numRows"] != numRows:
+        buildPyramids(binFilename, processes)
+        with open(infoFilename, "r") as infoFile:
+            info = json.load(infoFile)
+
+    return [MinMaxPyramid.load(dirname, "ch" + str(ch), 3, numRows, numLevels) for ch, numLevels in enumerate(info["numLevels"])]
+
+# Yields the rows of a csv recording written by the SaveDataWriter as int32 arrays shaped (rows, numColumns), parsed chunkBytes at a time
+# Raises ValueError if the header or any row isn't what the SaveDataWriter writes
+def readCsvChunks(csvFilename, numColumns, chunkBytes=1 << 24):
+
+    with open(csvFilename, "rb") as csvFile:
+        csvFile.readline() # Header
+        rowNum = 1
+        remainder = b""
+        while True:
+            chunk = csvFile.read(chunkBytes)
+            if not chunk and not remainder:
+                return
+            chunk = remainder + chunk
+            end = chunk.rfind(b"\n") + 1 if chunk.endswith(b"\n") or csvFile.peek(1) else len(chunk) # Cut at the last whole line unless it's the end of the file
+            chunk, remainder = chunk[:end], chunk[end:]
+            if not chunk:
+                continue
+
+            numLines = chunk.count(b"\n") + (not chunk.endswith(b"\n"))
+            try: # Rows with a value that isn't a whole number or a different number of values raise ValueError, blank lines are caught by the shape check
+                values = np.loadtxt(io.StringIO(chunk.decode("ascii")), delimiter=",", dtype=np.int64, ndmin=2)
+            except (ValueError, UnicodeDecodeError):
+                values = None
+            if values is None or values.shape != (numLines, numColumns):
+                raise ValueError(csvFilename + ": malformed row between lines " + str(rowNum + 1) + " and " + str(rowNum + numLines))
+            rowNum += numLines
+            yield values.astype(rowDtype)
+
+# Converts one csv recording to a binary recording with a sparse index next to it, run in a worker process by convertCsvFiles
+# The files are written under temporary names and only renamed once complete, so an interrupted conversion is never mistaken for a finished one
+# csv recordings hold no acquisition indices or times, rows are numbered from 0 and timed back from the file's last modification at sampleRate
+# Returns (csvFilename, rows, csv bytes, seconds taken)
+def convertCsv(csvFilename, sampleRate):
+
+    start = perf_counter()
+    with open(csvFilename, "r") as csvFile:
+        header = csvFile.readline().strip().split(",")
+    numChannels = (len(header) - 1) // 3
+    expected = ["packet_id"] + [chx + suffix for chx in ["chx" + str(ch) for ch in range(numChannels)] for suffix in ["_eeg", "_i", "_q"]]
+    if header != expected:
+        raise ValueError(csvFilename + ": header isn't a SaveDataWriter recording's")
+
+    with open(csvFilename, "rb") as csvFile:
+        numRows = sum(chunk.count(b"\n") for chunk in iter(lambda: csvFile.read(1 << 24), b"")) - 1
+    startTime = os.path.getmtime(csvFilename) - numRows / sampleRate
+
+    stem = os.path.splitext(csvFilename)[0]
+    partFilename = stem + ".converting.bin"
+    for filename in [partFilename, indexFilename(partFilename)]: # Leftovers of an interrupted run
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    recordingWriter = RecordingWriter(partFilename, numChannels, sampleRate, startTime, indexEvery=int(sampleRate))
+    try:
+        for rows in readCsvChunks(csvFilename, len(expected)):
+            sampleIndices = np.arange(recordingWriter.numRows, recordingWriter.numRows + len(rows))
+            recordingWriter.writeRows(rows, sampleIndices, startTime + sampleIndices[-1] / sampleRate)
+    finally:
+        recordingWriter.close()
+        if sys.exc_info()[0] is not None:
+            os.remove(partFilename)
+            os.remove(indexFilename(partFilename))
+    os.replace(indexFilename(partFilename), indexFilename(stem + ".bin"))
+    os.replace(partFilename, stem + ".bin")
+    return csvFilename, recordingWriter.numRows, os.path.getsize(csvFilename), perf_counter() - start
+
+# Pool worker, returns (csvFilename, error) instead of raising so one bad file doesn't stop the rest
+def tryConvertCsv(args):
+
+    try:
+        return convertCsv(*args)
+    except (OSError, ValueError) as e:
+        return args[0], e
+
+# Converts csv recordings on a pool of processes, skipping ones the manifest lists as already converted (and unchanged since)
+# and ones that already have a binary recording, e.g. from the GUI. The manifest is updated as each file finishes so a rerun picks up where
+# an interrupted one stopped. Prints each file and the overall rate as it goes
+def convertCsvFiles(csvFilenames, manifestFilename, sampleRate, processes=None):
+
+    manifest = {}
+    if os.path.exists(manifestFilename):
+        with open(manifestFilename, "r") as manifestFile:
+            manifest = json.load(manifestFile)
+
+    todo = []
+    for csvFilename in csvFilenames:
+        key = os.path.abspath(csvFilename)
+        done = manifest.get(key)
+        if done and done["size"] == os.path.getsize(csvFilename) and done["mtime"] == os.path.getmtime(csvFilename):
+            print(csvFilename + ": already converted")
+        elif not done and os.path.exists(binFilename(csvFilename)):
+            print(csvFilename + ": already has a binary recording")
+        else:
+            todo.append(csvFilename)
+
+    start = perf_counter()
+    totalRows = 0
+    totalBytes = 0
+    failed = 0
+    with mp.Pool(processes or os.cpu_count() or 1) as pool:
+        for result in pool.imap_unordered(tryConvertCsv, [(csvFilename, sampleRate) for csvFilename in todo]):
+            if isinstance(result[1], Exception):
+                print(result[0] + ": failed, " + str(result[1]))
+                failed += 1
+                continue
+
+            csvFilename, numRows, numBytes, seconds = result
+            totalRows += numRows
+            totalBytes += numBytes
+            manifest[os.path.abspath(csvFilename)] = {"size": numBytes, "mtime": os.path.getmtime(csvFilename), "rows": numRows}
+            with open(manifestFilename + ".tmp", "w") as manifestFile: # Replaced in one step so the manifest is never half written
+                json.dump(manifest, manifestFile, indent=1)
+            os.replace(manifestFilename + ".tmp", manifestFilename)
+            print(csvFilename + ": " + str(numRows) + " rows in " + str(round(seconds, 2)) + "s (" + str(round(numBytes / 2**20 / max(seconds, 1e-9), 1)) + " MiB/s)")
+
+    seconds = perf_counter() - start
+    print("Converted " + str(len(todo) - failed) + " of " + str(len(todo)) + " files, " + str(totalRows) + " rows, " + str(round(totalBytes / 2**20, 1)) + " MiB in "
+          + str(round(seconds, 2)) + "s: " + str(int(totalRows / max(seconds, 1e-9))) + " rows/s, " + str(round(totalBytes / 2**20 / max(seconds, 1e-9), 1)) + " MiB/s")
+    return failed
+
+# Maintenance of binary recordings from the command line, e.g. 'python guiRecording.py recover ../data/abc-0.bin'
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Binary recording tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    recoverParser = subparsers.add_parser("recover", help="Cut recordings back to their last intact block after a crash")
+    recoverParser.add_argument("recordings", nargs="+", help=".bin files")
+    recoverParser.add_argument("-n", "--dry-run", action="store_true", help="Only report what would be removed")
+    convertParser = subparsers.add_parser("convert", help="Convert csv recordings to indexed binary recordings")
+    convertParser.add_argument("recordings", nargs="*", help=".csv files, all of ../data by default")
+    convertParser.add_argument("-m", "--manifest", default="../data/conversionManifest.json", help="Records finished files so reruns skip them")
+    convertParser.add_argument("-j", "--processes", type=int, default=None, help="Files converted at once, one per cpu by default")
+    convertParser.add_argument("-r", "--sample-rate", type=float, default=guiSettings.sampleRate, help="Packets per second the recordings were made at")
+    args = parser.parse_args()
+
+    if args.command == "recover":
+        failed = False
+        for filename in args.recordings:
+            try:
+                result = recoverRecording(filename, args.dry_run)
+            except (OSError, ValueError) as e:
+                print(filename + ": " + str(e))
+                failed = True
+                continue
+            checked = "no checksum file, only whole rows checked" if result["verifiedBlocks"] is None else str(result["verifiedBlocks"]) + " blocks verified"
+            print(filename + ": kept " + str(result["keptRows"]) + " rows (" + str(round(result["seconds"], 1)) + "s, " + checked + "), "
+                  + ("would remove " if args.dry_run else "removed ") + str(result["removedRows"]) + " rows (" + str(result["removedBytes"]) + " bytes)")
+        sys.exit(1 if failed else 0)
+
+    elif args.command == "convert":
+        recordings = args.recordings or sorted(glob.glob("../data/*-*.csv"))
+        sys.exit(1 if convertCsvFiles(recordings, args.manifest, args.sample_rate, args.processes) else 0)
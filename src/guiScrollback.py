@@ -0,0 +1,127 @@
+from PyQt5.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QCheckBox
+from PyQt5.QtCore import QTimer
+from pyqtgraph import PlotWidget, mkPen
+
+import guiRecording
+
+# Button to pull up the scrollback window
+class ScrollbackButton(QPushButton):
+
+    def __init__(self, saveDataWriter):
+
+        super().__init__("Scrollback")
+        self.clicked.connect(self.showPopup)
+
+        self.saveDataWriter = saveDataWriter
+        self.scrollbackWindow = None
+
+    def showPopup(self):
+
+        if not self.scrollbackWindow:
+            self.scrollbackWindow = ScrollbackWindow(self.saveDataWriter)
+            self.scrollbackWindow.startUpdate()
+        self.scrollbackWindow.show()
+
+# Lets the user pan and zoom over the whole of the current recording while acquisition continues
+# Reads the binary recording through a memory map and draws it from the recording's min/max pyramid, so nothing is loaded into RAM
+class ScrollbackWindow(QWidget):
+
+    def __init__(self, saveDataWriter):
+
+        super().__init__()
+        self.setWindowTitle("Scrollback")
+
+        self.saveDataWriter = saveDataWriter
+        self.recordingWriter = None # Writer of the recording being viewed, holds the pyramid
+        self.recordingMap = None
+
+        self.refreshRate = 200 # Refresh rate in ms, controls how often new data is looked for
+        self.followSeconds = 10 # Width of the window shown when following live data
+
+        layout = QVBoxLayout()
+        optionsLayout = QHBoxLayout()
+
+        self.columnSelection = QComboBox()
+        self.columnSelection.addItems(saveDataWriter.header[1:]) # Same columns as the saved data, minus the packet id
+        self.columnSelection.currentIndexChanged.connect(self.redraw)
+
+        # When checked the view scrolls with the incoming data, panning or zooming pauses it so the user can look back
+        self.follow = QCheckBox("Follow Live")
+        self.follow.setCheckState(2)
+        self.follow.stateChanged.connect(self.redraw)
+
+        self.status = QLabel("No Recording")
+
+        optionsLayout.addWidget(self.columnSelection)
+        optionsLayout.addWidget(self.follow)
+        optionsLayout.addWidget(self.status)
+
+        self.plot = PlotWidget()
+        self.plot.setBackground('w')
+        self.plot.setMouseEnabled(x=True, y=False) # Drag to pan and scroll to zoom along the time axis
+        self.plot.setLabel('bottom', "Time (s)")
+        self.plot.getPlotItem().getViewBox().sigRangeChangedManually.connect(self.pauseFollow)
+        self.plot.getPlotItem().getViewBox().sigXRangeChanged.connect(self.redraw)
+        self.data_line = self.plot.plot([], [], pen=mkPen(color=(0,0,0), width=1))
+
+        layout.addLayout(optionsLayout)
+        layout.addWidget(self.plot)
+        self.setLayout(layout)
+
+        self.redrawing = False
+
+    def startUpdate(self):
+
+        self.timer = QTimer()
+        self.timer.setInterval(self.refreshRate)
+        self.timer.timeout.connect(self.refreshData)
+        self.timer.start()
+
+    # Picks up new data (or a new recording) and moves the view along if following
+    def refreshData(self):
+
+        if not self.isVisible():
+            return
+
+        recordingWriter = self.saveDataWriter.recordingWriter
+        if recordingWriter is not None and recordingWriter is not self.recordingWriter: # Recording started or moved on to a new file
+            if self.recordingMap:
+                self.recordingMap.close()
+            self.recordingWriter = recordingWriter
+            self.recordingMap = guiRecording.RecordingMap(recordingWriter.filename)
+
+        if self.recordingMap is None:
+            return
+
+        self.recordingMap.refresh()
+        numRows = len(self.recordingMap.rows)
+        sampleRate = self.recordingMap.header["sampleRate"]
+        self.status.setText(self.recordingMap.filename + ": " + str(round(numRows / sampleRate, 1)) + "s")
+
+        if self.follow.isChecked():
+            end = numRows / sampleRate
+            self.plot.setXRange(max(0, end - self.followSeconds), end, padding=0) # Triggers a redraw through sigXRangeChanged
+        else:
+            self.redraw()
+
+    def pauseFollow(self):
+
+        self.follow.setCheckState(0)
+
+    # Draws the visible time range at about two points per pixel
+    def redraw(self):
+
+        if self.recordingMap is None or self.redrawing:
+            return
+        self.redrawing = True
+
+        try: # Cleared however the redraw ends, or one failed redraw would stop every later one
+            sampleRate = self.recordingMap.header["sampleRate"]
+            (xMin, xMax), _ = self.plot.getPlotItem().getViewBox().viewRange()
+            maxPoints = 2 * max(1, int(self.plot.getPlotItem().getViewBox().width()))
+            column = self.columnSelection.currentIndex()
+
+            x, y = self.recordingWriter.pyramid.getEnvelope(self.recordingMap.rows[:, column + 1], column, int(xMin * sampleRate), int(xMax * sampleRate) + 1, maxPoints)
+            self.data_line.setData(x / sampleRate, y)
+        finally:
+            self.redrawing = False
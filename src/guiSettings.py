@@ -0,0 +1,8 @@
+# Acquisition settings shared by the GUI, the headless protocol runner and the offline tools, kept free of Qt so any process can import them
+# Times in scrollback, events, epochs and the spectra are all worked out from sampleRate, so it's only set here
+
+numChannels = 8 # Number of channels to expect, will definitely break if value is incorrect
+sampleRate = 1000 # Packets per second streamed by the chip, used to convert packet counts to time/frequency, change if the chip's output rate changes
+rawBufferSeconds = 60 # Seconds of raw packets kept in the RawRingBuffer, for backfilling graphs and cutting epochs
+saveQueueSeconds = 5 # Seconds of packets the recording can fall behind by before saveQueuePolicy applies
+saveQueuePolicy = "spill" # "block", "dropOldest" or "spill", see guiAcquisition.SaveQueue
@@ -0,0 +1,205 @@
+import multiprocessing as mp
+from time import sleep
+import numpy as np
+
+import guiDSP
+from guiDataProcesses import DataProcess
+
+# Computes a live welch power spectral density for every channel at once and feeds it to SpectralTraces
+# Keeps a rolling window of the raw EEG per channel, every 'hopLength' new packets one new hann windowed segment is transformed
+# (all channels in a single rfft) and swapped into the welch average, so each refresh only costs one FFT rather than a full welch
+class SpectralDataProcess():
+
+    def __init__(self, running, rawRingBuffer, sampleRate, amFreq, traceLists, xAxisLength):
+
+        self.running = running
+        self.rawRingBuffer = rawRingBuffer # Every packet is read from here by acquisition index, the welch segments need evenly spaced samples
+        self.numChannels = rawRingBuffer.numChannels
+        self.sampleRate = sampleRate
+        self.amFreq = amFreq # Shared value set by the cue system when an ASSR test is configured
+
+        segmentSeconds = 2 # Length of each welch segment, sets the frequency resolution to 1/segmentSeconds Hz
+        self.segmentLength = int(segmentSeconds * sampleRate)
+        self.hopLength = max(1, self.segmentLength // 4) # 75% overlap between consecutive segments
+        self.numSegments = 8 # Number of segments averaged together, more gives a smoother but slower to react estimate
+        self.maxFreq = min(100, sampleRate / 2) # Highest frequency shown on the psd plots
+
+        self.window = guiDSP.hannWindow(self.segmentLength)
+        self.freqs = guiDSP.rfftFreqs(self.segmentLength, sampleRate)
+        self.numShownBins = int(np.searchsorted(self.freqs, self.maxFreq, side="right"))
+        self.bandNames = list(guiDSP.bands.keys())
+        self.bandEdges = list(guiDSP.bands.values())
+
+        # Rolling window is stored twice back to back so the newest segmentLength samples are always one contiguous slice
+        self.buffer = np.zeros((self.numChannels, 2 * self.segmentLength))
+        self.writeIdx = 0
+
+        self.resetEstimate()
+
+        self.nextIndex = 0 # Acquisition index of the next packet to add, also the x axis position of the band and AM traces (one step per packet)
+
+        # traceLists provides the (x, y) managed lists for every trace, in the same order as they are created below
+        # Each trace gets its own shared xAxis length, same as the other DataProcesses
+        traceLists = iter(traceLists)
+        self.psdTraces = [] # One psd (x is frequency) trace per channel
+        self.bandTraces = [] # Per channel list of band power traces, same order as self.bandNames
+        self.amTraces = [] # Per channel trace of the power at the AM frequency
+        for _ in range(self.numChannels):
+            self.psdTraces.append(PSDTrace(running, *next(traceLists), mp.Value('i', xAxisLength), self.freqs[:self.numShownBins]))
+            self.bandTraces.append([SpectralTrace(running, *next(traceLists), mp.Value('i', xAxisLength)) for _ in self.bandNames])
+            self.amTraces.append(SpectralTrace(running, *next(traceLists), mp.Value('i', xAxisLength)))
+
+        self.allTraces = self.psdTraces + [trace for traces in self.bandTraces for trace in traces] + self.amTraces
+        self.computing = False
+
+        self.refreshRate = 2 # Refresh rate in ms, controls how often new data is looked for
+        self.idleRefreshRate = 50 # Refresh rate in ms while none of the traces are subscribed
+
+    # Clears the rolling window and the welch average
+    def resetEstimate(self):
+
+        self.numSamples = 0
+        self.samplesSinceHop = 0
+
+        # Periodograms of the last numSegments segments and their running sum, the welch estimate is sum / count
+        self.psdHistory = np.zeros((self.numSegments, self.numChannels, len(self.freqs)))
+        self.psdSum = np.zeros((self.numChannels, len(self.freqs)))
+        self.historyIdx = 0
+        self.historyCount = 0
+
+    # Number of (x, y) list pairs the constructor needs in traceLists
+    @staticmethod
+    def numTraces(numChannels):
+
+        return numChannels * (len(guiDSP.bands) + 2)
+
+    # Returns ("Graph Name", DataProcess) tuples for every trace so they can be added to the selectable graphs
+    def getPlotDataProcesses(self):
+
+        plotDataProcesses = []
+        for ch in range(self.numChannels):
+            plotDataProcesses.append(("Ch " + str(ch) + " PSD", self.psdTraces[ch]))
+            for name, trace in zip(self.bandNames, self.bandTraces[ch]):
+                plotDataProcesses.append(("Ch " + str(ch) + " " + name + " power", trace))
+            plotDataProcesses.append(("Ch " + str(ch) + " AM power", self.amTraces[ch]))
+        return plotDataProcesses
+
+    # The spectra are computed for all channels together, so they're needed as long as any one trace is subscribed
+    def isSubscribed(self):
+
+        return any(trace.numSubscribers.value > 0 for trace in self.allTraces)
+
+    # Starts a loop to call the updateData function
+    def startUpdateData(self):
+
+        while True:
+            if not self.isSubscribed():
+                self.computing = False
+                sleep(self.idleRefreshRate * 0.001)
+                continue
+
+            if bool(self.running.value):
+                if not self.computing: # Just subscribed, rebuilds the estimate from recent data so the traces don't start empty
+                    self.backfill()
+                    self.computing = True
+                self.updateData()
+
+            sleep(self.refreshRate * 0.001) # This caps the refresh rate and lowers the load on the computer, full speed not needed
+
+    # Replays the packets in rawRingBuffer needed for a full welch average through the estimate
+    def backfill(self):
+
+        historyLength = self.segmentLength + (self.numSegments - 1) * self.hopLength
+        numWritten = self.rawRingBuffer.numWritten.value
+        packetIds, samples = self.rawRingBuffer.readLatest(historyLength)
+        self.resetEstimate()
+        self.nextIndex = numWritten - len(packetIds)
+        self.addSamples(samples)
+
+    # Adds every packet that arrived since the last call, starting over from recent data if rawRingBuffer has already overwritten some
+    def updateData(self):
+
+        numWritten = self.rawRingBuffer.numWritten.value
+        if numWritten == self.nextIndex:
+            return
+        packets = self.rawRingBuffer.readRange(self.nextIndex, numWritten - self.nextIndex)
+        if packets is None: # Fell a whole ring behind, the missed packets would leave a gap in the segments
+            self.backfill()
+            return
+        self.addSamples(packets[1])
+
+    # Adds consecutive packets, samples shaped (packets, numChannels, 3) as rawRingBuffer returns them
+    def addSamples(self, samples):
+
+        for sample in samples[:, :, 0].astype(float):
+            self.nextIndex += 1
+            self.addSample(sample)
+
+    # Adds one packet's EEG for every channel to the rolling window and updates the estimate once a full hop has arrived
+    def addSample(self, sample):
+
+        self.buffer[:, self.writeIdx] = sample
+        self.buffer[:, self.writeIdx + self.segmentLength] = sample
+        self.writeIdx = (self.writeIdx + 1) % self.segmentLength
+        self.numSamples += 1
+        self.samplesSinceHop += 1
+
+        if self.numSamples >= self.segmentLength and self.samplesSinceHop >= self.hopLength:
+            self.samplesSinceHop = 0
+            self.updateEstimate()
+
+    # Transforms the newest segment for all channels and swaps it into the welch average
+    def updateEstimate(self):
+
+        segment = self.buffer[:, self.writeIdx:self.writeIdx + self.segmentLength]
+        psd = guiDSP.periodograms(segment, self.window, self.sampleRate)
+
+        self.psdSum += psd - self.psdHistory[self.historyIdx]
+        self.psdHistory[self.historyIdx] = psd
+        self.historyIdx = (self.historyIdx + 1) % self.numSegments
+        self.historyCount = min(self.historyCount + 1, self.numSegments)
+        if self.historyIdx == 0: # Resums from the history every full cycle so float error can't accumulate
+            self.psdSum = self.psdHistory.sum(axis=0)
+
+        welch = self.psdSum / self.historyCount
+        powers = guiDSP.bandPowers(welch, self.freqs, self.bandEdges)
+        amPower = guiDSP.binPower(welch, self.freqs, self.amFreq.value)
+        shownDB = 10 * np.log10(welch[:, :self.numShownBins] + 1e-12) # Small offset avoids log(0) on flat signals
+
+        for ch in range(self.numChannels):
+            self.psdTraces[ch].setSpectrum(shownDB[ch].tolist())
+            for bandIdx, trace in enumerate(self.bandTraces[ch]):
+                trace.pushPoint(self.nextIndex - 1, float(powers[ch, bandIdx]))
+            self.amTraces[ch].pushPoint(self.nextIndex - 1, float(amPower[ch]))
+
+# Time series trace filled by a SpectralDataProcess instead of by its own process
+class SpectralTrace(DataProcess):
+
+    def __init__(self, running, x, y, xAxisLength):
+
+        super().__init__(running, None, x, y, xAxisLength)
+
+    def startUpdateData(self):
+
+        pass # Data is pushed by the SpectralDataProcess that owns this trace
+
+# Power spectral density trace, x is frequency so it has a fixed length and isn't affected by x axis resizing
+class PSDTrace(SpectralTrace):
+
+    def __init__(self, running, x, y, xAxisLength, freqs):
+
+        super().__init__(running, x, y, xAxisLength)
+        with self.lock:
+            self.x[:] = freqs.tolist()
+            self.y[:] = [0] * len(freqs)
+            self.numReplaced.value += 1
+
+    def setSpectrum(self, spectrum):
+
+        with self.lock:
+            self.y[:] = spectrum
+            self.numReplaced.value += 1
+
+    def resizeXAxis(self, newXAxisLength):
+
+        pass
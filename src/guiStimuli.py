@@ -0,0 +1,201 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import simpleaudio as sa
+
+try:
+    import sounddevice # Optional, lets stimuli be streamed a block at a time, without it they're generated whole and played by simpleaudio
+except ImportError:
+    sounddevice = None
+
+samplingFreq = 48000 # Audio output rate of every stimulus
+
+# Identifies a stimulus by everything that changes its samples, params is a dict of the test's numeric parameters
+def stimulusKey(testName, params, length):
+
+    return (testName, length) + tuple(sorted(params.items()))
+
+# Size in bytes of the buffer generateStimulus returns for key
+def stimulusBytes(key):
+
+    return key[1] * samplingFreq * 4
+
+# Builds the float32 samples of the whole stimulus identified by key
+def generateStimulus(key):
+
+    return StimulusStream(key).read(key[1] * samplingFreq)
+
+# Generates a stimulus a block at a time, so any length of stimulus can be played with a constant amount of memory
+# Every sample is computed from its index since the onset (with the phases taken mod one cycle in integer arithmetic), so blocks join up
+# exactly and the time axis is exactly 1/samplingFreq per sample however long the stimulus runs
+class StimulusStream():
+
+    def __init__(self, key):
+
+        self.key = key
+        self.testName, self.length, self.params = key[0], key[1], dict(key[2:])
+        if self.testName not in ["clicks", "pureTone", "whiteNoise"]:
+            raise ValueError("No stimulus for test " + self.testName)
+
+        self.numFrames = self.length * samplingFreq
+        self.noise = np.random.default_rng() # Keeps running across repetitions, so each one gets fresh noise
+        self.reset()
+
+    # Rewinds to the onset, called before every repetition so the modulation always starts at the same phase
+    def reset(self):
+
+        self.position = 0
+
+    # Frames left before the end of the stimulus
+    def remaining(self):
+
+        return self.numFrames - self.position
+
+    # Returns the next (up to) numFrames float32 samples
+    def read(self, numFrames):
+
+        n = np.arange(self.position, self.position + min(numFrames, self.remaining()), dtype=np.int64)
+        self.position += len(n)
+
+        if self.testName == "clicks":
+            # One sample click at the start of every period, the period doesn't need to be a whole number of samples
+            return ((n * self.params["clickFreq"]) % samplingFreq < self.params["clickFreq"]).astype(np.float32)
+
+        amPiece = self.cosine(n, self.params["amFreq"])
+        if self.testName == "pureTone":
+            carrierPiece = self.cosine(n, self.params["carrierFreq"])
+        else:
+            carrierPiece = self.noise.normal(0, 0.5, size=len(n)) # Made std 0.5 because it kills my ears less but I don't know the "correct" value
+        return (self.params["carrierAmp"] + self.params["modAmp"] * amPiece * carrierPiece).astype(np.float32)
+
+    # cos(2 pi freq t) at each sample index n, freq is a whole number of Hz so the phase can be wrapped exactly
+    @staticmethod
+    def cosine(n, freq):
+
+        return np.cos(2 * np.pi * ((n * freq) % samplingFreq) / samplingFreq)
+
+# Opens a StreamingOutput, returns None if sounddevice isn't installed or there's no output device to open
+def openStreamingOutput():
+
+    if sounddevice is None:
+        print("sounddevice isn't installed, playing whole stimuli through simpleaudio (each is generated in full, 'pip install sounddevice' to stream them)")
+        return None
+    try:
+        return StreamingOutput()
+    except Exception as e:
+        print("Audio streaming unavailable, playing whole stimuli instead: " + str(e))
+        return None
+
+# Audio output that plays StimulusStreams a block at a time from the audio callback, memory use doesn't depend on the stimulus length
+# The device is kept running (playing silence between stimuli) so starting a stimulus never waits for it to open
+class StreamingOutput():
+
+    def __init__(self, blockSize=1024):
+
+        self.lock = threading.Lock() # Held while the callback reads a block or the GUI swaps the stream
+        self.stimulusStream = None # Stream currently playing, None while silent
+        self.output = sounddevice.OutputStream(samplerate=samplingFreq, channels=1, dtype="float32", blocksize=blockSize, callback=self.fillBlock)
+        self.output.start()
+
+    # Starts stimulusStream from its onset, replacing anything still playing
+    def play(self, stimulusStream):
+
+        with self.lock:
+            stimulusStream.reset()
+            self.stimulusStream = stimulusStream
+
+    def stop(self):
+
+        with self.lock:
+            self.stimulusStream = None
+
+    # Audio callback, fills outdata with the next block of the playing stream and silence after it
+    def fillBlock(self, outdata, frames, time, status):
+
+        with self.lock:
+            block = self.stimulusStream.read(frames) if self.stimulusStream else np.zeros(0, dtype=np.float32)
+            if self.stimulusStream and self.stimulusStream.remaining() == 0:
+                self.stimulusStream = None
+        outdata[:len(block), 0] = block
+        outdata[len(block):] = 0
+
+# Keeps recently used stimuli so repetitions (and repeated tests) don't regenerate them on the GUI thread
+# When streaming only the StimulusStream (a few numbers of state) is kept per stimulus and shared by every repetition
+# Otherwise whole buffers are generated by a worker thread as soon as they're asked for with prepare, the least recently used are evicted past maxBytes
+class StimulusCache():
+
+    def __init__(self, streaming, maxBytes=64 * 2**20):
+
+        self.streaming = streaming
+        self.maxBytes = maxBytes
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.entries = OrderedDict() # Key to future of the samples (or to the StimulusStream when streaming), least recently used first
+
+    # Starts generating the stimulus for key in the background if it isn't cached already
+    def prepare(self, key):
+
+        if self.streaming:
+            if key not in self.entries:
+                self.entries[key] = StimulusStream(key)
+            return
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = self.executor.submit(generateStimulus, key)
+        self.evict()
+
+    # Returns the StimulusStream for key, only used when streaming
+    def getStream(self, key):
+
+        self.prepare(key)
+        return self.entries[key]
+
+    # Returns the samples for key, only waits if it's still being generated (or generates it if it was never prepared)
+    def get(self, key):
+
+        self.prepare(key)
+        return self.entries[key].result()
+
+    # Drops the least recently used stimuli until the cache fits in maxBytes, the newest is always kept
+    def evict(self):
+
+        totalBytes = sum(stimulusBytes(key) for key in self.entries)
+        while totalBytes > self.maxBytes and len(self.entries) > 1:
+            key, future = self.entries.popitem(last=False)
+            future.cancel() # Only stops it if it hasn't started yet
+            totalBytes -= stimulusBytes(key)
+
+# Plays stimuli the best way available, streamed a block at a time through a StreamingOutput or as whole cached buffers through simpleaudio
+class StimulusPlayer():
+
+    def __init__(self):
+
+        self.output = openStreamingOutput() # None when whole buffers are played
+        self.cache = StimulusCache(self.output is not None)
+
+    # Gets the stimulus for key ready ahead of playing it
+    def prepare(self, key):
+
+        self.cache.prepare(key)
+
+    def play(self, key):
+
+        if self.output:
+            self.output.play(self.cache.getStream(key))
+        else:
+            sa.play_buffer(self.cache.get(key), 1, 4, samplingFreq)
+
+    # Cuts off a streamed stimulus, buffers already handed to simpleaudio play to the end
+    def stop(self):
+
+        if self.output:
+            self.output.stop()
+
+    # Plays a moment of silence to wake the audio device up, the first sound after it's been idle can start late
+    # A StreamingOutput never goes idle so it doesn't need this
+    def prewarm(self):
+
+        if self.output is None:
+            sa.play_buffer(np.zeros(samplingFreq // 10, dtype=np.float32), 1, 4, samplingFreq)
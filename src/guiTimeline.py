@@ -0,0 +1,143 @@
+import sys, threading
+from time import monotonic
+import numpy as np
+
+# Prompt shown during each phase, phases are named the same as the events marked when they start
+phaseTexts = {
+    "startDelay": "Wait for test to start...", "endDelay": "Wait for test to end...",
+    "rest": "Rest", "blink": "Blink", "eyesOpen": "Eyes Open", "eyesClosed": "Eyes Closed", "listen": "Listen",
+}
+
+# The (rest, cue) phases that make up one repetition of each test
+testPhases = {
+    "eyeBlinks": ("rest", "blink"), "alpha": ("eyesOpen", "eyesClosed"),
+    "clicks": ("rest", "listen"), "pureTone": ("rest", "listen"), "whiteNoise": ("rest", "listen"),
+}
+
+# One phase of a timeline, fired at offset seconds after the timeline starts
+class Cue():
+
+    def __init__(self, offset, duration, phase, beep=False, stimulusKey=None, amFreq=None):
+
+        self.offset = offset
+        self.duration = duration # 0 for the testStart and testStop markers, which only mark events
+        self.phase = phase
+        self.text = phaseTexts.get(phase, phase)
+        self.beep = beep # Whether a beep is played at the start of the phase
+        self.stimulusKey = stimulusKey # guiStimuli key of the stimulus played at the start of the phase, None for no stimulus
+        self.amFreq = amFreq # Frequency the test's response is expected at, set on testStart markers of ASSR tests
+
+# The whole sequence of phases of a test (or of a protocol of several tests) worked out before it starts, so every transition has a fixed time from the start
+class Timeline():
+
+    def __init__(self):
+
+        self.cues = []
+        self.duration = 0 # Seconds from the start to the end of the last phase
+
+    # Adds a phase after everything already in the timeline, phases with no duration are left out
+    def addPhase(self, phase, duration, beep=False, stimulusKey=None):
+
+        if duration > 0:
+            self.cues.append(Cue(self.duration, duration, phase, beep, stimulusKey))
+            self.duration += duration
+
+    # Adds every phase of a test between testStart and testStop markers, same parameters as the cue system's test settings (lengths in seconds)
+    # cueAudio beeps at the start of each phase of the eye blink and alpha tests, stimulusKey is played at the start of each listen phase
+    def addTest(self, testName, startDelay, repetitions, cuePhaseLength, restLength, endDelay, cueAudio=False, stimulusKey=None, amFreq=None):
+
+        restPhase, cuePhase = testPhases[testName]
+        self.cues.append(Cue(self.duration, 0, "testStart", amFreq=amFreq))
+        self.addPhase("startDelay", startDelay)
+        for _ in range(repetitions):
+            self.addPhase(restPhase, restLength, beep=cueAudio)
+            self.addPhase(cuePhase, cuePhaseLength, beep=cueAudio, stimulusKey=stimulusKey)
+        self.addPhase("endDelay", endDelay)
+        self.cues.append(Cue(self.duration, 0, "testStop"))
+
+    # Keys of every stimulus the timeline plays, so they can be prepared before it starts
+    def stimulusKeys(self):
+
+        return list(dict.fromkeys(cue.stimulusKey for cue in self.cues if cue.stimulusKey is not None))
+
+# Carries out a cue at its deadline, shared by the cue system and the headless protocol runner
+# Sets the frequency the response is looked for at (if amFreq is given), marks the cue's events and plays its sounds
+def performCue(cue, eventRecorder, stimulusPlayer, beepWav, amFreq=None):
+
+    if cue.amFreq is not None and amFreq is not None:
+        amFreq.value = cue.amFreq
+    eventRecorder.mark(cue.phase)
+    if cue.beep:
+        beepWav.play()
+        eventRecorder.mark("beep")
+    if cue.stimulusKey is not None:
+        stimulusPlayer.play(cue.stimulusKey)
+        eventRecorder.mark(cue.stimulusKey[0])
+
+# Runs a Timeline on its own thread, calling fireCue(cue) at each cue's deadline and finished() at the end
+# Deadlines are absolute monotonic times from the start, so a late transition doesn't push back the ones after it, and the thread sleeps
+# until just before each deadline then spins, so transitions fire within a fraction of a ms whatever the GUI is doing
+class CueScheduler():
+
+    def __init__(self, timeline, fireCue, finished):
+
+        self.timeline = timeline
+        self.fireCue = fireCue # Called on the scheduler thread, anything touching Qt widgets has to be passed to the GUI thread with a signal
+        self.finished = finished
+        self.spinSeconds = 0.002 # Sleeping can wake up a few ms late, so the last part of every wait is spent polling the clock
+        self.stopEvent = threading.Event()
+        self.lateness = [] # Seconds each cue fired after its deadline
+        self.startTime = None
+        self.done = False # Set once the whole timeline has run, as opposed to being stopped
+        self.thread = None
+
+    def start(self):
+
+        self.startTime = monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Stops the timeline, nothing more is fired after this returns
+    # Waits for a cue already past its deadline to finish firing, which is short as fireCue only plays sounds, marks events and emits signals
+    def stop(self):
+
+        self.stopEvent.set()
+        if self.thread is not None and self.thread is not threading.current_thread(): # finished() can stop it from its own thread
+            self.thread.join()
+
+    def run(self):
+
+        # Other threads are made to hand over the GIL sooner while the timeline runs, so a busy GUI thread can't hold up a deadline for long
+        switchInterval = sys.getswitchinterval()
+        try:
+            sys.setswitchinterval(0.0005)
+            for cue in self.timeline.cues:
+                deadline = self.startTime + cue.offset
+                if not self.waitUntil(deadline):
+                    return
+                self.lateness.append(monotonic() - deadline)
+                self.fireCue(cue)
+            if self.waitUntil(self.startTime + self.timeline.duration):
+                self.done = True
+                self.finished()
+        finally:
+            sys.setswitchinterval(switchInterval)
+
+    # Returns once monotonic time reaches deadline (True) or the scheduler is stopped (False)
+    def waitUntil(self, deadline):
+
+        remaining = deadline - monotonic() - self.spinSeconds
+        if remaining > 0 and self.stopEvent.wait(remaining):
+            return False
+        while monotonic() < deadline:
+            if self.stopEvent.is_set():
+                return False
+        return not self.stopEvent.is_set()
+
+    # Summary of how late the cues fired, shown at the end of each test
+    def jitterReport(self):
+
+        if not self.lateness:
+            return "Cue timing: no cues fired"
+        lateness = np.array(self.lateness) * 1000
+        return "Cue timing: " + str(len(lateness)) + " cues, mean " + str(round(lateness.mean(), 3)) + "ms late, max " + str(round(lateness.max(), 3)) + "ms, std " + str(round(lateness.std(), 3)) + "ms"
@@ -0,0 +1,181 @@
+import os
+from csv import reader
+from PyQt5.QtWidgets import QMainWindow, QGridLayout, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QLabel
+from pyqtgraph import PlotWidget, mkPen
+
+import guiOptions
+import guiPlots
+import guiRecording
+
+# Window used to browse a finished binary recording with no device attached, launched with 'guiMain.py --view recording.bin'
+# Uses the same plot columns and dropdowns as the live GUI, the plots draw from per channel min/max pyramids cached next to the recording
+class ViewerWindow(QMainWindow):
+
+    def __init__(self, filename, configFilename):
+
+        super().__init__()
+
+        self.setWindowTitle("Ear EEG GUI Viewer - " + os.path.basename(filename))
+
+        if os.path.splitext(filename)[1] == ".csv": # Allows passing the csv recording, the binary copy is next to it
+            if not os.path.exists(guiRecording.binFilename(filename)): # Recordings from before binary copies were saved only have the csv
+                raise FileNotFoundError(filename + " has no binary copy yet, make one with 'python guiRecording.py convert " + filename + "'")
+            filename = guiRecording.binFilename(filename)
+
+        self.recordingMap = guiRecording.RecordingMap(filename)
+        sampleRate = self.recordingMap.header["sampleRate"]
+        numChannels = self.recordingMap.header["numChannels"]
+        pyramids = guiRecording.loadPyramids(filename) # Built in parallel on first open, memory mapped from the cache afterwards
+
+        # Same ("Graph Name", DataProcess) tuples as the live GUI, but every graph is one raw column of the recording
+        plotDataProcesses = []
+        for ch in range(numChannels):
+            for idx, columnName in enumerate(["EEG", "I", "Q"]):
+                recordingColumn = RecordingColumn(self.recordingMap, pyramids[ch], 1 + 3 * ch + idx, idx, sampleRate)
+                plotDataProcesses.append(("Ch " + str(ch) + " " + columnName, recordingColumn))
+
+        layout = ViewerLayout(plotDataProcesses, configFilename)
+        layout.addWidget(QLabel(filename + ": " + str(len(self.recordingMap.rows)) + " packets, " + str(round(len(self.recordingMap.rows) / sampleRate, 1)) + "s"), 2, 0)
+
+        mainWidget = QWidget()
+        mainWidget.setLayout(layout)
+        self.setCentralWidget(mainWidget)
+
+# Plot columns and their dropdowns, set up the same way as CustomGridLayout but without any of the acquisition options
+class ViewerLayout(QGridLayout):
+
+    def __init__(self, plotDataProcesses, configFilename):
+
+        super().__init__()
+
+        labels = [str(d[0]) for d in plotDataProcesses]
+        maxNumPlots = min(8, int(len(plotDataProcesses) / 2))
+
+        # Uses the saved live layout where it fits this recording, otherwise the default 2x2
+        plotLayout = []
+        if os.path.exists(configFilename):
+            with open(configFilename, 'r') as config:
+                plotLayout = [[int(plotNum) for plotNum in plotCol] for plotCol in reader(config)]
+        if len(plotLayout) != 2 or any(plotNum >= len(plotDataProcesses) for col in plotLayout for plotNum in col):
+            plotLayout = [[0,1],[2,3]]
+
+        plotWidgetPool = ViewerPlotWidgetPool()
+
+        current = []
+        initalPlots = []
+        plotDropdowns = []
+        for column in plotLayout:
+            current.append([plotDataProcesses[plotNum] for plotNum in column])
+            initalPlots.append([plotWidgetPool.acquire(plotDataProcesses[plotNum][1], plotDataProcesses[plotNum][0]) for plotNum in column])
+            dropdowns = []
+            for plotNum in column:
+                dd = QComboBox()
+                dd.addItems(labels)
+                dd.setCurrentIndex(plotNum)
+                dropdowns.append(dd)
+            plotDropdowns.append(dropdowns)
+
+        plotColumn0 = guiPlots.PlotColumn(initalPlots[0], 0, maxNumPlots, plotWidgetPool)
+        plotColumn1 = guiPlots.PlotColumn(initalPlots[1], 1, maxNumPlots, plotWidgetPool)
+
+        # There is nothing to start or stop when viewing a recording, so no running value is needed
+        columnDropdowns0 = guiOptions.ColumnDropdowns(None, plotWidgetPool, plotDropdowns[0], plotColumn0, plotDataProcesses, labels, current, maxNumPlots)
+        columnDropdowns1 = guiOptions.ColumnDropdowns(None, plotWidgetPool, plotDropdowns[1], plotColumn1, plotDataProcesses, labels, current, maxNumPlots)
+        current.append([columnDropdowns0, columnDropdowns1])
+
+        combindedPlotColumnLayout = QHBoxLayout()
+        combindedPlotColumnLayout.addWidget(plotColumn0)
+        combindedPlotColumnLayout.addWidget(plotColumn1)
+
+        columnDropdownsLayout = QVBoxLayout()
+        columnDropdownsLayout.addWidget(columnDropdowns0)
+        columnDropdownsLayout.addWidget(columnDropdowns1)
+
+        self.addLayout(combindedPlotColumnLayout, 0, 0)
+        self.addLayout(columnDropdownsLayout, 1, 0)
+
+# One column of a binary recording, stands in for a DataProcess in the plot dropdowns
+class RecordingColumn():
+
+    def __init__(self, recordingMap, pyramid, column, pyramidColumn, sampleRate):
+
+        self.recordingMap = recordingMap
+        self.pyramid = pyramid
+        self.column = column # Column in the recording rows
+        self.pyramidColumn = pyramidColumn # Column in the channel's pyramid
+        self.sampleRate = sampleRate
+
+    # A recording is already computed, so there is nothing to start or stop
+    def subscribe(self):
+
+        pass
+
+    def unsubscribe(self):
+
+        pass
+
+    # Returns (time, value) arrays for the time range [t0, t1) seconds with about maxPoints points
+    def getRange(self, t0, t1, maxPoints):
+
+        x, y = self.pyramid.getEnvelope(self.recordingMap.rows[:, self.column], self.pyramidColumn, int(t0 * self.sampleRate), int(t1 * self.sampleRate) + 1, maxPoints)
+        return x / self.sampleRate, y
+
+    def duration(self):
+
+        return len(self.recordingMap.rows) / self.sampleRate
+
+# Pannable/zoomable plot of a RecordingColumn, redraws only the visible range whenever the view changes
+class RecordingPlotWidget(PlotWidget):
+
+    def __init__(self, recordingColumn, name):
+
+        super().__init__()
+        self.setBackground('w')
+        self.setMouseEnabled(x=True, y=False) # Drag to pan and scroll to zoom along the time axis
+        self.pen = mkPen(color=(0,0,0), width=1)
+        self.data_line = self.plot([], [], pen=self.pen)
+        self.getPlotItem().getViewBox().sigXRangeChanged.connect(self.redraw)
+        self.getPlotItem().getViewBox().sigResized.connect(self.redraw)
+
+        self.bind(recordingColumn, name)
+
+    # Same interface as CustomPlotWidget.bind, lets the pool reuse the widget for another column
+    def bind(self, recordingColumn, name):
+
+        self.recordingColumn = recordingColumn
+        self.setTitle(name)
+        self.redraw()
+
+    def redraw(self):
+
+        (t0, t1), _ = self.getPlotItem().getViewBox().viewRange()
+        maxPoints = 2 * max(1, int(self.getPlotItem().getViewBox().width()))
+        self.data_line.setData(*self.recordingColumn.getRange(t0, t1, maxPoints))
+
+# Same interface as PlotWidgetPool but for RecordingPlotWidgets, all plots share one linked time axis so they navigate together
+class ViewerPlotWidgetPool():
+
+    def __init__(self):
+
+        self.parked = []
+        self.masterPlot = None # Every plot's x axis is linked to this one
+
+    def acquire(self, recordingColumn, name):
+
+        if self.parked:
+            plot = self.parked.pop()
+            plot.bind(recordingColumn, name)
+        elif self.masterPlot is None:
+            plot = RecordingPlotWidget(recordingColumn, name)
+            plot.setXRange(0, recordingColumn.duration(), padding=0) # Starts showing the whole recording
+            self.masterPlot = plot
+        else:
+            plot = RecordingPlotWidget(recordingColumn, name)
+            plot.setXLink(self.masterPlot)
+        return plot
+
+    def release(self, plot):
+
+        plot.setParent(None)
+        plot.hide() # PlotColumn shows it again once it's back in a layout
+        self.parked.append(plot)
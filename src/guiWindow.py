@@ -0,0 +1,314 @@
+import os
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from csv import reader, writer
+from serial.tools import list_ports
+import multiprocessing as mp
+from PyQt5.QtWidgets import QApplication, QMainWindow, QGridLayout, QVBoxLayout, QHBoxLayout, QWidget, QComboBox
+
+import guiAcquisition
+import guiData
+import guiDataProcesses
+import guiEpochs
+import guiEvents
+import guiOptions
+import guiPlots
+import guiScrollback
+import guiSettings
+import guiSpectral
+
+# The main window of the GUI, doesn't include the layout and elements inside
+class MainWindow(QMainWindow):
+
+    # Performs most non-gui/visual startup tasks
+    def __init__(self, commandLinePort, startupTimer):
+
+        super().__init__()
+        self.startupTimer = startupTimer
+
+        self.setWindowTitle("Ear EEG GUI")
+
+        numChannels = guiSettings.numChannels # Acquisition settings are shared with the headless runner and offline tools, see guiSettings
+        sampleRate = guiSettings.sampleRate
+        vid = 0x1915 # Nordic device vendor id, used for auto connect, change if desired connectionb device changes
+        pid = 0x521A # Corrosponding product id, use same as vendor id
+        configFilename = "guiConfig.csv" # Filename from which to save and load plot configurations, regenerated automatically on deletion
+        startupCommandsFilename = "startupCommands.txt" # Filename from which to run commands automatically on connection, step skipped if file not found
+        regDumpFilename = "regDump.txt" # Filename in which to append dumped registers
+
+        # List of all DataProcesses backends that be shown as graphs
+        # Contains ("Graph Name", DataProcess) tuples
+        plotDataProcesses = []
+
+        running = mp.Value('i', False) # Controls whether the DataProcesses update and CustomGraphWidgets redraw themselves across all processes
+        amFreq = mp.Value('d', 40) # AM/click frequency of the current ASSR test, set by the cue system and tracked by the spectral plots
+
+        # Sets port to read data from to command line input if entered
+        if commandLinePort:
+            port = commandLinePort
+        # If no command line argument, port is found automatically based on device and vendor info
+        else:
+            # port = "../EMULATOR/ttyGUI" # Hardcoded port formulator, if so comment out following block
+            # port = "/dev/cu.usbmodem0000000000001" Used to manually set port, if so comment out following block
+            set = False
+            for device in list_ports.comports():
+                if device.vid == vid and device.pid == pid:
+                    port = device.device
+                    print("Correct port found to be " + port + ", connecting...")
+                    set = True
+            # If no port with the correct vendor and device id is found, it falls back to a preset port
+            if not set:
+                port = "/dev/cu.usbmodem0000000000001"
+                print("Auto connection failed, no device with correct vendor and product id found, reverting to default: " + port)
+        startupTimer.mark("find port")
+        
+        # Holds the current packet id and data of every channel, used by DataProcesses to generate the graph data for all graphs
+        # Initalized to 0s, a sequence counter keeps all data and the corresponding packet id consistent without locking
+        latestSnapshot = guiAcquisition.LatestSnapshot(numChannels)
+
+        # Keeps the last rawBufferSeconds of raw packets so graphs can be backfilled the moment they're selected
+        rawRingBuffer = guiAcquisition.RawRingBuffer(numChannels, guiSettings.rawBufferSeconds * sampleRate)
+
+        # Managers generate the multiprocessing objects shared with the graph processes, each is its own server process so they're started together
+        # Managers have an internal limit on how many objects they can generate simultaneously, multiple needed to avoid occasional crashes
+        with ThreadPoolExecutor(3) as executor:
+            self.manager1, self.manager2, self.manager3 = executor.map(lambda _: mp.Manager(), range(3))
+        startupTimer.mark("managers")
+
+        # Bounded queue used to send data from the SerialReader to the SaveDataWriter, what happens when it fills is set by saveQueuePolicy
+        saveDataQueue = guiAcquisition.SaveQueue(guiSettings.saveQueueSeconds * sampleRate, numChannels, guiSettings.saveQueuePolicy)
+
+        connectionPipe, sRConnectionPipe = mp.Pipe() # Sends a 1 to let main processes know that the device is successfully connected
+        commandWriterPipe, sRCommandWriterPipe = mp.Pipe() # Used to send commands from the chat window (main process) to the SerialReader (handles chip interactions)
+        commandResponsePipe, sRCommandResponsePipe = mp.Pipe() # Used to send the chip response from commands from SerialReader to the chat window
+
+        # Creates SerialReader object to read data from serial port "port", populate latestSnapshot, and save the data to saveDataQueue
+        # The SerialReader update function runs on a different process and handles all interactions with the chip (data and commands)
+        serialReader = guiAcquisition.SerialReader(port, numChannels, latestSnapshot, rawRingBuffer, saveDataQueue, sRConnectionPipe, sRCommandWriterPipe, commandResponsePipe)
+        self.serialReaderProcess = mp.Process(target=serialReader.startSerialReader)
+        self.serialReaderProcess.daemon = True
+        self.serialReaderProcess.start() # Started before anything else so it's connecting to the device while the rest of startup runs
+        startupTimer.mark("serial reader")
+
+        xAxisLength = 100 # Default length of the xAxis, repersents number of packets so depending on what % of packets of graphed, corresponding time changes
+
+        # Each graph's post-processing process (which then sends data to its graph) is only started when the graph is first shown
+        for i in range(numChannels): # Each channel has three different post-processes applied
+            managedX = self.manager1.list() # List of the most recent X values, updated by data process then used by the graph
+            managedY = self.manager1.list() # List of the most recent X values, updated by data process then used by the graph
+            managedAxisLen = mp.Value('i', xAxisLength) # Shared xAxis length between main process (updates this value) and data process (uses this value)
+            eegDataProcess = guiDataProcesses.EEGDataProcess(running, latestSnapshot, managedX, managedY, managedAxisLen, rawRingBuffer, i % numChannels)
+            eegDataProcess.launcher = guiDataProcesses.ProcessLauncher(eegDataProcess.startUpdateData) # Runs the while loop that will check for new data, once the graph is first shown
+
+            plotDataProcesses.append(("Ch " + str(i) + " EEG", eegDataProcess)) # Adds name and data process to the possible graphs
+
+            managedX = self.manager2.list()
+            managedY = self.manager2.list()
+            managedAxisLen = mp.Value('i', xAxisLength)
+            iQMagDataProcess = guiDataProcesses.IQMagDataProcess(running, latestSnapshot, managedX, managedY, managedAxisLen, rawRingBuffer, i % numChannels)
+            iQMagDataProcess.launcher = guiDataProcesses.ProcessLauncher(iQMagDataProcess.startUpdateData)
+
+            plotDataProcesses.append(("Ch " + str(i) + " mag(I&Q)", iQMagDataProcess))
+
+            managedX = self.manager3.list()
+            managedY = self.manager3.list()
+            managedAxisLen = mp.Value('i', xAxisLength)
+            iQPhaseDataProcess = guiDataProcesses.IQPhaseDataProcess(running, latestSnapshot, managedX, managedY, managedAxisLen, rawRingBuffer, i % numChannels)
+            iQPhaseDataProcess.launcher = guiDataProcesses.ProcessLauncher(iQPhaseDataProcess.startUpdateData)
+
+            plotDataProcesses.append(("Ch " + str(i) + " phase(I&Q)", iQPhaseDataProcess))
+
+        startupTimer.mark("channel graphs")
+
+        # One process computes the spectra of every channel together, its traces (psd, band powers, AM power) are added after the per channel graphs
+        # It's started when the first of them is shown
+        spectralLists = [(self.manager2.list(), self.manager2.list()) for _ in range(guiSpectral.SpectralDataProcess.numTraces(numChannels))]
+        spectralDataProcess = guiSpectral.SpectralDataProcess(running, rawRingBuffer, sampleRate, amFreq, spectralLists, xAxisLength)
+        spectralLauncher = guiDataProcesses.ProcessLauncher(spectralDataProcess.startUpdateData)
+        for _, trace in spectralDataProcess.getPlotDataProcesses():
+            trace.launcher = spectralLauncher
+
+        plotDataProcesses.extend(spectralDataProcess.getPlotDataProcesses())
+
+        # One process averages every channel around the cue onsets it's sent by the EventRecorder, its traces are added last
+        # It always runs, as events have to be averaged as they happen whether or not they're being watched
+        epochEventQueue = self.manager3.Queue()
+        epochLists = [(self.manager3.list(), self.manager3.list(), self.manager3.list()) for _ in range(guiEpochs.EpochDataProcess.numTraces(numChannels))]
+        snrLists = [(self.manager3.list(), self.manager3.list()) for _ in range(guiEpochs.EpochDataProcess.numTraces(numChannels))]
+        epochDataProcess = guiEpochs.EpochDataProcess(running, rawRingBuffer, sampleRate, amFreq, epochEventQueue, epochLists, snrLists, xAxisLength)
+        assrEstimator = epochDataProcess.assrEstimator # Shares the latest SNR with the cue system
+        guiDataProcesses.ProcessLauncher(epochDataProcess.startUpdateData).start()
+
+        plotDataProcesses.extend(epochDataProcess.getPlotDataProcesses())
+        startupTimer.mark("spectral and epochs")
+
+        plotLayout = [] # 2d array containing arrays representing each column, inside inner arrays are the numbers corresponding with which graph to show
+        if os.path.exists(configFilename): # If a config file exists this block will load it and arrange the plots accordingly
+            print("Loading Config")
+            with open(configFilename, 'r') as config:
+                configReader = reader(config) # CSV reader
+                for plotCol in configReader:
+                    plotLayout.append([int(plotNum) for plotNum in plotCol]) # Converts to ints from strings and adds the row to the layout
+
+        if (not os.path.exists(configFilename)) or (not len(plotLayout) == 2): # There are two columns, this needs to be changed if the number of columns changes
+            print("Config Missing or Broken, Regenerating")
+            plotLayout = [[0,1],[2,3]] # Default plot layout shows these four plots in a 2x2
+            with open(configFilename, 'w') as config:
+                configWriter = writer(config) # CSV writer
+                configWriter.writerows(plotLayout)
+
+        # Collects cue events, aligned to the packets being recorded, the cue system gives it this machine's audio latencies when it's opened
+        eventRecorder = guiEvents.EventRecorder(rawRingBuffer, sampleRate, epochEventQueue)
+
+        # Layout of the main window, used to create all the graphs and UI elements
+        layout = CustomGridLayout(running, amFreq, eventRecorder, assrEstimator, numChannels, sampleRate, plotDataProcesses, plotLayout, configFilename, connectionPipe, commandWriterPipe, startupCommandsFilename, sRCommandResponsePipe, saveDataQueue, xAxisLength, regDumpFilename)
+
+        # Puts the graphs and UI into the main window for display
+        mainWidget = QWidget()
+        mainWidget.setLayout(layout)
+        self.setCentralWidget(mainWidget)
+        startupTimer.mark("layout")
+
+        layout.startStop.connectionMade.connect(self.reportConnection)
+        self.saveDataWriter = layout.saveDataWriter
+
+    # Marks when the window is first drawn, called from the event loop straight after show
+    def reportShown(self):
+
+        self.startupTimer.mark("window shown")
+        self.startupTimer.report()
+
+    def reportConnection(self):
+
+        if self.startupTimer.enabled:
+            print("Device connected " + str(round(perf_counter() - self.startupTimer.startTime, 2)) + "s after launch")
+
+    # Function called on close of the main window
+    def closeEvent(self, _):
+
+        self.saveDataWriter.finish() # Packets still queued are written before the recording is closed
+        QApplication.closeAllWindows() # Used to close any extra windows (such as cue or save data) that may have been opened
+
+# The layout that fills the main window
+class CustomGridLayout(QGridLayout):
+
+    # Performs most gui-based/visual startup tasks
+    def __init__(self, running, amFreq, eventRecorder, assrEstimator, numChannels, sampleRate, plotDataProcesses, plotLayout, configFilename, connectionPipe, commandWriterPipe, startupCommandsFilename, sRCommandResponsePipe, saveDataQueue, xAxisLength, regDumpFilename):
+
+        self.parent = super() # Needed later to add elements to layout
+        self.parent.__init__()
+
+        
+        labels = [str(d[0]) for d in plotDataProcesses] # Extracts the names of the graphs for the dropdown menu
+
+        # Sets maximum number of plots that can be shown at once, one column can't ever show more than half the graphs or more than 8 graphs
+        normalMaxNumPlots = 8
+        maxNumPlots = min(normalMaxNumPlots, int(len(plotDataProcesses) / 2))
+
+        current = [] # 2d array containing arrays representing each column, contains current plot data process objects being shown, used to update plots from dropdown menu
+        initalPlots = [] # 2d array containing arrays representing each column, used to fill plot columns with intial plot objects
+        plotDropdowns = [] # 2d array containing arrays representing each column, contains dropdown menus corresponding with each graph containing all graph options
+
+        renderScheduler = guiPlots.RenderScheduler(running) # Redraws every plot on screen from a single timer
+        plotWidgetPool = guiPlots.PlotWidgetPool(running, renderScheduler) # Creates plots and reuses ones taken off screen
+
+        for column in plotLayout: 
+            # Each sublist repersents a column
+            currentSublist = []
+            initalPlotsSublist = []
+            plotDropdownsSublist = []
+
+            for plotNum in column: # This iterates through every plot that is to be shown on the inital layout
+                currentSublist.append(plotDataProcesses[plotNum]) # Keeps track of the corresponding data process for later use by the dropdown menu
+                plotDataProcesses[plotNum][1].subscribe() # Data processes only compute while a plot (or recording) is subscribed
+
+                plot = plotWidgetPool.acquire(plotDataProcesses[plotNum][1], plotDataProcesses[plotNum][0]) # Creates the plot from a DataProcess, it will update once the start button is clicked
+                initalPlotsSublist.append(plot) # Appends it to inital plots to be shown on screen
+
+                dd = QComboBox() # Creates the starting dropdown menue
+                dd.addItems(labels) # Adds the graph names to the dropdown menu
+                dd.setCurrentIndex(plotNum) # Sets the item that it should start on, must come before connecting 'currentIndexChanged'
+                plotDropdownsSublist.append(dd) # Appends it to plot dropdowns to be shown on screen
+
+            # Adds column worth of info to each overarching list
+            current.append(currentSublist)
+            initalPlots.append(initalPlotsSublist)
+            plotDropdowns.append(plotDropdownsSublist)
+                
+        # Creates a plot column from a list of plots, an index and the max number of plots
+        plotColumn0 = guiPlots.PlotColumn(initalPlots[0], 0, maxNumPlots, plotWidgetPool)
+        plotColumn1 = guiPlots.PlotColumn(initalPlots[1], 1, maxNumPlots, plotWidgetPool)
+
+        # Creates a section of dropdown menus corresponding to the plot column, allows for the user to select plots and UI to show correct plots
+        columnDropdowns0 = guiOptions.ColumnDropdowns(running, plotWidgetPool, plotDropdowns[0], plotColumn0, plotDataProcesses, labels, current, maxNumPlots)
+        columnDropdowns1 = guiOptions.ColumnDropdowns(running, plotWidgetPool, plotDropdowns[1], plotColumn1, plotDataProcesses, labels, current, maxNumPlots)
+
+        # Stacks the two column dropdown sections together vertically
+        columnDropdownsLayout = QVBoxLayout()
+        columnDropdownsLayout.addWidget(columnDropdowns0)
+        columnDropdownsLayout.addWidget(columnDropdowns1)
+
+        # Stacks the two plot columns together horizontally
+        combindedPlotColumnLayout = QHBoxLayout()
+        combindedPlotColumnLayout.addWidget(plotColumn0)
+        combindedPlotColumnLayout.addWidget(plotColumn1)
+
+        renderScheduler.start()
+
+        saveDataMenuButton = guiData.SaveDataMenuButton(running) # Creates the button used to pull up all data saving options
+
+        # Creates chat window with connections needed to send/recive data to/from chip and starts update to look for such data
+        chatWindow = guiOptions.ChatWindow(commandWriterPipe, startupCommandsFilename, sRCommandResponsePipe)
+        chatWindow.startUpdate()
+
+        # Creates object used to actually save the data, is a QWidget to be included in gui update loop, this also means it has to be created here so it can be added to the UI (below)
+        saveDataWriter = guiData.SaveDataWriter(running, numChannels, sampleRate, saveDataQueue, saveDataMenuButton, eventRecorder, chatWindow) 
+        saveDataWriter.startSaveDataWriter() # Not in its own process as implmentation would be complicated and it is the only demanding task on the main proces, prepares object to save data
+
+        regDump = guiOptions.RegDump(regDumpFilename, chatWindow) # Creates button to dump all registers to specified file
+
+        startStop = guiOptions.StartStop(running, connectionPipe, saveDataMenuButton, chatWindow, regDump) # Creates buttons to start/stop data stream
+
+        cueSystemButton = guiOptions.CueSystemButton(running, startStop, amFreq, eventRecorder, assrEstimator) # Creates button to pull up cue system menu
+
+        scrollbackButton = guiScrollback.ScrollbackButton(saveDataWriter) # Creates button to pull up a view of the whole current recording
+
+        xAxisResizer = guiOptions.XAxisResizer(plotDataProcesses, xAxisLength) # Creates area to resize x axis
+
+        layoutSaver = guiOptions.LayoutSaver(configFilename, columnDropdowns0, columnDropdowns1, chatWindow) # Creates button to save current layout
+
+        resetButton = guiOptions.PyserialReset(running, startStop, connectionPipe, chatWindow) # Creates button to reset pyserial connection
+
+        # All options buttons added into a row together
+        optionsRowLayout = QHBoxLayout()
+        optionsRowLayout.addWidget(saveDataMenuButton)
+        optionsRowLayout.addWidget(cueSystemButton)
+        optionsRowLayout.addWidget(scrollbackButton)
+        optionsRowLayout.addWidget(startStop)
+        optionsRowLayout.addWidget(xAxisResizer)
+        optionsRowLayout.addWidget(layoutSaver)
+        optionsRowLayout.addWidget(regDump)
+        optionsRowLayout.addWidget(resetButton)
+
+        # Adds together options buttons and column dropdowns
+        optionsLayout = QVBoxLayout()
+        optionsLayout.addLayout(optionsRowLayout)
+        optionsLayout.addLayout(columnDropdownsLayout)
+
+        # Adds chat box to side of buttons + dropdowns
+        optionsChatLayout = QHBoxLayout()
+        optionsChatLayout.addLayout(optionsLayout, 3) # The second param on this line/next line is the stretch. Thus 3/1 gives 75% of the space to the options and 25% to chat
+        optionsChatLayout.addWidget(chatWindow, 1)
+
+        # Adds plot columns and interactable GUI section to grid layout, currently only two things to add so same as QVBoxLayout but allows for more adaptability later
+        self.parent.addLayout(combindedPlotColumnLayout, 0, 0)
+        self.parent.addLayout(optionsChatLayout, 1, 0)
+        
+        self.parent.addWidget(saveDataWriter, 2, 0) # SaveDataWriter hides itself and is only attached to be in the event loop
+
+        current.append([columnDropdowns0, columnDropdowns1]) # Last item in current is list of ColumnDropdowns so they can reference each other
+
+        # Connects automatically as soon as the SerialReader finds the device, the window is usable in the meantime
+        self.startStop = startStop
+        self.saveDataWriter = saveDataWriter
+        startStop.waitForConnection("Automatic Connection Attempt Failed, still waiting for the device")